@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+End-to-end throughput benchmark of the collector -> transport -> handler
+pipeline.
+
+Synthetic collectors run in collector processes (or collector pools) like
+the server runs them and publish through their QueueHandler and the metric
+transport to a handler process feeding a handler doing nothing and a
+GraphiteHandler writing to a local TCP sink. Every metric carries the time it
+was created as its value, which gives the end-to-end latency wherever it ends
+up.
+
+Reported for the measured window, after a warm up:
+
+ * metrics/s received by each handler, against the rate offered
+ * end-to-end latency percentiles in ms, sampled by each handler
+ * CPU use and RSS of every process of the pipeline
+
+Examples:
+
+    ./benchmarks/pipeline.py --collectors 4 --metrics 20000 --interval 1
+    ./benchmarks/pipeline.py --transport ring_buffer -o batch=1000
+    ./benchmarks/pipeline.py --execution pool --interval 0.1 --json
+"""
+
+import json
+import logging
+import multiprocessing
+import optparse
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '..', 'src')))
+
+import configobj
+
+from diamond.collector import Collector
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.Handler import Handler
+from diamond.handler.queue import QueueHandler
+from diamond.utils.classes import load_dynamic_class
+from diamond.utils.dispatch import create_handler_worker
+from diamond.utils.scheduler import collector_pool_process
+from diamond.utils.scheduler import collector_process
+from diamond.utils.scheduler import handler_process
+from diamond.utils.telemetry import Histogram
+from diamond.utils.transport import MetricTransport
+from diamond.utils.transport import TRANSPORTS
+
+try:
+    CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = PAGE_SIZE = None
+
+
+class SyntheticCollector(Collector):
+    """
+    Publish `metrics` gauges per run, valued with the time of the run
+    """
+
+    def get_default_config(self):
+        config = super(SyntheticCollector, self).get_default_config()
+        config.update({
+            'path': 'synthetic',
+            'metrics': 1000,
+        })
+        return config
+
+    def process_config(self):
+        super(SyntheticCollector, self).process_config()
+        self.names = ['metric%d' % i
+                      for i in range(int(self.config['metrics']))]
+
+    def collect(self):
+        now = time.time()
+        self.publish_many([(name, now) for name in self.names], precision=6)
+
+
+class NullHandler(Handler):
+    """
+    Count the metrics and sample their latency, reporting both to the
+    benchmark on flush
+    """
+
+    def __init__(self, config=None, results=None, sample_every=100):
+        Handler.__init__(self, config)
+        self.results = results
+        self.sample_every = sample_every
+        self.count = 0
+        self.samples = []
+
+    def process(self, metric):
+        self.count += 1
+        if self.count % self.sample_every == 0:
+            self.samples.append(time.time() - metric.value)
+
+    def flush(self):
+        self.results.put((self.count, self.samples))
+        self.samples = []
+
+
+class Recorder(object):
+    """
+    Metrics counted and latencies sampled by one destination
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.start_count = 0
+        self.histogram = Histogram(size=10000)
+
+    def add(self, count, samples, cumulative=False):
+        with self.lock:
+            if cumulative:
+                self.count = count
+            else:
+                self.count += count
+            for sample in samples:
+                self.histogram.add(sample * 1000)
+
+    def start(self):
+        with self.lock:
+            self.start_count = self.count
+            self.histogram = Histogram(size=10000)
+
+    def result(self, duration):
+        with self.lock:
+            result = {
+                'metrics': self.count - self.start_count,
+                'metrics_per_sec': (self.count - self.start_count) / duration,
+            }
+            if self.histogram.count:
+                summary = self.histogram.summary()
+                for key in ('p50', 'p90', 'p99', 'max'):
+                    result['latency_%s_ms' % key] = summary[key]
+        return result
+
+
+class Sink(object):
+    """
+    A graphite plaintext TCP server counting lines, taking the latency of the
+    last line of every read
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.server.accept()[0]
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.read, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def read(self, conn):
+        while True:
+            try:
+                data = conn.recv(262144)
+            except socket.error:
+                break
+            if not data:
+                break
+            samples = []
+            end = data.rfind('\n')
+            start = data.rfind('\n', 0, end) + 1
+            if start > 0:
+                try:
+                    samples.append(time.time() -
+                                   float(data[start:end].split()[1]))
+                except (IndexError, ValueError):
+                    pass
+            self.recorder.add(data.count('\n'), samples)
+        conn.close()
+
+    def close(self):
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
+
+
+def run_collectors(config, producers, execution, threads, log):
+    """
+    Create the collectors in the process running them and run them. Unlike
+    in the server they are not created by the parent, which would have their
+    queue handlers flush into a stopped transport on exit.
+    """
+    collectors = []
+    for name, queue in producers:
+        handler = QueueHandler(config=config, queue=queue, log=log)
+        collectors.append(SyntheticCollector(config, [handler], name=name))
+    if execution == 'pool':
+        collector_pool_process(collectors, None, log, threads)
+    else:
+        collector_process(collectors[0], None, log)
+
+
+def get_process_stats(pid):
+    """
+    CPU seconds used so far and RSS in bytes of a process, from /proc
+    """
+    if CLOCK_TICKS is None:
+        return None, None
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # Skip past the command, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/%d/statm' % pid) as f:
+            rss = int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return None, None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss
+
+
+def get_processes():
+    processes = dict((p.pid, p.name) for p in multiprocessing.active_children())
+    processes[os.getpid()] = 'Benchmark (sink)'
+    return processes
+
+
+def parse_options(values):
+    options = {}
+    for value in values:
+        key, _, value = value.partition('=')
+        options[key.strip()] = value.strip()
+    return options
+
+
+def run(options):
+    log = logging.getLogger('diamond')
+
+    config = configobj.ConfigObj()
+    config['server'] = {
+        'metric_transport': options.transport,
+        'metric_batch_size': options.metric_batch_size,
+    }
+    config['collectors'] = {
+        'default': {
+            'hostname': 'bench',
+            'interval': options.interval,
+            'metrics': options.metrics,
+        },
+    }
+
+    transport = load_dynamic_class(
+        TRANSPORTS.get(options.transport, options.transport),
+        MetricTransport)(config['server'])
+
+    null = Recorder('NullHandler')
+    graphite = Recorder('GraphiteHandler')
+    sink = Sink(graphite)
+    sink.start()
+
+    handler_config = configobj.ConfigObj()
+    handler_config.update(parse_options(options.handler_options))
+    handler_config['host'] = '127.0.0.1'
+    handler_config['port'] = sink.port
+    results = multiprocessing.Queue()
+    handlers = [NullHandler(handler_config, results)]
+    if not options.no_graphite:
+        handlers.append(GraphiteHandler(handler_config))
+    workers = [create_handler_worker(handler, log) for handler in handlers]
+
+    process = multiprocessing.Process(
+        name='Handlers', target=handler_process,
+        args=(workers, transport, log))
+    process.daemon = True
+    process.start()
+
+    producers = []
+    for i in range(options.collectors):
+        name = 'SyntheticCollector%d' % i
+        config['collectors'][name] = {'path': 'synthetic%d' % i}
+        producers.append((name, transport.producer(name)))
+
+    if options.execution == 'pool':
+        groups = min(options.pools, len(producers))
+        groups = [('CollectorPool-%d' % i, producers[i::groups])
+                  for i in range(groups)]
+    else:
+        groups = [(producer_name, [(producer_name, queue)])
+                  for producer_name, queue in producers]
+    for name, group in groups:
+        process = multiprocessing.Process(
+            name=name, target=run_collectors,
+            args=(config, group, options.execution, options.threads, log))
+        process.daemon = True
+        process.start()
+
+    def drain():
+        while True:
+            try:
+                count, samples = results.get(block=False)
+            except Queue.Empty:
+                return
+            null.add(count, samples, cumulative=True)
+
+    time.sleep(options.warmup)
+    drain()
+    null.start()
+    graphite.start()
+    processes = get_processes()
+    start_stats = dict((pid, get_process_stats(pid)) for pid in processes)
+    start = time.time()
+
+    deadline = start + options.duration
+    while time.time() < deadline:
+        time.sleep(min(0.1, max(0, deadline - time.time())))
+        drain()
+
+    duration = time.time() - start
+    end_stats = dict((pid, get_process_stats(pid)) for pid in processes)
+
+    report = {
+        'transport': options.transport,
+        'execution': options.execution,
+        'collectors': options.collectors,
+        'offered_metrics_per_sec': (options.collectors * options.metrics /
+                                    options.interval),
+        'duration': duration,
+        'handlers': {null.name: null.result(duration)},
+        'processes': {},
+    }
+    if not options.no_graphite:
+        report['handlers'][graphite.name] = graphite.result(duration)
+
+    for pid, name in processes.iteritems():
+        cpu_start, _ = start_stats[pid]
+        cpu_end, rss = end_stats[pid]
+        if cpu_start is None or cpu_end is None:
+            continue
+        report['processes']['%s (%d)' % (name, pid)] = {
+            'cpu_percent': 100 * (cpu_end - cpu_start) / duration,
+            'rss_bytes': rss,
+        }
+
+    for child in multiprocessing.active_children():
+        child.terminate()
+    sink.close()
+    return report
+
+
+def print_report(report):
+    print ('%(collectors)d collectors, %(execution)s execution, %(transport)s '
+           'transport, %(offered_metrics_per_sec)d metrics/s offered, '
+           '%(duration).1fs measured' % report)
+    print
+    print '%-16s %12s %10s %10s %10s %10s' % (
+        'handler', 'metrics/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    for name, result in sorted(report['handlers'].iteritems()):
+        print '%-16s %12d %10s %10s %10s %10s' % (
+            (name, result['metrics_per_sec']) + tuple(
+                '%.1f' % result[key] if key in result else '-'
+                for key in ('latency_p50_ms', 'latency_p90_ms',
+                            'latency_p99_ms', 'latency_max_ms')))
+    print
+    print '%-32s %8s %10s' % ('process', 'cpu %', 'rss MB')
+    for name, result in sorted(report['processes'].iteritems()):
+        print '%-32s %8.1f %10.1f' % (name, result['cpu_percent'],
+                                      result['rss_bytes'] / 1048576.0)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--collectors', type='int', default=4,
+                      help='Number of synthetic collectors')
+    parser.add_option('--metrics', type='int', default=10000,
+                      help='Metrics published by a collector per run')
+    parser.add_option('--interval', type='float', default=1.0,
+                      help='Seconds between the runs of a collector')
+    parser.add_option('--execution', choices=('process', 'pool'),
+                      default='process',
+                      help='Collector execution: process or pool')
+    parser.add_option('--pools', type='int', default=1,
+                      help='Pool processes for the pool execution')
+    parser.add_option('--threads', type='int', default=4,
+                      help='Threads of a pool process')
+    parser.add_option('--transport', default='manager',
+                      help='Metric transport: manager or ring_buffer')
+    parser.add_option('--metric-batch-size', type='int', default=1024,
+                      help='Metrics per batch put on the transport')
+    parser.add_option('-o', '--handler-option', dest='handler_options',
+                      action='append', default=[],
+                      help='key=value handler config, e.g. dispatch=thread')
+    parser.add_option('--no-graphite', action='store_true', default=False,
+                      help='Only feed the handler doing nothing')
+    parser.add_option('--warmup', type='float', default=3.0,
+                      help='Seconds to run before measuring')
+    parser.add_option('--duration', type='float', default=10.0,
+                      help='Seconds to measure')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='Print the report as JSON')
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    report = run(options)
+    if options.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
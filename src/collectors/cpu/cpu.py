@@ -184,10 +184,7 @@ class CPUCollector(diamond.collector.Collector):
                     self.config['xenfix'] = False
 
             # Publish Metric Derivative
-            for metric_name in metrics.keys():
-                self.publish(metric_name,
-                             metrics[metric_name],
-                             precision=2)
+            self.publish_many(metrics, precision=2)
             return True
 
         else:
@@ -199,66 +196,27 @@ class CPUCollector(diamond.collector.Collector):
             cpu_time = psutil.cpu_times(True)
             cpu_count = len(cpu_time)
             total_time = psutil.cpu_times()
+            metrics = {}
             for i in range(0, len(cpu_time)):
                 metric_name = 'cpu' + str(i)
-                self.publish(
-                    metric_name + '.user',
-                    self.derivative(metric_name + '.user',
-                                    cpu_time[i].user,
-                                    self.MAX_VALUES['user']),
-                    precision=2)
-
-                if hasattr(cpu_time[i], 'nice'):
-                    self.publish(
-                        metric_name + '.nice',
-                        self.derivative(metric_name + '.nice',
-                                        cpu_time[i].nice,
-                                        self.MAX_VALUES['nice']),
-                        precision=2)
-
-                self.publish(
-                    metric_name + '.system',
-                    self.derivative(metric_name + '.system',
-                                    cpu_time[i].system,
-                                    self.MAX_VALUES['system']),
-                    precision=2)
-
-                self.publish(
-                    metric_name + '.idle',
-                    self.derivative(metric_name + '.idle',
-                                    cpu_time[i].idle,
-                                    self.MAX_VALUES['idle']),
-                    precision=2)
+                for s in ('user', 'nice', 'system', 'idle'):
+                    if not hasattr(cpu_time[i], s):
+                        continue
+                    metrics[metric_name + '.' + s] = self.derivative(
+                        metric_name + '.' + s,
+                        getattr(cpu_time[i], s),
+                        self.MAX_VALUES[s])
 
             metric_name = 'total'
-            self.publish(
-                metric_name + '.user',
-                self.derivative(metric_name + '.user',
-                                total_time.user,
-                                self.MAX_VALUES['user']) / cpu_count,
-                precision=2)
-
-            if hasattr(total_time, 'nice'):
-                self.publish(
-                    metric_name + '.nice',
-                    self.derivative(metric_name + '.nice',
-                                    total_time.nice,
-                                    self.MAX_VALUES['nice']) / cpu_count,
-                    precision=2)
-
-            self.publish(
-                metric_name + '.system',
-                self.derivative(metric_name + '.system',
-                                total_time.system,
-                                self.MAX_VALUES['system']) / cpu_count,
-                precision=2)
-
-            self.publish(
-                metric_name + '.idle',
-                self.derivative(metric_name + '.idle',
-                                total_time.idle,
-                                self.MAX_VALUES['idle']) / cpu_count,
-                precision=2)
+            for s in ('user', 'nice', 'system', 'idle'):
+                if not hasattr(total_time, s):
+                    continue
+                metrics[metric_name + '.' + s] = self.derivative(
+                    metric_name + '.' + s,
+                    getattr(total_time, s),
+                    self.MAX_VALUES[s]) / cpu_count
+
+            self.publish_many(metrics, precision=2)
 
             self.publish('cpu_count', psutil.cpu_count())
 
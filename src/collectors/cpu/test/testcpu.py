@@ -34,14 +34,14 @@ class TestCPUCollector(CollectorTestCase):
 
     @patch('__builtin__.open')
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_open_proc_stat(self, publish_mock, open_mock):
         CPUCollector.PROC = '/proc/stat'
         open_mock.return_value = StringIO('')
         self.collector.collect()
         open_mock.assert_called_once_with('/proc/stat')
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_synthetic_data(self, publish_mock):
         patch_open = patch('__builtin__.open', Mock(return_value=StringIO(
             'cpu 100 200 300 400 500 0 0 0 0 0')))
@@ -67,7 +67,7 @@ class TestCPUCollector(CollectorTestCase):
             'total.user': 1.0
         })
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_real_data(self, publish_mock):
         CPUCollector.PROC = self.getFixturePath('proc_stat_1')
         self.collector.collect()
@@ -90,7 +90,7 @@ class TestCPUCollector(CollectorTestCase):
                            defaultpath=self.collector.config['path'])
         self.assertPublishedMany(publish_mock, metrics)
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_ec2_data(self, publish_mock):
         self.collector.config['interval'] = 30
         patch_open = patch('os.path.isdir', Mock(return_value=True))
@@ -116,7 +116,7 @@ class TestCPUCollector(CollectorTestCase):
 
         self.assertPublishedMany(publish_mock, metrics)
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_473(self, publish_mock):
         """
         No cpu value should ever be over 100
@@ -137,8 +137,7 @@ class TestCPUCollector(CollectorTestCase):
 
         totals = {}
 
-        for call in publish_mock.mock_calls:
-            call = call[1]
+        for call in self.getPublishedArgs(publish_mock):
             if call[0][:6] == 'total.':
                 continue
             if call[1] > 100:
@@ -202,7 +201,7 @@ class TestCPUCollectorNormalize(CollectorTestCase):
                  )
                 )
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_proc_stat(self, publish_mock):
         patch_open = patch('__builtin__.open', Mock(return_value=StringIO(
             "\n".join([self.input_dict_to_proc_string('', self.input_base),
@@ -231,9 +230,11 @@ class TestCPUCollectorNormalize(CollectorTestCase):
         self.assertPublishedMany(publish_mock, self.expected)
 
     @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     @patch('cpu.os')
     @patch('cpu.psutil')
-    def test_should_work_psutil(self, psutil_mock, os_mock, publish_mock):
+    def test_should_work_psutil(self, psutil_mock, os_mock, publish_mock,
+                                cpu_count_mock):
 
         os_mock.access.return_value = False
 
@@ -163,6 +163,7 @@ class DiskUsageCollector(diamond.collector.Collector):
             self.log.error('No diskspace metrics retrieved')
             return None
 
+        published = {}
         for key, info in results.iteritems():
             metrics = {}
             name = info['device']
@@ -277,4 +278,6 @@ class DiskUsageCollector(diamond.collector.Collector):
                 for key in metrics:
                     metric_name = '.'.join([info['device'], key]).replace(
                         '/', '_')
-                    self.publish(metric_name, metrics[key], precision=3)
+                    published[metric_name] = metrics[key]
+
+        self.publish_many(published, precision=3)
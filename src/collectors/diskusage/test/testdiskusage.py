@@ -52,7 +52,7 @@ class TestDiskUsageCollector(CollectorTestCase):
         return result
 
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_real_data(self, publish_mock):
 
         patch_open = patch(
@@ -89,7 +89,7 @@ class TestDiskUsageCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_verify_supporting_vda_and_xvdb(self, publish_mock):
         patch_open = patch(
             '__builtin__.open',
@@ -125,7 +125,7 @@ class TestDiskUsageCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_verify_supporting_md_dm(self, publish_mock):
         patch_open = patch(
             '__builtin__.open',
@@ -160,7 +160,7 @@ class TestDiskUsageCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_verify_supporting_disk(self, publish_mock):
         patch_open = patch(
             '__builtin__.open',
@@ -194,7 +194,7 @@ class TestDiskUsageCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_service_Time(self, publish_mock):
         patch_open = patch(
             '__builtin__.open',
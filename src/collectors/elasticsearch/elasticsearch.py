@@ -5,7 +5,7 @@ Collect the elasticsearch stats for the local node.
 
 Supports multiple instances. When using the 'instances'
 parameter the instance alias will be appended to the
-'path' parameter.
+'path' parameter. The instances are polled concurrently.
 
 #### Dependencies
 
@@ -28,7 +28,7 @@ import diamond.collector
 RE_LOGSTASH_INDEX = re.compile('^(.*)-\d{4}(\.\d{2}){2,3}$')
 
 
-class ElasticSearchCollector(diamond.collector.Collector):
+class ElasticSearchCollector(diamond.collector.AsyncCollector):
 
     def process_config(self):
         super(ElasticSearchCollector, self).process_config()
@@ -116,7 +116,8 @@ class ElasticSearchCollector(diamond.collector.Collector):
                 base64string = base64.standard_b64encode(
                     '%s:%s' % (self.config['user'], self.config['password']))
                 request.add_header("Authorization", "Basic %s" % base64string)
-            response = urllib2.urlopen(request)
+            response = urllib2.urlopen(request,
+                                       timeout=self.get_request_timeout())
         except Exception, err:
             self.log.error("%s: %s" % (url, err))
             return False
@@ -241,6 +242,11 @@ class ElasticSearchCollector(diamond.collector.Collector):
                                 index['primaries'])
 
     def collect_instance(self, alias, scheme, host, port):
+        metrics = self.get_instance_metrics(scheme, host, port)
+        if metrics:
+            self.publish_instance_metrics(alias, metrics)
+
+    def get_instance_metrics(self, scheme, host, port):
         result = self._get(scheme, host, port, '_nodes/_local/stats', 'nodes')
         if not result:
             return
@@ -417,8 +423,9 @@ class ElasticSearchCollector(diamond.collector.Collector):
         if 'indices' in self.config['stats']:
             self.collect_instance_index_stats(scheme, host, port, metrics)
 
-        #
-        # all done, now publishing all metrics
+        return metrics
+
+    def publish_instance_metrics(self, alias, metrics):
         for key in metrics:
             full_key = key
             if alias != '':
@@ -431,6 +438,12 @@ class ElasticSearchCollector(diamond.collector.Collector):
             return {}
 
         scheme = self.config['scheme']
-        for alias in sorted(self.instances):
-            (host, port) = self.instances[alias]
-            self.collect_instance(alias, scheme, host, port)
+        aliases = sorted(self.instances)
+        results = self.run_concurrently([
+            (self.get_instance_metrics, (scheme,) + self.instances[alias])
+            for alias in aliases])
+
+        # Publish from this thread once all instances answered
+        for alias, metrics in zip(aliases, results):
+            if metrics:
+                self.publish_instance_metrics(alias, metrics)
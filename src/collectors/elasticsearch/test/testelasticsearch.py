@@ -64,7 +64,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         self.collector.config['cluster'] = True
 
@@ -132,7 +132,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         self.collector.config['cluster'] = True
 
@@ -200,7 +200,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('logstash_indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         self.collector.config['logstash_mode'] = True
 
@@ -272,7 +272,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('logstash_hourly_indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         self.collector.config['logstash_mode'] = True
 
@@ -344,7 +344,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         urlopen_mock.start()
         self.collector.collect()
@@ -388,21 +388,23 @@ class TestElasticSearchCollector(CollectorTestCase):
         self.collector = ElasticSearchCollector(config, None)
         self.assertEqual(len(self.collector.instances), 2)
 
-        returns = [
-            self.getFixture('stats'),
-            self.getFixture('indices_stats'),
-            self.getFixture('stats2'),
-            self.getFixture('indices_stats2'),
-        ]
+        # The instances are polled concurrently, answer by host
+        returns = {
+            '10.10.10.201': [self.getFixture('stats'),
+                             self.getFixture('indices_stats')],
+            '10.10.10.202': [self.getFixture('stats2'),
+                             self.getFixture('indices_stats2')],
+        }
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda request, **kwargs: returns[
+                request.get_host().split(':')[0]].pop(0)))
 
         urlopen_mock.start()
         self.collector.collect()
         urlopen_mock.stop()
 
         # check how many fixtures were consumed
-        self.assertEqual(urlopen_mock.new.call_count, 4)
+        self.assertEqual(returns, {'10.10.10.201': [], '10.10.10.202': []})
 
         metrics = {
             'esprodata01.http.current': 1,
@@ -430,7 +432,7 @@ class TestElasticSearchCollector(CollectorTestCase):
             self.getFixture('indices_stats'),
         ]
         urlopen_mock = patch('urllib2.urlopen', Mock(
-            side_effect=lambda *args: returns.pop(0)))
+            side_effect=lambda *args, **kwargs: returns.pop(0)))
 
         urlopen_mock.start()
         self.collector.collect()
@@ -39,9 +39,13 @@ class TestHttpdCollector(CollectorTestCase):
 
         self.HTTPResponse = TestHTTPResponse()
 
-        httplib.HTTPConnection.request = Mock(return_value=True)
-        httplib.HTTPConnection.getresponse = Mock(
-            return_value=self.HTTPResponse)
+        patch.object(httplib.HTTPConnection, 'request',
+                     Mock(return_value=True)).start()
+        patch.object(httplib.HTTPConnection, 'getresponse',
+                     Mock(return_value=self.HTTPResponse)).start()
+
+    def tearDown(self):
+        patch.stopall()
 
     def test_import(self):
         self.assertTrue(HttpdCollector)
@@ -27,6 +27,9 @@ you to specify "java.lang:name=ParNew,type=GarbageCollector" (the raw name from
 jolokia) or "java.lang.name_ParNew.type_GarbageCollector" (the fixed name
 as used for output)
 
+The MBeans of the different domains are read concurrently, up to
+```concurrency``` requests at a time.
+
 If the ```regex``` flag is set to True, mbeans will match based on regular
 expressions rather than a plain textual match.
 
@@ -57,7 +60,7 @@ import urllib
 import urllib2
 
 
-class JolokiaCollector(diamond.collector.Collector):
+class JolokiaCollector(diamond.collector.AsyncCollector):
 
     LIST_URL = "/list"
 
@@ -98,6 +101,9 @@ class JolokiaCollector(diamond.collector.Collector):
                                    ' Default is "True',
             'jolokia_path': 'Path to jolokia.  typically "jmx" or "jolokia".'
                             ' Defaults to the value of "path" variable.',
+            'request_timeout': 'Timeout in seconds of a single request.'
+                               ' Defaults to 2/3 of the interval, at least'
+                               ' 2 seconds.',
         })
         return config_help
 
@@ -114,6 +120,7 @@ class JolokiaCollector(diamond.collector.Collector):
             'host': 'localhost',
             'port': 8778,
             'use_canonical_names': True,
+            'request_timeout': None,
         })
         return config
 
@@ -190,21 +197,30 @@ class JolokiaCollector(diamond.collector.Collector):
             if mbean in self.mbeans or mbeanfix in self.mbeans:
                 return True
 
+    def get_request_timeout(self):
+        if self.config['request_timeout'] is not None:
+            return float(self.config['request_timeout'])
+        # need some time to process the downloaded metrics, so that's why
+        # timeout is lower than the interval.
+        return max(2, float(self.config['interval']) * 2 / 3)
+
     def collect(self):
         if not self.domains:
             self._get_domains()
-        for domain in self.domains:
-            if domain not in self.IGNORE_DOMAINS:
-                obj = self._read_request(domain)
-                try:
-                    mbeans = obj['value'] if obj['status'] == 200 else {}
-                except KeyError:
-                    # The reponse was totally empty, or not an expected format
-                    self.log.error('Unable to retrieve domain %s.', domain)
-                    continue
-                for k, v in mbeans.iteritems():
-                    if self._check_mbean(k):
-                        self.collect_bean(k, v)
+        domains = [domain for domain in self.domains
+                   if domain not in self.IGNORE_DOMAINS]
+        responses = self.run_concurrently([(self._read_request, (domain,))
+                                           for domain in domains])
+        for domain, obj in zip(domains, responses):
+            try:
+                mbeans = obj['value'] if obj['status'] == 200 else {}
+            except (KeyError, TypeError):
+                # The reponse was totally empty, or not an expected format
+                self.log.error('Unable to retrieve domain %s.', domain)
+                continue
+            for k, v in mbeans.iteritems():
+                if self._check_mbean(k):
+                    self.collect_bean(k, v)
 
     def _read_json(self, request):
         json_str = request.read()
@@ -227,11 +243,9 @@ class JolokiaCollector(diamond.collector.Collector):
                 self.config['port'],
                 self.jolokia_path,
                 self.LIST_URL)
-            # need some time to process the downloaded metrics, so that's why
-            # timeout is lower than the interval.
-            timeout = max(2, float(self.config['interval']) * 2 / 3)
-            with closing(urllib2.urlopen(self._create_request(url),
-                                         timeout=timeout)) as response:
+            with closing(urllib2.urlopen(
+                    self._create_request(url),
+                    timeout=self.get_request_timeout())) as response:
                 return self._read_json(response)
         except (urllib2.HTTPError, ValueError) as e:
             self.log.error('Unable to read JSON response: %s', str(e))
@@ -250,11 +264,9 @@ class JolokiaCollector(diamond.collector.Collector):
                                          self.config['port'],
                                          self.jolokia_path,
                                          url_path)
-            # need some time to process the downloaded metrics, so that's why
-            # timeout is lower than the interval.
-            timeout = max(2, float(self.config['interval']) * 2 / 3)
-            with closing(urllib2.urlopen(self._create_request(url),
-                                         timeout=timeout)) as response:
+            with closing(urllib2.urlopen(
+                    self._create_request(url),
+                    timeout=self.get_request_timeout())) as response:
                 return self._read_json(response)
         except (urllib2.HTTPError, ValueError):
             self.log.error('Unable to read JSON response.')
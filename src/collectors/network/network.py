@@ -107,6 +107,10 @@ class NetworkCollector(diamond.collector.Collector):
                 results[device]['rx_packets'] = network_stat.packets_recv
                 results[device]['tx_packets'] = network_stat.packets_sent
 
+        # Byte counters are converted to the configured units and published
+        # with a precision of 2, the other counters as they are
+        converted = {}
+        metrics = {}
         for device in results:
             stats = results[device]
             for s, v in stats.items():
@@ -123,11 +127,12 @@ class NetworkCollector(diamond.collector.Collector):
                                                          unit='byte')
 
                     for u in self.config['byte_unit']:
-                        # Public Converted Metric
-                        self.publish(metric_name.replace('bytes', u),
-                                     convertor.get(unit=u), 2)
+                        converted[metric_name.replace('bytes', u)] = (
+                            convertor.get(unit=u))
                 else:
-                    # Publish Metric Derivative
-                    self.publish(metric_name, metric_value)
+                    metrics[metric_name] = metric_value
+
+        self.publish_many(converted, precision=2)
+        self.publish_many(metrics)
 
         return None
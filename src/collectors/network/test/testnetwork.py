@@ -35,13 +35,13 @@ class TestNetworkCollector(CollectorTestCase):
 
     @patch('__builtin__.open')
     @patch('os.access', Mock(return_value=True))
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_open_proc_net_dev(self, publish_mock, open_mock):
         open_mock.return_value = StringIO('')
         self.collector.collect()
         open_mock.assert_called_once_with('/proc/net/dev')
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_virtual_interfaces_and_bridges(self,
                                                              publish_mock):
         NetworkCollector.PROC = self.getFixturePath('proc_net_dev_1')
@@ -72,7 +72,7 @@ class TestNetworkCollector(CollectorTestCase):
                            defaultpath=self.collector.config['path'])
         self.assertPublishedMany(publish_mock, metrics)
 
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_should_work_with_real_data(self, publish_mock):
         NetworkCollector.PROC = self.getFixturePath('proc_net_dev_1')
         self.collector.collect()
@@ -99,7 +99,7 @@ class TestNetworkCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     # Named test_z_* to run after test_should_open_proc_net_dev
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_z_issue_208_a(self, publish_mock):
         NetworkCollector.PROC = self.getFixturePath('208-a_1')
         self.collector.collect()
@@ -211,7 +211,7 @@ class TestNetworkCollector(CollectorTestCase):
         self.assertPublishedMany(publish_mock, metrics)
 
     # Named test_z_* to run after test_should_open_proc_net_dev
-    @patch.object(Collector, 'publish')
+    @patch.object(Collector, 'publish_many')
     def test_z_issue_208_b(self, publish_mock):
         NetworkCollector.PROC = self.getFixturePath('208-b_1')
         self.collector.collect()
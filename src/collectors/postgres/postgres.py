@@ -110,9 +110,9 @@ class PostgresqlCollector(diamond.collector.Collector):
                     stat = klass(dbase, conn,
                                  underscore=self.config['underscore'])
                     stat.fetch(self.config['pg_version'])
-                    for metric, value in stat:
-                        if value is not None:
-                            self.publish(metric, value)
+                    self.publish_many([(metric, value)
+                                       for metric, value in stat
+                                       if value is not None])
 
                     # Setting multi_db to True will run this query on all known
                     # databases. This is bad for queries that hit views like
@@ -69,4 +69,5 @@ class TestWebsiteCollector(CollectorTestCase):
         })
 
     def tearDown(self):
-        self.patcher.stop()
+        # Tests calling setUp again start more than one patcher
+        patch.stopall()
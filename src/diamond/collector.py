@@ -4,6 +4,8 @@
 The Collector class is a base class for all metric collectors.
 """
 
+import copy
+import math
 import os
 import socket
 import platform
@@ -13,8 +15,11 @@ import time
 import re
 import subprocess
 import signal
+from multiprocessing.pool import ThreadPool
 
 from diamond.metric import Metric
+from diamond.utils.config import ConfigSnapshot
+from diamond.utils.counters import CounterStore
 from diamond.utils.config import load_config
 from error import DiamondException
 
@@ -178,44 +183,81 @@ class Collector(object):
         signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
         self.handlers = handlers
-        self.last_values = {}
+        # Last values of the counters, for publish_counter
+        self.last_values = CounterStore()
+
+        # End of the time allowed to the current run, set by the scheduler
+        self.deadline = None
+
+        # Self telemetry of the process running the collector, if enabled
+        self.telemetry = None
+        self.published = 0
 
         self.configfile = None
+        self.config_snapshot = None
+        self.config_version = None
         self.load_config(configfile, config)
 
     def load_config(self, configfile=None, override_config=None):
         """
         Process a configfile, or reload if previously given one.
+
+        configfile may be a ConfigSnapshot shared with other collectors, the
+        files are then only parsed again when they changed.
         """
         self.config = configobj.ConfigObj()
 
+        # The metric paths are built from the config, rebuild them
+        self.path_cache = None
+
         # Load in the collector's defaults
         if self.get_default_config() is not None:
             self.config.merge(self.get_default_config())
 
-        if configfile is not None:
+        if isinstance(configfile, ConfigSnapshot):
+            self.config_snapshot = configfile
+            self.configfile = configfile.configfile
+        elif configfile is not None:
+            self.config_snapshot = None
             self.configfile = os.path.abspath(configfile)
 
-        if self.configfile is not None:
+        config = None
+        if self.config_snapshot is not None:
+            config = self.config_snapshot.load()
+            self.config_version = self.config_snapshot.version
+        elif self.configfile is not None:
             config = load_config(self.configfile)
 
+        if config is not None:
             if 'collectors' in config:
                 if 'default' in config['collectors']:
-                    self.config.merge(config['collectors']['default'])
+                    self._merge_config(config['collectors']['default'])
 
                 if self.name in config['collectors']:
-                    self.config.merge(config['collectors'][self.name])
+                    self._merge_config(config['collectors'][self.name])
 
         if override_config is not None:
             if 'collectors' in override_config:
                 if 'default' in override_config['collectors']:
-                    self.config.merge(override_config['collectors']['default'])
+                    self._merge_config(override_config['collectors']['default'])
 
                 if self.name in override_config['collectors']:
-                    self.config.merge(override_config['collectors'][self.name])
+                    self._merge_config(override_config['collectors'][self.name])
+
+        self.last_values.ttl = int(self.config.get('counter_ttl', 0))
+        self.last_values.max_size = int(self.config.get('max_counters', 0))
 
         self.process_config()
 
+    def _merge_config(self, section):
+        """
+        Merge a copy of a config section: process_config may change the lists
+        of the config in place, and the section may be shared by collectors
+        """
+        if isinstance(section, configobj.Section):
+            section = section.dict()
+        self.config.merge(copy.deepcopy(section))
+
     def process_config(self):
         """
         Intended to put any code that should be run after any config reload
@@ -258,6 +300,13 @@ class Collector(object):
                                  'Mutually exclusive with metrics_blacklist',
             'metrics_blacklist': 'Regex to match metrics to block. ' +
                                  'Mutually exclusive with metrics_whitelist',
+            'execution': 'process to run in a process of its own, pool to '
+                         'share the thread pool of the collector pool '
+                         'processes',
+            'counter_ttl': 'Runs after which the last value of a counter no '
+                           'longer published is forgotten, 0 to keep it',
+            'max_counters': 'Most counter values kept, the least recently '
+                            'published are forgotten first, 0 for no limit',
         }
 
     def get_default_config(self):
@@ -310,6 +359,15 @@ class Collector(object):
 
             # Blacklist of metrics to let through
             'metrics_blacklist': None,
+
+            # Run in a process of its own or in a collector pool process
+            'execution': 'process',
+
+            # Forget the counters not published for this many runs
+            'counter_ttl': 10,
+
+            # Most counters remembered
+            'max_counters': 100000,
         }
 
     def get_metric_path(self, name, instance=None):
@@ -319,20 +377,34 @@ class Collector(object):
             virtual machine and should have a different
             root prefix.
         """
+        if self.path_cache is None:
+            self.path_cache = self._build_path_cache()
+        base, instance_prefix, path, hostname, split = self.path_cache
+
+        if instance is not None:
+            if path == '.':
+                return '.'.join([instance_prefix, instance, name])
+            else:
+                return '.'.join([instance_prefix, instance, path, name])
+
+        if base:
+            return base + '.' + name
+        return name
+
+    def _build_path_cache(self):
+        """
+        Work out the parts of the metric paths that only depend on the
+        config, once per config load rather than once per metric
+        """
         if 'path' in self.config:
             path = self.config['path']
         else:
             path = self.__class__.__name__
 
-        if instance is not None:
-            if 'instance_prefix' in self.config:
-                prefix = self.config['instance_prefix']
-            else:
-                prefix = 'instances'
-            if path == '.':
-                return '.'.join([prefix, instance, name])
-            else:
-                return '.'.join([prefix, instance, path, name])
+        if 'instance_prefix' in self.config:
+            instance_prefix = self.config['instance_prefix']
+        else:
+            instance_prefix = 'instances'
 
         if 'path_prefix' in self.config:
             prefix = self.config['path_prefix']
@@ -358,16 +430,60 @@ class Collector(object):
         is_path_invalid = path == '.' or not path
 
         if is_path_invalid and prefix:
-            return '.'.join([prefix, name])
+            base = prefix
         elif prefix:
-            return '.'.join([prefix, path, name])
+            base = '.'.join([prefix, path])
         elif is_path_invalid:
-            return name
+            base = ''
         else:
-            return '.'.join([path, name])
+            base = path
+
+        return (base, instance_prefix, path, hostname,
+                self._split_base(base, hostname))
+
+    def _split_base(self, base, hostname):
+        """
+        Split the base path into the path prefix, the collector path and the
+        start of the metric path the way Metric parses them back out of the
+        full path, so metrics can carry them instead
+        """
+        if hostname is None:
+            return None
+        offset = base.find(hostname)
+        if offset < 1:
+            return None
+
+        start = offset + len(hostname) + 1
+        if start > len(base):
+            return None
+        end = base.find('.', start)
+        if end < 0:
+            return base[:offset - 1], base[start:], ''
+        return base[:offset - 1], base[start:end], base[end + 1:] + '.'
+
+    def get_path_components(self, name, instance=None):
+        """
+        Get the path prefix, collector path and metric path of a metric, or
+        None for each when they are left to Metric to work out
+        """
+        if self.path_cache is None:
+            self.path_cache = self._build_path_cache()
+        split = self.path_cache[4]
+        if instance is not None or split is None:
+            return None, None, None
+        return split[0], split[1], split[2] + name
 
     def get_hostname(self):
-        return get_hostname(self.config)
+        if self.path_cache is None:
+            self.path_cache = self._build_path_cache()
+        return self.path_cache[3]
+
+    def deadline_exceeded(self):
+        """
+        Whether the current run went past the time allowed to it. Collectors
+        doing a lot of slow work can check it to give up early.
+        """
+        return self.deadline is not None and time.time() > self.deadline
 
     def collect(self):
         """
@@ -390,6 +506,8 @@ class Collector(object):
 
         # Get metric Path
         path = self.get_metric_path(name, instance=instance)
+        path_prefix, collector_path, metric_path = self.get_path_components(
+            name, instance=instance)
 
         # Get metric TTL
         ttl = float(self.config['interval']) * float(
@@ -399,7 +517,10 @@ class Collector(object):
         try:
             metric = Metric(path, value, raw_value=raw_value, timestamp=None,
                             precision=precision, host=self.get_hostname(),
-                            metric_type=metric_type, ttl=ttl)
+                            metric_type=metric_type, ttl=ttl,
+                            path_prefix=path_prefix,
+                            collector_path=collector_path,
+                            metric_path=metric_path)
         except DiamondException:
             self.log.error(('Error when creating new Metric: path=%r, '
                             'value=%r'), path, value)
@@ -413,9 +534,88 @@ class Collector(object):
         Publish a Metric object
         """
         # Process Metric
+        self.published += 1
         for handler in self.handlers:
             handler._process(metric)
 
+    def publish_many(self, metrics, precision=0, metric_type='GAUGE',
+                     instance=None):
+        """
+        Publish many metrics, given as a dict or an iterable of (name, value)
+        pairs. The config is looked up once for all of them and the handlers
+        get them as a single batch. Metrics with an invalid value are logged
+        and left out of the batch.
+        """
+        if isinstance(metrics, dict):
+            metrics = metrics.iteritems()
+        self._publish_many(((name, value, None) for name, value in metrics),
+                           precision, metric_type, instance)
+
+    def publish_counters(self, metrics, precision=0, max_value=0,
+                         time_delta=True, interval=None, allow_negative=False,
+                         instance=None):
+        """
+        Publish the derivatives of many counters, see publish_many
+        """
+        if isinstance(metrics, dict):
+            metrics = metrics.iteritems()
+        items = []
+        for name, value in metrics:
+            items.append((name, self.derivative(
+                name, value, max_value=max_value, time_delta=time_delta,
+                interval=interval, allow_negative=allow_negative,
+                instance=instance), value))
+        self._publish_many(items, precision, 'COUNTER', instance)
+
+    def _publish_many(self, items, precision, metric_type, instance):
+        """
+        Publish (name, value, raw_value) items as a batch
+        """
+        whitelist = self.config['metrics_whitelist']
+        blacklist = self.config['metrics_blacklist']
+        ttl = float(self.config['interval']) * float(
+            self.config['ttl_multiplier'])
+        host = self.get_hostname()
+        timestamp = int(time.time())
+        get_metric_path = self.get_metric_path
+        get_path_components = self.get_path_components
+
+        metrics = []
+        for name, value, raw_value in items:
+            # Check whitelist/blacklist
+            if whitelist:
+                if not whitelist.match(name):
+                    continue
+            elif blacklist and blacklist.match(name):
+                continue
+
+            path = get_metric_path(name, instance=instance)
+            path_prefix, collector_path, metric_path = get_path_components(
+                name, instance=instance)
+            try:
+                metrics.append(Metric(path, value, raw_value=raw_value,
+                                      timestamp=timestamp,
+                                      precision=precision, host=host,
+                                      metric_type=metric_type, ttl=ttl,
+                                      path_prefix=path_prefix,
+                                      collector_path=collector_path,
+                                      metric_path=metric_path))
+            except DiamondException:
+                self.log.error(('Error when creating new Metric: path=%r, '
+                                'value=%r'), path, value)
+
+        self.publish_metrics(metrics)
+
+    def publish_metrics(self, metrics):
+        """
+        Publish a list of Metric objects
+        """
+        if not metrics:
+            return
+        self.published += len(metrics)
+        for handler in self.handlers:
+            handler._process_many(metrics)
+
     def publish_gauge(self, name, value, precision=0, instance=None):
         return self.publish(name, value, precision=precision,
                             metric_type='GAUGE', instance=instance)
@@ -477,15 +677,28 @@ class Collector(object):
         """
         try:
             start_time = time.time()
+            self.published = 0
 
             # Collect Data
             self.collect()
 
+            # Forget the counters of series that went away
+            dropped = self.last_values.expire()
+            if dropped:
+                self.log.debug('Forgot %d counters', dropped)
+
             end_time = time.time()
             collector_time = int((end_time - start_time) * 1000)
 
             self.log.debug('Collection took %s ms', collector_time)
 
+            if self.telemetry is not None:
+                self.telemetry.record(
+                    ('collectors', self.name, 'run_time_ms'),
+                    (end_time - start_time) * 1000)
+                self.telemetry.record(('collectors', self.name, 'metrics'),
+                                      self.published)
+
             if 'measure_collector_time' in self.config:
                 if self.config['measure_collector_time']:
                     metric_name = 'collector_time_ms'
@@ -574,3 +787,85 @@ class ProcessCollector(Collector):
         except OSError:
             self.log.exception("Unable to run %s", command)
             return None
+
+
+class AsyncCollector(Collector):
+    """
+    Collector with helpers for running blocking requests concurrently, so
+    that polling many endpoints takes about as long as the slowest of them
+    rather than the sum of all of them.
+
+    The requests run on a pool of threads kept for the life of the collector,
+    the standard library of python 2 having no event loop to share.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.pool = None
+        self.pool_size = None
+        super(AsyncCollector, self).__init__(*args, **kwargs)
+
+    def get_default_config_help(self):
+        config_help = super(AsyncCollector, self).get_default_config_help()
+        config_help.update({
+            'concurrency':      'Maximum number of requests in flight',
+            'request_timeout':  'Timeout in seconds of a single request',
+        })
+        return config_help
+
+    def get_default_config(self):
+        """
+        Returns the default collector settings
+        """
+        config = super(AsyncCollector, self).get_default_config()
+        config.update({
+            'concurrency':      8,
+            'request_timeout':  10,
+        })
+        return config
+
+    def get_request_timeout(self):
+        return float(self.config['request_timeout'])
+
+    def _get_pool(self):
+        size = max(int(self.config['concurrency']), 1)
+        if self.pool is None or self.pool_size != size:
+            if self.pool is not None:
+                self.pool.close()
+            # Created on first use so that it belongs to the collector
+            # process rather than to the server it was forked from
+            self.pool = ThreadPool(size)
+            self.pool_size = size
+        return self.pool
+
+    def run_concurrently(self, calls):
+        """
+        Call each (function, args) of calls on the thread pool and wait for
+        them all.
+
+        Returns the results in the order of calls, with None for the calls
+        that raised or did not return in time. The functions run in other
+        threads, they should return their data rather than publish it.
+        """
+        if not calls:
+            return []
+
+        pool = self._get_pool()
+        pending = [pool.apply_async(function, args)
+                   for function, args in calls]
+
+        # Each request is expected to honor the request timeout, this only
+        # bounds the wait for the ones that do not
+        rounds = math.ceil(len(calls) / float(self.pool_size))
+        deadline = time.time() + rounds * self.get_request_timeout() + 1
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+
+        results = []
+        for (function, args), result in zip(calls, pending):
+            try:
+                results.append(result.get(max(deadline - time.time(), 0)))
+            except Exception, e:
+                self.log.error('%s: %s%r failed: %r', self.name,
+                               function.__name__, args, e)
+                results.append(None)
+        return results
@@ -1,11 +1,14 @@
 # coding=utf-8
 
 import logging
+import os
 import threading
 import traceback
 from configobj import ConfigObj
 import time
 
+from diamond.utils.spool import Spool
+
 
 class Handler(object):
     """
@@ -40,6 +43,22 @@ class Handler(object):
             self.config['server_error_interval'])
         self._errors = {}
 
+        # Exceptions raised processing or flushing metrics
+        self.errors = 0
+
+        # Write-ahead spool, for the handlers supporting one by having
+        # spool_path in their default config
+        self.spool = None
+        if (('spool_path' in self.get_default_config() and
+             self.config['spool_path'])):
+            self.spool = Spool(
+                os.path.join(self.config['spool_path'], self._spool_name()),
+                segment_size=self.config['spool_segment_size'],
+                max_size=self.config['spool_max_size'],
+                max_age=self.config['spool_max_age'],
+                replay_rate=self.config['spool_replay_rate'],
+                log=self.log)
+
         # Initialize Lock
         self.lock = threading.Lock()
 
@@ -51,6 +70,12 @@ class Handler(object):
             'get_default_config_help': 'get_default_config_help',
             'server_error_interval': ('How frequently to send repeated server '
                                       'errors'),
+            'dispatch': ('Where metrics are processed: inline in the handler '
+                         'process, in a thread or in a process of their own'),
+            'dispatch_queue_size': ('How many metric batches may wait for a '
+                                    'thread or process dispatch'),
+            'dispatch_overflow': ('What to do when the dispatch queue is full:'
+                                  ' drop_new, drop_old or block'),
         }
 
     def get_default_config(self):
@@ -60,6 +85,9 @@ class Handler(object):
         return {
             'get_default_config': 'get_default_config',
             'server_error_interval': 120,
+            'dispatch': 'inline',
+            'dispatch_queue_size': 1024,
+            'dispatch_overflow': 'drop_new',
         }
 
     def _process(self, metric):
@@ -73,11 +101,26 @@ class Handler(object):
                 self.lock.acquire()
                 self.process(metric)
             except Exception:
+                self.errors += 1
                 self.log.error(traceback.format_exc())
         finally:
             if self.lock.locked():
                 self.lock.release()
 
+    def _process_many(self, metrics):
+        """
+        Process a list of metrics, taking the lock once for all of them
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            for metric in metrics:
+                try:
+                    self.process(metric)
+                except Exception:
+                    self.errors += 1
+                    self.log.error(traceback.format_exc())
+
     def process(self, metric):
         """
         Process a metric
@@ -97,6 +140,7 @@ class Handler(object):
                 self.lock.acquire()
                 self.flush()
             except Exception:
+                self.errors += 1
                 self.log.error(traceback.format_exc())
         finally:
             if self.lock.locked():
@@ -110,6 +154,72 @@ class Handler(object):
         """
         pass
 
+    def close(self):
+        """
+        Flush and release the connections of a handler a config reload
+        removed or replaced
+        """
+        self._flush()
+        if hasattr(self, '_close'):
+            with self.lock:
+                self._close()
+
+    def stats(self):
+        """
+        Gauges kept by the handler itself, published with the telemetry of
+        the handler process
+        """
+        return {}
+
+    def batch_deadline(self):
+        """
+        When the handler timer should fire next to send buffered metrics, None
+        if it has nothing waiting. See BatchingMixin.
+        """
+        return None
+
+    def _tick(self, now):
+        """
+        Called by the handler timer once the batch deadline passed
+        """
+        pass
+
+    def _spool_name(self):
+        """
+        Name of the spool directory of this handler
+        """
+        return self.__class__.__name__
+
+    def _spool(self, records):
+        """
+        Park data the backend did not accept in the spool, if there is one.
+
+        :returns: whether the records were spooled
+        """
+        if self.spool is None or not records:
+            return False
+        try:
+            self.spool.append(records)
+        except (IOError, OSError):
+            self._throttle_error('%s: Failed to spool data',
+                                 self.__class__.__name__, exc_info=True)
+            return False
+        return True
+
+    def _replay_spool(self, send):
+        """
+        Replay spooled data through send, which is given a list of records and
+        returns whether the backend accepted them. Call it once the backend
+        takes data again.
+        """
+        if self.spool is None or not len(self.spool):
+            return
+        try:
+            self.spool.replay(send)
+        except (IOError, OSError):
+            self._throttle_error('%s: Failed to replay spooled data',
+                                 self.__class__.__name__, exc_info=True)
+
     def _throttle_error(self, msg, *args, **kwargs):
         """
         Avoids sending errors repeatedly. Waits at least
@@ -149,3 +259,79 @@ class Handler(object):
             del self._errors[msg]
         else:
             self._errors = {}
+
+
+class BatchingMixin(object):
+    """
+    Size and latency thresholds for handlers sending metrics in batches.
+
+    Handlers mixing this in before Handler call _init_batching, call
+    _batch_added whenever they buffered metrics and implement _batch_length
+    and _send_batch. The batch is sent once batch_size metrics are buffered or
+    the oldest of them waited batch_max_latency seconds, whichever comes first.
+    The latency is enforced by the timer of the handler process, so metrics do
+    not wait for more metrics or the next flush to go out.
+    """
+
+    def _init_batching(self, size, max_latency):
+        self.batch_size = int(size)
+        self.batch_max_latency = float(max_latency)
+        self.batch_started = None
+
+    def _batch_length(self):
+        """
+        Number of metrics buffered
+        """
+        raise NotImplementedError
+
+    def _send_batch(self):
+        """
+        Send the buffered metrics
+        """
+        raise NotImplementedError
+
+    def _batch_added(self, count=1):
+        """
+        Account for count metrics just buffered, sending the batch if full
+        """
+        length = self._batch_length()
+        if length <= count or self.batch_started is None:
+            # The batch was empty, sent by a flush or whatever else
+            self.batch_started = time.time()
+        if length >= self.batch_size:
+            self._send_pending()
+
+    def _send_pending(self):
+        try:
+            self._send_batch()
+        finally:
+            if self._batch_length():
+                # Not sent, try again once the latency passed again
+                self.batch_started = time.time()
+            else:
+                self.batch_started = None
+
+    def batch_deadline(self):
+        # Disabled handlers may have returned before _init_batching
+        if not self.enabled or getattr(self, 'batch_started', None) is None:
+            return None
+        if self.batch_max_latency <= 0 or not self._batch_length():
+            return None
+        return self.batch_started + self.batch_max_latency
+
+    def _tick(self, now):
+        if not self.enabled:
+            self.batch_started = None
+            return
+        with self.lock:
+            deadline = self.batch_deadline()
+            if deadline is None or now < deadline:
+                return
+            if not self._batch_length():
+                self.batch_started = None
+                return
+            try:
+                self._send_pending()
+            except Exception:
+                self.errors += 1
+                self.log.error(traceback.format_exc())
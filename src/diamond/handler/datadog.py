@@ -4,20 +4,26 @@ Operations and Development teams who write and run applications
 at scale, and want to turn the massive amounts of data produced
 by their apps, tools and services into actionable insight.
 
-#### Dependencies
-
-  * [dogapi](https://github.com/DataDog/datadogpy)
+Metrics are posted to the series endpoint of the Datadog API, all the
+metrics of a flush in one compressed payload, split in several when over
+max_payload_size, over a connection kept alive from one flush to the next.
 
 """
 
 from Handler import Handler
+import json
 import logging
-from collections import deque
+import socket
+import httplib
 
 try:
-    import dogapi
+    from collections import OrderedDict
 except ImportError:
-    dogapi = None
+    # Python 2.6 needs the ordereddict package
+    from ordereddict import OrderedDict
+
+from diamond.utils.httpclient import compress
+from diamond.utils.httpclient import KeepAliveConnection
 
 
 class DatadogHandler(Handler):
@@ -30,14 +36,16 @@ class DatadogHandler(Handler):
         Handler.__init__(self, config)
         logging.debug("Initialized Datadog handler.")
 
-        if dogapi is None:
-            logging.error("Failed to load dogapi module.")
-            return
+        self.api_key = self.config.get('api_key', '')
+        self.queue_size = int(self.config.get('queue_size') or 0)
+        self.max_payload_size = int(self.config['max_payload_size'])
+        self.compression = self.config['compression']
+        self.connection = KeepAliveConnection(self.config['url'],
+                                              float(self.config['timeout']))
 
-        self.api = dogapi.dog_http_api
-        self.api.api_key = self.config.get('api_key', '')
-        self.queue_size = self.config.get('queue_size', 1)
-        self.queue = deque([])
+        # Points waiting to be sent, per metric path and host
+        self.series = OrderedDict()
+        self.queued = 0
 
     def get_default_config_help(self):
         """
@@ -47,7 +55,13 @@ class DatadogHandler(Handler):
 
         config.update({
             'api_key': 'Datadog API key',
-            'queue_size': 'Number of metrics to queue before send',
+            'queue_size': 'Number of metrics to queue before send, 0 to send '
+                          'them on flush only',
+            'url': 'The series endpoint of the Datadog API',
+            'timeout': 'Timeout of the requests in seconds',
+            'max_payload_size': 'Most bytes of series in one request, more '
+                                'are split in several requests',
+            'compression': 'gzip, deflate or none',
         })
 
         return config
@@ -60,18 +74,33 @@ class DatadogHandler(Handler):
 
         config.update({
             'api_key': '',
-            'queue_size': '',
+            'queue_size': 0,
+            'url': 'https://app.datadoghq.com/api/v1/series',
+            'timeout': 15,
+            'max_payload_size': 2097152,
+            'compression': 'deflate',
         })
 
         return config
 
     def process(self, metric):
         """
-        Process metric by sending it to datadog api
+        Queue a metric, sending the queue to the datadog api once full
         """
-
-        self.queue.append(metric)
-        if len(self.queue) >= self.queue_size:
+        path = '%s.%s.%s' % (
+            metric.getPathPrefix(),
+            metric.getCollectorPath(),
+            metric.getMetricPath()
+        )
+
+        key = (path, metric.host)
+        points = self.series.get(key)
+        if points is None:
+            points = self.series[key] = []
+        points.append([metric.timestamp, metric.value])
+        self.queued += 1
+
+        if self.queue_size and self.queued >= self.queue_size:
             self._send()
 
     def flush(self):
@@ -81,26 +110,57 @@ class DatadogHandler(Handler):
 
         self._send()
 
-    def _send(self):
+    def _payloads(self):
         """
-        Take metrics from queue and send it to Datadog API
+        Split the queued series in JSON payloads of at most max_payload_size
+        bytes, but for series larger than that on their own
         """
+        payload = []
+        size = 0
+        for (path, host), points in self.series.iteritems():
+            series = json.dumps({
+                'metric': path,
+                'points': points,
+                'type': 'gauge',
+                'host': host,
+            })
+            if payload and size + len(series) + 1 > self.max_payload_size:
+                yield payload
+                payload = []
+                size = 0
+            payload.append(series)
+            size += len(series) + 1
+        if payload:
+            yield payload
 
-        while len(self.queue) > 0:
-            metric = self.queue.popleft()
-
-            path = '%s.%s.%s' % (
-                metric.getPathPrefix(),
-                metric.getCollectorPath(),
-                metric.getMetricPath()
-            )
-
-            topic, value, timestamp = str(metric).split()
-            logging.debug(
-                "Sending.. topic[%s], value[%s], timestamp[%s]",
-                path,
-                value,
-                timestamp
-            )
+    def _send(self):
+        """
+        Send the queued series to the Datadog API
+        """
+        if not self.series:
+            return
 
-            self.api.metric(path, (timestamp, value), host=metric.host)
+        headers = {'Content-Type': 'application/json'}
+        if self.compression in ('gzip', 'deflate'):
+            headers['Content-Encoding'] = self.compression
+        query = 'api_key=%s' % self.api_key
+
+        try:
+            for payload in self._payloads():
+                body = '{"series": [%s]}' % ','.join(payload)
+                logging.debug("Sending %d series to Datadog", len(payload))
+                status, data = self.connection.request(
+                    'POST', compress(body, self.compression), headers, query)
+                if status >= 300:
+                    self._throttle_error(
+                        'DatadogHandler: Datadog answered %d: %s', status,
+                        data[:200])
+        except (httplib.HTTPException, socket.error), e:
+            self._throttle_error('DatadogHandler: Failed to send metrics to '
+                                 'Datadog: %s', e)
+        finally:
+            self.series.clear()
+            self.queued = 0
+
+    def _close(self):
+        self.connection.close()
@@ -16,12 +16,16 @@ use it.
 
 """
 
+from Handler import BatchingMixin
 from Handler import Handler
+from diamond.utils.spool import SPOOL_DEFAULT_CONFIG
+from diamond.utils.spool import SPOOL_DEFAULT_CONFIG_HELP
+from diamond.utils.writer import BackgroundWriter
 import socket
 import time
 
 
-class GraphiteHandler(Handler):
+class GraphiteHandler(BatchingMixin, Handler):
     """
     Implements the abstract Handler class, sending data to graphite
     """
@@ -43,7 +47,8 @@ class GraphiteHandler(Handler):
         self.timeout = float(self.config['timeout'])
         self.keepalive = bool(self.config['keepalive'])
         self.keepaliveinterval = int(self.config['keepaliveinterval'])
-        self.batch_size = int(self.config['batch'])
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_latency'])
         self.max_backlog_multiplier = int(
             self.config['max_backlog_multiplier'])
         self.trim_backlog_multiplier = int(
@@ -54,8 +59,22 @@ class GraphiteHandler(Handler):
         self.reconnect_interval = int(self.config['reconnect_interval'])
         self.last_connect_timestamp = -1
 
-        # Connect
-        self._connect()
+        self.writer = None
+        if self.config['writer'] == 'background':
+            # Sending and reconnecting happen in a thread of its own
+            self.writer = BackgroundWriter(
+                self._create_socket,
+                max_buffer=self.config['writer_buffer_size'],
+                max_backoff=self.config['writer_max_backoff'],
+                reconnect_interval=self.reconnect_interval,
+                name='%s-%s:%d' % (self.__class__.__name__, self.host,
+                                   self.port),
+                log=self.log)
+        elif self.config['writer'] == 'inline':
+            # Connect
+            self._connect()
+        else:
+            raise ValueError('Unknown writer %r' % self.config['writer'])
 
     def get_default_config_help(self):
         """
@@ -69,6 +88,9 @@ class GraphiteHandler(Handler):
             'proto': 'udp, udp4, udp6, tcp, tcp4, or tcp6',
             'timeout': '',
             'batch': 'How many to store before sending to the graphite server',
+            'batch_max_latency': 'Send the batch once its oldest metric '
+                                 'waited this many seconds even if not full, '
+                                 '0 to wait for a full batch or a flush',
             'max_backlog_multiplier': 'how many batches to store before trimming',  # NOQA
             'trim_backlog_multiplier': 'Trim down how many batches',
             'keepalive': 'Enable keepalives for tcp streams',
@@ -77,7 +99,15 @@ class GraphiteHandler(Handler):
             'scope_id': 'IPv6 Scope ID',
             'reconnect_interval': 'How often (seconds) to reconnect to '
                                   'graphite. Default (0) is never',
+            'writer': 'inline to send from the handler loop, background to '
+                      'hand the data off to a thread sending it so a slow '
+                      'graphite never blocks the handler',
+            'writer_buffer_size': 'Bytes the background writer buffers, the '
+                                  'oldest data is spooled or dropped first',
+            'writer_max_backoff': 'Maximum seconds the background writer '
+                                  'waits between reconnects',
         })
+        config.update(SPOOL_DEFAULT_CONFIG_HELP)
 
         return config
 
@@ -93,6 +123,7 @@ class GraphiteHandler(Handler):
             'proto': 'tcp',
             'timeout': 15,
             'batch': 1,
+            'batch_max_latency': 1,
             'max_backlog_multiplier': 5,
             'trim_backlog_multiplier': 4,
             'keepalive': 0,
@@ -100,7 +131,11 @@ class GraphiteHandler(Handler):
             'flow_info': 0,
             'scope_id': 0,
             'reconnect_interval': 0,
+            'writer': 'inline',
+            'writer_buffer_size': 16777216,
+            'writer_max_backoff': 60,
         })
+        config.update(SPOOL_DEFAULT_CONFIG)
 
         return config
 
@@ -110,22 +145,54 @@ class GraphiteHandler(Handler):
         """
         self._close()
 
+    def close(self):
+        Handler.close(self)
+        if self.writer is not None:
+            self.writer.stop()
+
+    def is_connected(self):
+        """
+        Whether there is a connection to graphite
+        """
+        if self.writer is not None:
+            return self.writer.connected
+        return self.socket is not None
+
+    def stats(self):
+        """
+        Send side stats of the background writer
+        """
+        if self.writer is None:
+            return {}
+        return self.writer.stats()
+
     def process(self, metric):
         """
         Process a metric by sending it to graphite
         """
         # Append the data to the array as a string
         self.metrics.append(str(metric))
-        if len(self.metrics) >= self.batch_size:
-            self._send()
+        self._batch_added()
+
+    def _batch_length(self):
+        return len(self.metrics)
+
+    def _send_batch(self):
+        self._send()
 
     def flush(self):
         """Flush metrics in queue"""
         self._send()
 
+    def _spool_name(self):
+        return '%s-%s-%s' % (self.__class__.__name__, self.config['host'],
+                             self.config['port'])
+
     def _send_data(self, data):
         """
         Try to send all data in buffer.
+
+        :returns: False if the data could not be sent
         """
         try:
             self.socket.sendall(data)
@@ -138,8 +205,29 @@ class GraphiteHandler(Handler):
             try:
                 self.socket.sendall(data)
             except:
-                return
+                return False
             self._reset_errors()
+        return True
+
+    def _send_spooled(self, records):
+        """
+        Send data replayed from the spool
+        """
+        if self.writer is not None:
+            data = ''.join(records)
+            if ((not self.writer.connected or
+                 not self.writer.has_room(len(data)))):
+                return False
+            self.writer.write(data)
+            return True
+        if self.socket is None:
+            return False
+        try:
+            self.socket.sendall(''.join(records))
+        except Exception:
+            self._close()
+            return False
+        return True
 
     def _time_to_reconnect(self):
         if self.reconnect_interval > 0:
@@ -152,6 +240,10 @@ class GraphiteHandler(Handler):
         """
         Send data to graphite. Data that can not be sent will be queued.
         """
+        if self.writer is not None:
+            self._send_background()
+            return
+
         # Check to see if we have a valid socket. If not, try to connect.
         try:
             try:
@@ -163,7 +255,10 @@ class GraphiteHandler(Handler):
                     self.log.debug("GraphiteHandler: Reconnect failed.")
                 else:
                     # Send data to socket
-                    self._send_data(''.join(self.metrics))
+                    if self._send_data(''.join(self.metrics)) is False:
+                        self._spool(self.metrics)
+                    else:
+                        self._replay_spool(self._send_spooled)
                     self.metrics = []
                     if self._time_to_reconnect():
                         self._close()
@@ -176,16 +271,40 @@ class GraphiteHandler(Handler):
                     self.batch_size * self.max_backlog_multiplier):
                 trim_offset = (self.batch_size *
                                self.trim_backlog_multiplier * -1)
-                self.log.warn('GraphiteHandler: Trimming backlog. Removing' +
-                              ' oldest %d and keeping newest %d metrics',
-                              len(self.metrics) - abs(trim_offset),
-                              abs(trim_offset))
+                trimmed = self.metrics[:trim_offset]
+                if self._spool(trimmed):
+                    self.log.debug('GraphiteHandler: Spooled oldest %d '
+                                   'metrics of the backlog', len(trimmed))
+                else:
+                    self.log.warn('GraphiteHandler: Trimming backlog. '
+                                  'Removing oldest %d and keeping newest %d '
+                                  'metrics', len(trimmed), abs(trim_offset))
                 self.metrics = self.metrics[trim_offset:]
 
+    def _send_background(self):
+        """
+        Hand the data off to the background writer, spooling what it had to
+        drop to make room
+        """
+        dropped = self.writer.write(''.join(self.metrics))
+        self.metrics = []
+        if dropped and not self._spool(dropped):
+            self._throttle_error('GraphiteHandler: Writer buffer full, '
+                                 'dropped %d bytes',
+                                 sum(len(data) for data in dropped))
+        if self.writer.connected:
+            self._replay_spool(self._send_spooled)
+
     def _connect(self):
         """
         Connect to the graphite server
         """
+        self.socket = self._create_socket()
+
+    def _create_socket(self):
+        """
+        Return a socket connected to the graphite server, None on failure
+        """
         if (self.proto == 'udp'):
             stream = socket.SOCK_DGRAM
         else:
@@ -216,27 +335,25 @@ class GraphiteHandler(Handler):
                 family = socket.AF_INET
 
         # Create socket
-        self.socket = socket.socket(family, stream)
-        if self.socket is None:
+        sock = socket.socket(family, stream)
+        if sock is None:
             # Log Error
             self.log.error("GraphiteHandler: Unable to create socket.")
-            # Close Socket
-            self._close()
             return
         # Enable keepalives?
         if self.proto != 'udp' and self.keepalive:
             self.log.error("GraphiteHandler: Setting socket keepalives...")
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
-                                   self.keepaliveinterval)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
-                                   self.keepaliveinterval)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                            self.keepaliveinterval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                            self.keepaliveinterval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
         # Set socket timeout
-        self.socket.settimeout(self.timeout)
+        sock.settimeout(self.timeout)
         # Connect to graphite server
         try:
-            self.socket.connect(connection_struct)
+            sock.connect(connection_struct)
             # Log
             self.log.debug("GraphiteHandler: Established connection to "
                            "graphite server %s:%d.",
@@ -247,8 +364,9 @@ class GraphiteHandler(Handler):
             self._throttle_error("GraphiteHandler: Failed to connect to "
                                  "%s:%i. %s.", self.host, self.port, ex)
             # Close Socket
-            self._close()
+            sock.close()
             return
+        return sock
 
     def _close(self):
         """
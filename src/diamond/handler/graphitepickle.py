@@ -40,8 +40,6 @@ class GraphitePickleHandler(GraphiteHandler):
         GraphiteHandler.__init__(self, config)
         # Initialize Data
         self.batch = []
-        # Initialize Options
-        self.batch_size = int(self.config['batch'])
 
     def get_default_config_help(self):
         """
@@ -72,18 +70,30 @@ class GraphitePickleHandler(GraphiteHandler):
         # Add the metric to the match
         self.batch.append(m)
         # If there are sufficient metrics, then pickle and send
-        if len(self.batch) >= self.batch_size:
-            # Log
-            self.log.debug("GraphitePickleHandler: Sending batch size: %d",
-                           self.batch_size)
-            # Pickle the batch of metrics
-            self.metrics = [self._pickle_batch()]
-            # Send pickled batch
-            self._send()
-            # Flush the metric pack down the wire
-            self.flush()
-            # Clear Batch
-            self.batch = []
+        self._batch_added()
+
+    def flush(self):
+        """Send the batch, full or not, and the metrics in queue"""
+        if self.batch:
+            self._send_batch()
+        else:
+            GraphiteHandler.flush(self)
+
+    def _batch_length(self):
+        return len(self.batch)
+
+    def _send_batch(self):
+        # Log
+        self.log.debug("GraphitePickleHandler: Sending batch size: %d",
+                       len(self.batch))
+        # Pickle the batch of metrics
+        self.metrics = [self._pickle_batch()]
+        # Clear Batch
+        self.batch = []
+        # Send pickled batch
+        self._send()
+        # Flush the metric pack down the wire
+        GraphiteHandler.flush(self)
 
     def _pickle_batch(self):
         """
@@ -85,8 +85,18 @@ class HostedGraphiteHandler(Handler):
         metric = self.key + '.' + str(metric)
         self.graphite._process(metric)
 
+    def _process_many(self, metrics):
+        for metric in metrics:
+            self._process(metric)
+
     def _flush(self):
         self.graphite._flush()
 
+    def batch_deadline(self):
+        return self.graphite.batch_deadline()
+
+    def _tick(self, now):
+        self.graphite._tick(now)
+
     def flush(self):
         self.graphite.flush()
@@ -5,17 +5,19 @@
 Send metrics to a http endpoint via POST
 """
 
+from Handler import BatchingMixin
 from Handler import Handler
 import urllib2
 
 
-class HttpPostHandler(Handler):
+class HttpPostHandler(BatchingMixin, Handler):
 
     # Inititalize Handler with url and batch size
     def __init__(self, config=None):
         Handler.__init__(self, config)
         self.metrics = []
-        self.batch_size = int(self.config['batch'])
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_latency'])
         self.url = self.config.get('url')
 
     def get_default_config_help(self):
@@ -27,6 +29,8 @@ class HttpPostHandler(Handler):
         config.update({
             'url': 'Fully qualified url to send metrics to',
             'batch': 'How many to store before sending to the graphite server',
+            'batch_max_latency': 'Send the batch once its oldest metric '
+                                 'waited this many seconds even if not full',
         })
 
         return config
@@ -40,6 +44,7 @@ class HttpPostHandler(Handler):
         config.update({
             'url': 'http://localhost/blah/blah/blah',
             'batch': 100,
+            'batch_max_latency': 1,
         })
 
         return config
@@ -47,8 +52,13 @@ class HttpPostHandler(Handler):
     # Join batched metrics and push to url mentioned in config
     def process(self, metric):
         self.metrics.append(str(metric))
-        if len(self.metrics) >= self.batch_size:
-            self.post()
+        self._batch_added()
+
+    def _batch_length(self):
+        return len(self.metrics)
+
+    def _send_batch(self):
+        self.post()
 
     # Overriding flush to post metrics for every collector.
     def flush(self):
@@ -9,9 +9,24 @@ v1.1 : force influxdb driver with SSL
 v1.2 : added a timer to delay influxdb writing in case of failure
        this whill avoid the 100% cpu loop when influx in not responding
        Sebastien Prune THOMAS - prune@lecentre.net
+v1.3 : line protocol writer
 
 #### Dependencies
- * [influxdb](https://github.com/influxdb/influxdb-python)
+ * [influxdb](https://github.com/influxdb/influxdb-python), for the json
+   protocol only
+
+#### Line protocol
+
+With `protocol = line`, metrics are written to the /write endpoint of
+InfluxDB 0.9 and later in the line protocol, without the influxdb module. The
+collector is the measurement, the rest of the metric path the field, and the
+host a tag, so that `servers.web1.cpu.total.idle 97 1000` is written as
+
+    cpu,host=web1 total.idle=97 1000
+
+along with the other fields of the same host and time. The request bodies are
+gzipped, hold at most max_points lines and go over a connection kept alive
+from one request to the next.
 
 
 #### Configuration
@@ -20,24 +35,57 @@ v1.2 : added a timer to delay influxdb writing in case of failure
 hostname = localhost
 port = 8086 #8084 for HTTPS
 batch_size = 100 # default to 1
+batch_max_latency = 1 # seconds, default to 1
 cache_size = 1000 # default to 20000
 username = root
 password = root
 database = graphite
 time_precision = s
+protocol = line # default to json
+tags = dc=us1, rack=r2 # line protocol only
 ```
 """
 
+import httplib
+import math
+import socket
 import time
+import urllib
+from Handler import BatchingMixin
 from Handler import Handler
+from diamond.utils.httpclient import compress
+from diamond.utils.httpclient import KeepAliveConnection
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 needs the ordereddict package
+    from ordereddict import OrderedDict
 
 try:
     from influxdb.client import InfluxDBClient
 except ImportError:
     InfluxDBClient = None
 
+# Multiplier of timestamps in seconds per time precision
+PRECISIONS = {
+    's': 1,
+    'ms': 1000,
+    'u': 1000000,
+}
+
+
+def escape(value, special=', '):
+    """
+    Escape the characters of a measurement, or with special=',= ' of a tag or
+    field key or a tag value, that have a meaning in the line protocol
+    """
+    for char in special:
+        value = value.replace(char, '\\' + char)
+    return value
+
 
-class InfluxdbHandler(Handler):
+class InfluxdbHandler(BatchingMixin, Handler):
     """
     Sending data to Influxdb using batched format
     """
@@ -48,8 +96,14 @@ class InfluxdbHandler(Handler):
         """
         # Initialize Handler
         Handler.__init__(self, config)
+        self._init_batching(self.config['batch_size'],
+                            self.config['batch_max_latency'])
 
-        if not InfluxDBClient:
+        self.protocol = self.config['protocol']
+        if self.protocol not in ('json', 'line'):
+            raise ValueError('Unknown protocol %r' % self.protocol)
+
+        if self.protocol == 'json' and not InfluxDBClient:
             self.log.error('influxdb.client.InfluxDBClient import failed. '
                            'Handler disabled')
             self.enabled = False
@@ -65,7 +119,6 @@ class InfluxdbHandler(Handler):
         self.username = self.config['username']
         self.password = self.config['password']
         self.database = self.config['database']
-        self.batch_size = int(self.config['batch_size'])
         self.metric_max_cache = int(self.config['cache_size'])
         self.batch_count = 0
         self.time_precision = self.config['time_precision']
@@ -76,9 +129,44 @@ class InfluxdbHandler(Handler):
         self.batch_timestamp = time.time()
         self.time_multiplier = 1
 
+        if self.protocol == 'line':
+            self._init_line_protocol()
+            return
+
         # Connect
         self._connect()
 
+    def _init_line_protocol(self):
+        if self.time_precision not in PRECISIONS:
+            raise ValueError('Unknown time_precision %r' % self.time_precision)
+        self.max_points = int(self.config['max_points'])
+        self.compression = self.config['compression']
+        # InfluxDB only takes gzipped request bodies
+        if self.compression not in ('gzip', 'none'):
+            raise ValueError('Unknown compression %r' % self.compression)
+        tags = self.config['tags']
+        if isinstance(tags, basestring):
+            tags = tags.split()
+        self.tags = ''.join(
+            ',%s=%s' % tuple(escape(part.strip(), ',= ')
+                             for part in tag.split('=', 1))
+            for tag in sorted(tags))
+
+        query = urllib.urlencode([
+            ('db', self.database),
+            ('precision', self.time_precision),
+            ('u', self.username),
+            ('p', self.password),
+        ])
+        self.connection = KeepAliveConnection(
+            '%s://%s:%d/write?%s' % ('https' if self.ssl else 'http',
+                                     self.hostname, self.port, query),
+            float(self.config['timeout']))
+
+        # Fields waiting to be written per series and time
+        self.points = OrderedDict()
+        self.retry_at = 0
+
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this handler
@@ -91,6 +179,8 @@ class InfluxdbHandler(Handler):
             'ssl': 'set to True to use HTTPS instead of http',
             'batch_size': 'How many metrics to store before sending to the'
             ' influxdb server',
+            'batch_max_latency': 'Send the batch once its oldest metric waited'
+            ' this many seconds even if not full',
             'cache_size': 'How many values to store in cache in case of'
             ' influxdb failure',
             'username': 'Username for connection',
@@ -98,6 +188,13 @@ class InfluxdbHandler(Handler):
             'database': 'Database name',
             'time_precision': 'time precision in second(s), milisecond(ms) or '
             'microsecond (u)',
+            'protocol': 'json to write series through the influxdb module '
+            '(InfluxDB 0.8), line to write the line protocol (0.9 and later)',
+            'tags': 'Tags added to every point, as a list of key=value, line '
+            'protocol only',
+            'max_points': 'Most lines in one request, line protocol only',
+            'compression': 'gzip or none, line protocol only',
+            'timeout': 'Timeout of the requests in seconds, line protocol only',
         })
 
         return config
@@ -116,8 +213,14 @@ class InfluxdbHandler(Handler):
             'password': 'root',
             'database': 'graphite',
             'batch_size': 1,
+            'batch_max_latency': 1,
             'cache_size': 20000,
             'time_precision': 's',
+            'protocol': 'json',
+            'tags': [],
+            'max_points': 5000,
+            'compression': 'gzip',
+            'timeout': 15,
         })
 
         return config
@@ -129,29 +232,47 @@ class InfluxdbHandler(Handler):
         self._close()
 
     def process(self, metric):
-        if self.batch_count <= self.metric_max_cache:
+        if self.protocol == 'line':
+            self._queue_point(metric)
+        elif self.batch_count <= self.metric_max_cache:
             # Add the data to the batch
             self.batch.setdefault(metric.path, []).append([metric.timestamp,
                                                            metric.value])
             self.batch_count += 1
         # If there are sufficient metrics, then pickle and send
-        if self.batch_count >= self.batch_size and (
-                time.time() - self.batch_timestamp) > 2**self.time_multiplier:
-            # Log
-            self.log.debug(
-                "InfluxdbHandler: Sending batch sizeof : %d/%d after %fs",
-                self.batch_count,
-                self.batch_size,
-                (time.time() - self.batch_timestamp))
-            # reset the batch timer
-            self.batch_timestamp = time.time()
-            # Send pickled batch
-            self._send()
-        else:
+        self._batch_added()
+
+    def flush(self):
+        """Send the metrics in queue"""
+        if self.batch_count:
+            self._send_batch()
+
+    def _batch_length(self):
+        return self.batch_count
+
+    def _send_batch(self):
+        if self.protocol == 'line':
+            self._send_lines()
+            return
+
+        # After a failure wait before trying again
+        if self.time_multiplier > 1 and (
+                time.time() - self.batch_timestamp) <= 2**self.time_multiplier:
             self.log.debug(
                 "InfluxdbHandler: not sending batch of %d as timestamp is %f",
                 self.batch_count,
                 (time.time() - self.batch_timestamp))
+            return
+        # Log
+        self.log.debug(
+            "InfluxdbHandler: Sending batch sizeof : %d/%d after %fs",
+            self.batch_count,
+            self.batch_size,
+            (time.time() - self.batch_timestamp))
+        # reset the batch timer
+        self.batch_timestamp = time.time()
+        # Send pickled batch
+        self._send()
 
     def _send(self):
         """
@@ -193,6 +314,79 @@ class InfluxdbHandler(Handler):
                 2**self.time_multiplier)
             raise
 
+    def _queue_point(self, metric):
+        """
+        Add a metric to the fields of its series at its time, dropping the
+        oldest points above cache_size
+        """
+        # InfluxDB rejects tags without a value, leave the host out then
+        series = escape(metric.getCollectorPath())
+        if metric.host:
+            series += ',host=' + escape(metric.host, ',= ')
+        series += self.tags
+
+        value = metric.value
+        if isinstance(value, float):
+            if math.isnan(value) or math.isinf(value):
+                return
+            value = repr(value)
+        else:
+            value = str(value)
+
+        key = (series, int(metric.timestamp * PRECISIONS[
+            self.time_precision]))
+        fields = self.points.get(key)
+        if fields is None:
+            fields = self.points[key] = []
+        fields.append('%s=%s' % (escape(metric.getMetricPath(), ',= '), value))
+        self.batch_count += 1
+
+        while self.batch_count > self.metric_max_cache:
+            self.batch_count -= len(self.points.popitem(last=False)[1])
+
+    def _send_lines(self):
+        """
+        Write the points waiting, max_points lines per request. The points
+        that could not be written wait for the next batch, after a backoff
+        """
+        if not self.points or time.time() < self.retry_at:
+            return
+
+        headers = {'Content-Type': 'text/plain'}
+        if self.compression == 'gzip':
+            headers['Content-Encoding'] = 'gzip'
+
+        points = self.points.items()
+        written = 0
+        try:
+            while written < len(points):
+                lines = points[written:written + self.max_points]
+                body = '\n'.join(
+                    '%s %s %d' % (series, ','.join(fields), timestamp)
+                    for (series, timestamp), fields in lines)
+                status, data = self.connection.request(
+                    'POST', compress(body, self.compression), headers)
+                if status >= 500:
+                    raise httplib.HTTPException('%d %s' % (status, data))
+                if status >= 300:
+                    # Retrying would not change the mind of InfluxDB
+                    self._throttle_error(
+                        'InfluxdbHandler: InfluxDB refused %d points: %d %s',
+                        len(lines), status, data[:200])
+                written += len(lines)
+            self.time_multiplier = 1
+        except (httplib.HTTPException, socket.error), e:
+            if self.time_multiplier < 5:
+                self.time_multiplier += 1
+            self.retry_at = time.time() + 2 ** self.time_multiplier
+            self._throttle_error(
+                "InfluxdbHandler: Error sending metrics, waiting for %ds: %s",
+                2 ** self.time_multiplier, e)
+        finally:
+            for key, fields in points[:written]:
+                del self.points[key]
+                self.batch_count -= len(fields)
+
     def _connect(self):
         """
         Connect to the influxdb server
@@ -221,3 +415,5 @@ class InfluxdbHandler(Handler):
         Close the socket = do nothing for influx which is http stateless
         """
         self.influx = None
+        if getattr(self, 'connection', None) is not None:
+            self.connection.close()
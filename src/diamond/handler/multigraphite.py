@@ -4,11 +4,21 @@
 Send metrics to a [graphite](http://graphite.wikidot.com/) using the default
 interface. Unlike GraphiteHandler, this one supports multiple graphite servers.
 Specify them as a list of hosts divided by comma.
+
+Every metric goes to every server by default. With sharding set to
+consistent_hashing each metric goes to replication_factor of them instead,
+picked by the consistent hash ring carbon-relay uses. A host can then be given
+as host:port:instance like a carbon-relay destination. Metrics of a server that
+is down go to the next one on the ring until it is back.
 """
 
 from Handler import Handler
 from graphite import GraphiteHandler
+from diamond.utils.hashing import ConsistentHashRing
 from copy import deepcopy
+import re
+
+DESTINATION = re.compile(r'^(\[[^\]]+\]|[^:]+)(?::(\d+))?(?::(\w+))?$')
 
 
 class MultiGraphiteHandler(Handler):
@@ -25,13 +35,43 @@ class MultiGraphiteHandler(Handler):
         Handler.__init__(self, config)
 
         self.handlers = []
+        self.nodes = {}
+        self.down = set()
 
         # Initialize Options
+        self.sharding = self.config['sharding']
+        if self.sharding not in ('none', 'consistent_hashing'):
+            raise ValueError('Unknown sharding mode %r' % self.sharding)
+        self.replication_factor = int(self.config['replication_factor'])
+        self.ring = ConsistentHashRing()
+
         hosts = self.config['host']
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
         for host in hosts:
             config = deepcopy(self.config)
-            config['host'] = host
-            self.handlers.append(GraphiteHandler(config))
+            node = None
+            match = DESTINATION.match(host)
+            if match:
+                server, port, instance = match.groups()
+                config['host'] = server.strip('[]')
+                if port:
+                    config['port'] = port
+                node = (server, instance)
+            else:
+                config['host'] = host
+                node = (host, None)
+            handler = self._create_handler(config)
+            self.handlers.append(handler)
+            if node not in self.nodes:
+                self.nodes[node] = handler
+                self.ring.add_node(node)
+
+        if self.sharding != 'none':
+            self._update_down()
+
+    def _create_handler(self, config):
+        return GraphiteHandler(config)
 
     def get_default_config_help(self):
         """
@@ -45,8 +85,16 @@ class MultiGraphiteHandler(Handler):
             'proto': 'udp or tcp',
             'timeout': '',
             'batch': 'How many to store before sending to the graphite server',
+            'batch_max_latency': 'Send the batch once its oldest metric '
+                                 'waited this many seconds even if not full',
             'max_backlog_multiplier': 'how many batches to store before trimming',  # NOQA
             'trim_backlog_multiplier': 'Trim down how many batches',
+            'sharding': 'none to send every metric to every host, '
+                        'consistent_hashing to send each metric to '
+                        'replication_factor hosts picked like carbon-relay '
+                        'does',
+            'replication_factor': 'How many hosts each metric is sent to '
+                                  'when sharding',
         })
 
         return config
@@ -63,8 +111,11 @@ class MultiGraphiteHandler(Handler):
             'proto': 'tcp',
             'timeout': 15,
             'batch': 1,
+            'batch_max_latency': 1,
             'max_backlog_multiplier': 5,
             'trim_backlog_multiplier': 4,
+            'sharding': 'none',
+            'replication_factor': 1,
         })
 
         return config
@@ -74,10 +125,63 @@ class MultiGraphiteHandler(Handler):
         Process a metric by passing it to GraphiteHandler
         instances
         """
-        for handler in self.handlers:
+        if self.sharding == 'none':
+            for handler in self.handlers:
+                handler.process(metric)
+            return
+
+        for handler in self.get_handlers(metric.path):
             handler.process(metric)
 
+    def get_handlers(self, path):
+        """
+        Return the handlers of the replication_factor first servers up on the
+        ring for path, or of the first ones on the ring if all are down
+        """
+        nodes = []
+        fallback = []
+        for node in self.ring.get_nodes(path):
+            if node not in self.down:
+                nodes.append(node)
+                if len(nodes) == self.replication_factor:
+                    break
+            elif len(fallback) < self.replication_factor:
+                fallback.append(node)
+        if not nodes:
+            nodes = fallback
+        return [self.nodes[node] for node in nodes]
+
+    def _update_down(self):
+        """
+        Mark the servers without a connection as down so their metrics go to
+        the next servers on the ring, and back up once they reconnected
+        """
+        for node, handler in self.nodes.iteritems():
+            connected = handler.is_connected()
+            if not connected and node not in self.down:
+                self.log.warning('%s: %s is down, sharding its metrics to '
+                                 'the next hosts', self.__class__.__name__,
+                                 node[0])
+                self.down.add(node)
+            elif connected and node in self.down:
+                self.log.info('%s: %s is back up', self.__class__.__name__,
+                              node[0])
+                self.down.discard(node)
+
+    def batch_deadline(self):
+        deadlines = [handler.batch_deadline() for handler in self.handlers]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def _tick(self, now):
+        for handler in self.handlers:
+            handler._tick(now)
+
     def flush(self):
         """Flush metrics in queue"""
         for handler in self.handlers:
             handler.flush()
+        if self.sharding != 'none':
+            self._update_down()
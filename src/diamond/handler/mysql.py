@@ -2,13 +2,22 @@
 
 """
 Insert the collected values into a mysql table
+
+Metrics are buffered and inserted batch of them at a time, max_rows rows per
+INSERT statement, all the statements of a batch in one transaction. When
+MySQL is unreachable the rows wait for the next batch, up to max_buffer rows.
 """
 
+from Handler import BatchingMixin
 from Handler import Handler
-import MySQLdb
+
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
 
 
-class MySQLHandler(Handler):
+class MySQLHandler(BatchingMixin, Handler):
     """
     Implements the abstract Handler class, sending data to a mysql table
     """
@@ -21,6 +30,15 @@ class MySQLHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config)
 
+        self.rows = []
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_latency'])
+
+        if MySQLdb is None:
+            self.log.error('MySQLdb import failed. Handler disabled')
+            self.enabled = False
+            return
+
         # Initialize Options
         self.hostname = self.config['hostname']
         self.port = int(self.config['port'])
@@ -31,9 +49,18 @@ class MySQLHandler(Handler):
         self.col_time = self.config['col_time']
         self.col_metric = self.config['col_metric']
         self.col_value = self.config['col_value']
+        self.max_rows = int(self.config['max_rows'])
+        self.max_buffer = int(self.config['max_buffer'])
+
+        self.query = ("INSERT INTO %s (%s, %s, %s) VALUES(%%s, %%s, %%s)"
+                      % (self.table, self.col_metric, self.col_time,
+                         self.col_value))
 
         # Connect
-        self._connect()
+        try:
+            self._connect()
+        except MySQLdb.Error, e:
+            self._throttle_error("MySQLHandler: Failed to connect. %s.", e)
 
     def get_default_config_help(self):
         """
@@ -42,6 +69,13 @@ class MySQLHandler(Handler):
         config = super(MySQLHandler, self).get_default_config_help()
 
         config.update({
+            'batch': 'How many rows to buffer before inserting them',
+            'batch_max_latency': 'Insert the rows once the oldest waited this '
+                                 'many seconds even if fewer than batch, 0 to '
+                                 'wait for a full batch or a flush',
+            'max_rows': 'Most rows inserted by one INSERT statement',
+            'max_buffer': 'Most rows kept while MySQL is unreachable, the '
+                          'oldest are dropped first',
         })
 
         return config
@@ -53,6 +87,10 @@ class MySQLHandler(Handler):
         config = super(MySQLHandler, self).get_default_config()
 
         config.update({
+            'batch': 1000,
+            'batch_max_latency': 1,
+            'max_rows': 500,
+            'max_buffer': 100000,
         })
 
         return config
@@ -67,27 +105,66 @@ class MySQLHandler(Handler):
         """
         Process a metric
         """
-        # Just send the data
-        self._send(str(metric))
+        fstring = "%%0.%if" % metric.precision
+        self.rows.append((metric.path, int(metric.timestamp),
+                          fstring % metric.value))
+        self._batch_added()
+
+    def _batch_length(self):
+        return len(self.rows)
+
+    def _send_batch(self):
+        self._send()
+
+    def flush(self):
+        self._send()
 
-    def _send(self, data):
+    def _send(self):
         """
-        Insert the data
+        Insert the rows buffered in one transaction, trying again once over
+        a new connection if it fails
         """
-        data = data.strip().split(' ')
+        if not self.rows:
+            return
+
+        for attempt in (1, 2):
+            try:
+                if self.conn is None:
+                    self._connect()
+                self._insert(self.rows)
+                self.rows = []
+                return
+            except MySQLdb.Error, e:
+                # Log Error
+                self._throttle_error("MySQLHandler: Failed sending data. %s.",
+                                     e)
+                # Attempt to restablish connection
+                self._close()
+
+        if len(self.rows) > self.max_buffer:
+            dropped = len(self.rows) - self.max_buffer
+            del self.rows[:dropped]
+            self._throttle_error("MySQLHandler: Dropped %d rows.", dropped)
+
+    def _insert(self, rows):
+        """
+        Insert rows, max_rows per statement, and commit them at once
+        """
+        cursor = self.conn.cursor()
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO %s (%s, %s, %s) VALUES(%%s, %%s, %%s)"
-                           % (self.table, self.col_metric,
-                              self.col_time, self.col_value),
-                           (data[0], data[2], data[1]))
-            cursor.close()
+            for start in xrange(0, len(rows), self.max_rows):
+                # MySQLdb turns executemany into a multi-row INSERT
+                cursor.executemany(self.query,
+                                   rows[start:start + self.max_rows])
             self.conn.commit()
-        except BaseException, e:
-            # Log Error
-            self.log.error("MySQLHandler: Failed sending data. %s.", e)
-            # Attempt to restablish connection
-            self._connect()
+        except MySQLdb.Error:
+            try:
+                self.conn.rollback()
+            except MySQLdb.Error:
+                pass
+            raise
+        finally:
+            cursor.close()
 
     def _connect(self):
         """
@@ -105,5 +182,8 @@ class MySQLHandler(Handler):
         Close the connection
         """
         if self.conn:
-            self.conn.commit()
-            self.conn.close()
+            try:
+                self.conn.close()
+            except MySQLdb.Error:
+                pass
+        self.conn = None
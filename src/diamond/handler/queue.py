@@ -6,6 +6,7 @@ do not try to use it as a normal handler
 """
 
 from Handler import Handler
+from diamond.metric import MetricBatch
 import Queue
 
 
@@ -17,6 +18,15 @@ class QueueHandler(Handler):
 
         self.queue = queue
 
+        # Metrics are shipped to the handler process once per collector run,
+        # or every batch_size metrics for collectors publishing a lot
+        self.batch_size = int(self.config.get('server', {}).get(
+            'metric_batch_size', 1024))
+        self.metrics = []
+
+        # Metrics dropped because the queue was full
+        self.dropped = 0
+
     def __del__(self):
         """
         Ensure as many of the metrics as possible are sent to the handers on
@@ -32,10 +42,17 @@ class QueueHandler(Handler):
         We skip any locking code due to the fact that this is now a single
         process per collector
         """
-        try:
-            self.queue.put(metric, block=False)
-        except Queue.Full:
-            self._throttle_error('Queue full, check handlers for delays')
+        self.metrics.append(metric)
+        if len(self.metrics) >= self.batch_size:
+            self._send(flush=False)
+
+    def _process_many(self, metrics):
+        self.metrics.extend(metrics)
+        while len(self.metrics) >= self.batch_size:
+            pending = self.metrics[self.batch_size:]
+            self.metrics = self.metrics[:self.batch_size]
+            self._send(flush=False)
+            self.metrics = pending
 
     def flush(self):
         return self._flush()
@@ -45,8 +62,17 @@ class QueueHandler(Handler):
         We skip any locking code due to the fact that this is now a single
         process per collector
         """
-        # Send a None down the queue to indicate a flush
+        # The flush is implied at the end of the batch
+        self._send(flush=True)
+
+    def _send(self, flush):
+        """
+        Put the pending metrics down the queue as a single batch
+        """
+        batch = MetricBatch(self.metrics, flush=flush)
+        self.metrics = []
         try:
-            self.queue.put(None, block=False)
+            self.queue.put(batch, block=False)
         except Queue.Full:
+            self.dropped += len(batch.metrics)
             self._throttle_error('Queue full, check handlers for delays')
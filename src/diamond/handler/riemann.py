@@ -15,41 +15,74 @@ It has these options:
  * `host` - The Riemann host to connect to.
  * `port` - The port it's on.
  * `transport` - Either `tcp` or `udp`. (default: `tcp`)
+ * `batch` - How many events go in one message. (default: `100`)
+ * `batch_max_latency` - Send the message once its oldest event waited this
+   many seconds even if not full. (default: `1`)
+ * `acks` - `sync` to wait for Riemann to acknowledge each message before
+   sending the next one, `async` to keep sending and read the
+   acknowledgements as they come in. (default: `sync`)
+
+Events are buffered and sent many to a Riemann message. While Riemann is
+unreachable, they wait for a reconnect, retried with an exponential backoff,
+up to max_queue_size events.
 
 """
 
+from Handler import BatchingMixin
 from Handler import Handler
 import logging
+import select
+import socket
+import struct
+import time
 
 try:
-    from riemann_client.transport import TCPTransport, UDPTransport
-    from riemann_client.client import Client
+    from riemann_client import riemann_pb2
     riemann_client = True
 except ImportError:
     riemann_client = None
 
 
-class RiemannHandler(Handler):
+class RiemannHandler(BatchingMixin, Handler):
 
     def __init__(self, config=None):
         # Initialize Handler
         Handler.__init__(self, config)
 
+        self.socket = None
+        # Events waiting to be sent, as (host, service, time, metric, ttl)
+        self.events = []
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_latency'])
+
         if riemann_client is None:
             logging.error("Failed to load riemann_client module")
+            self.enabled = False
             return
 
         # Initialize options
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.transport = self.config['transport']
+        self.timeout = float(self.config['timeout'])
+        self.acks = self.config['acks']
+        if self.acks not in ('sync', 'async'):
+            raise ValueError('Unknown acks %r' % self.acks)
+        self.max_pending_acks = int(self.config['max_pending_acks'])
+        self.max_queue_size = int(self.config['max_queue_size'])
+        self.backoff = float(self.config['reconnect_backoff'])
+        self.max_backoff = float(self.config['reconnect_max_backoff'])
+
+        self.hostname = socket.gethostname()
+
+        # Messages sent and not acknowledged yet, and what was read of the
+        # acknowledgements
+        self.pending_acks = 0
+        self.ack_buffer = ''
+        self.rejected = 0
 
-        # Initialize client
-        if self.transport == 'tcp':
-            self.transport = TCPTransport(self.host, self.port)
-        else:
-            self.transport = UDPTransport(self.host, self.port)
-        self.client = Client(self.transport)
+        self.retry_at = 0
+        self.retry_backoff = self.backoff
         self._connect()
 
     def get_default_config_help(self):
@@ -62,6 +95,19 @@ class RiemannHandler(Handler):
             'host': '',
             'port': '',
             'transport': 'tcp or udp',
+            'timeout': 'Socket timeout in seconds',
+            'batch': 'How many events to send in one message',
+            'batch_max_latency': 'Send the message once its oldest event '
+                                 'waited this many seconds even if not full, '
+                                 '0 to wait for a full message or a flush',
+            'acks': 'sync to wait for the acknowledgement of each message, '
+                    'async to read them as they come in (tcp only)',
+            'max_pending_acks': 'How many messages may wait for their '
+                                'acknowledgement with async acks',
+            'max_queue_size': 'Most events kept while Riemann is '
+                              'unreachable, the oldest are dropped first',
+            'reconnect_backoff': 'Seconds to wait before the first reconnect',
+            'reconnect_max_backoff': 'Most seconds to wait between reconnects',
         })
 
         return config
@@ -76,49 +122,187 @@ class RiemannHandler(Handler):
             'host': '',
             'port': 123,
             'transport': 'tcp',
+            'timeout': 10,
+            'batch': 100,
+            'batch_max_latency': 1,
+            'acks': 'sync',
+            'max_pending_acks': 100,
+            'max_queue_size': 100000,
+            'reconnect_backoff': 1,
+            'reconnect_max_backoff': 60,
         })
 
         return config
 
     def process(self, metric):
         """
-        Send a metric to Riemann.
+        Queue a metric to be sent to Riemann.
         """
-        event = self._metric_to_riemann_event(metric)
-        try:
-            self.client.send_event(event)
-        except Exception, e:
-            self.log.error(
-                "RiemannHandler: Error sending event to Riemann: %s", e)
+        self.events.append(self._metric_to_riemann_event(metric))
+        self._batch_added()
 
     def _metric_to_riemann_event(self, metric):
         """
-        Convert a metric to a dictionary representing a Riemann event.
+        Convert a metric to the fields of a Riemann event.
         """
         # Riemann has a separate "host" field, so remove from the path.
-        path = '%s.%s.%s' % (
+        service = '%s.%s.%s' % (
             metric.getPathPrefix(),
             metric.getCollectorPath(),
             metric.getMetricPath()
         )
 
-        return self.client.create_event({
-            'host': metric.host,
-            'service': path,
-            'time': metric.timestamp,
-            'metric_f': float(metric.value),
-            'ttl': metric.ttl,
-        })
+        return (metric.host, service, metric.timestamp, float(metric.value),
+                metric.ttl)
+
+    def _serialize(self, events):
+        """
+        Serialize events as one Riemann message
+        """
+        message = riemann_pb2.Msg()
+        for host, service, timestamp, value, ttl in events:
+            event = message.events.add()
+            event.host = host or self.hostname
+            event.service = service
+            event.time = int(timestamp)
+            event.metric_f = value
+            if ttl is not None:
+                event.ttl = ttl
+        return message.SerializeToString()
+
+    def _batch_length(self):
+        return len(self.events)
+
+    def _send_batch(self):
+        self._send()
+
+    def flush(self):
+        self._send()
+
+    def _send(self):
+        """
+        Send the events waiting, batch_size of them per message
+        """
+        if self.socket is None and self.events:
+            self._connect()
+        while self.socket is not None and self.events:
+            events = self.events[:self.batch_size]
+            data = self._serialize(events)
+            try:
+                if self.transport == 'udp':
+                    self.socket.send(data)
+                else:
+                    self.socket.sendall(struct.pack('!I', len(data)) + data)
+                    self.pending_acks += 1
+                    if self.acks == 'sync':
+                        # Sent again over the next connection if unanswered
+                        self._read_acks(0)
+            except (socket.error, ValueError), e:
+                self._throttle_error('RiemannHandler: Error sending events '
+                                     'to Riemann: %s', e)
+                self._disconnect()
+                break
+            del self.events[:len(events)]
+
+            if self.transport == 'tcp' and self.acks == 'async':
+                try:
+                    self._read_acks(self.max_pending_acks)
+                except (socket.error, ValueError), e:
+                    self._throttle_error('RiemannHandler: Error reading '
+                                         'acknowledgements from Riemann: %s',
+                                         e)
+                    self._disconnect()
+                    break
+
+        if len(self.events) > self.max_queue_size:
+            dropped = len(self.events) - self.max_queue_size
+            del self.events[:dropped]
+            self._throttle_error('RiemannHandler: Riemann unreachable, '
+                                 'dropped %d events', dropped)
+
+    def _read_acks(self, max_pending):
+        """
+        Read the acknowledgements of the messages sent that came in, waiting
+        for more of them while over max_pending are outstanding
+        """
+        while self.pending_acks:
+            if self.pending_acks <= max_pending:
+                if not select.select([self.socket], [], [], 0)[0]:
+                    return
+            data = self.socket.recv(65536)
+            if not data:
+                raise socket.error('Connection closed by Riemann')
+            self.ack_buffer += data
+
+            while len(self.ack_buffer) >= 4:
+                length = struct.unpack('!I', self.ack_buffer[:4])[0]
+                if len(self.ack_buffer) < 4 + length:
+                    break
+                response = riemann_pb2.Msg()
+                response.ParseFromString(self.ack_buffer[4:4 + length])
+                self.ack_buffer = self.ack_buffer[4 + length:]
+                self.pending_acks -= 1
+                if not response.ok:
+                    self.rejected += 1
+                    self._throttle_error('RiemannHandler: Riemann rejected '
+                                         'events: %s', response.error)
 
     def _connect(self):
-        self.transport.connect()
+        """
+        Connect to Riemann, waiting longer between attempts while it fails
+        """
+        if time.time() < self.retry_at:
+            return False
+        try:
+            if self.transport == 'udp':
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect((self.host, self.port))
+            else:
+                sock = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+            sock.settimeout(self.timeout)
+        except socket.error, e:
+            self._throttle_error('RiemannHandler: Failed to connect to '
+                                 '%s:%d, retrying in %.1fs: %s', self.host,
+                                 self.port, self.retry_backoff, e)
+            self.retry_at = time.time() + self.retry_backoff
+            self.retry_backoff = min(self.retry_backoff * 2, self.max_backoff)
+            return False
+
+        self.socket = sock
+        self.retry_backoff = self.backoff
+        self.pending_acks = 0
+        self.ack_buffer = ''
+        return True
+
+    def _disconnect(self):
+        """
+        Drop a failed connection, reconnect once the backoff passed
+        """
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        self.socket = None
+        self.retry_at = time.time() + self.retry_backoff
 
     def _close(self):
         """
         Disconnect from Riemann.
         """
-        if hasattr(self, 'transport'):
-            self.transport.disconnect()
+        if getattr(self, 'socket', None) is None:
+            return
+        if self.pending_acks:
+            # Take what Riemann acknowledged before leaving
+            try:
+                self._read_acks(0)
+            except (socket.error, ValueError):
+                pass
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        self.socket = None
 
     def __del__(self):
         self._close()
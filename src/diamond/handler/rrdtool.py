@@ -2,14 +2,27 @@
 
 """
 Save stats in RRD files using rrdtool.
+
+With the daemon option set, the RRD files are created and updated through
+[rrdcached](http://oss.oetiker.ch/rrdtool/doc/rrdcached.en.html): the updates
+of a flush go in one BATCH over a persistent connection. Otherwise, or while
+rrdcached is unreachable, the files are written in-process through the rrdtool
+python bindings if installed, by running the rrdtool commands if not.
 """
 
+from __future__ import absolute_import
+
 import os
 import re
+import socket
 import subprocess
-import Queue
 
-from Handler import Handler
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None
+
+from diamond.handler.Handler import Handler
 
 #
 # Constants for RRD file creation.
@@ -26,6 +39,8 @@ METRIC_STEP = 10
 
 BATCH_SIZE = 1
 
+RRDCACHED_PORT = 42217
+
 # NOTE: We don't really have a rigorous defition
 # for metrics, particularly how often they will be
 # reported, etc. Because of this, we have to guess
@@ -57,6 +72,95 @@ RRA_SPECS = [
 ]
 
 
+class RRDCachedError(Exception):
+    pass
+
+
+class RRDCachedClient(object):
+    """
+    A connection to rrdcached, at unix:<path> or <path> for a UNIX socket,
+    <host>[:<port>] for TCP
+    """
+
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self.socket = None
+        self.file = None
+
+    def _create_socket(self):
+        if self.address.startswith('unix:') or self.address.startswith('/'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            target = self.address.split('unix:', 1)[-1]
+        else:
+            host, _, port = self.address.partition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            target = (host, int(port or RRDCACHED_PORT))
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(target)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def connect(self):
+        if self.socket is None:
+            self.socket = self._create_socket()
+            self.file = self.socket.makefile('rb')
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.file.close()
+                self.socket.close()
+            except socket.error:
+                pass
+        self.socket = None
+        self.file = None
+
+    def _read_line(self):
+        line = self.file.readline()
+        if not line.endswith('\n'):
+            raise socket.error('Connection closed by rrdcached')
+        return line.rstrip('\n')
+
+    def _read_response(self):
+        """
+        Read a status line and the lines that follow it, rrdcached answers
+        <status> <message> with a negative status on errors, else the number
+        of lines that follow
+        """
+        status, _, message = self._read_line().partition(' ')
+        status = int(status)
+        lines = []
+        for i in range(max(status, 0)):
+            lines.append(self._read_line())
+        return status, message, lines
+
+    def command(self, command):
+        self.connect()
+        self.socket.sendall(command + '\n')
+        status, message, lines = self._read_response()
+        if status < 0:
+            raise RRDCachedError(message)
+        return lines
+
+    def batch(self, commands):
+        """
+        Send commands in one BATCH, returns the errors as a list of
+        (command, message)
+        """
+        self.command('BATCH')
+        self.socket.sendall(''.join(command + '\n' for command in commands) +
+                            '.\n')
+        errors = []
+        for line in self._read_response()[2]:
+            index, _, message = line.partition(' ')
+            errors.append((commands[int(index) - 1], message))
+        return errors
+
+
 class RRDHandler(Handler):
 
     # NOTE: This handler is fairly loose about locking (none),
@@ -79,12 +183,21 @@ class RRDHandler(Handler):
         self._queues = {}
         self._last_update = {}
 
+        self._client = None
+        if self.config['daemon']:
+            self._client = RRDCachedClient(self.config['daemon'],
+                                           float(self.config['timeout']))
+
     def get_default_config_help(self):
         config = super(RRDHandler, self).get_default_config_help()
         config.update({
             'basedir': 'The base directory for all RRD files.',
             'batch': 'Wait for this many updates before saving to the RRD file',
             'step': 'The minimum interval represented in generated RRD files.',
+            'daemon': 'Address of rrdcached, unix:<path> or <host>[:<port>]. '
+                      'When set, the updates of a flush are sent in one '
+                      'batch and batch is ignored',
+            'timeout': 'Timeout of the rrdcached connection in seconds',
         })
         return config
 
@@ -94,6 +207,8 @@ class RRDHandler(Handler):
             'basedir': BASEDIR,
             'batch': BATCH_SIZE,
             'step': METRIC_STEP,
+            'daemon': '',
+            'timeout': 10,
         })
         return config
 
@@ -131,6 +246,28 @@ class RRDHandler(Handler):
 
         ds_spec = "DS:%s:%s:%d:U:U" % (
             metric_name, metric_type, self._step * 2)
+
+        if self._client is not None:
+            try:
+                self._call_daemon(self._client.command, ' '.join(
+                    ["CREATE", filename, "-s", str(self._step), "-O",
+                     ds_spec] + RRA_SPECS))
+                return
+            except RRDCachedError, e:
+                # Created meanwhile, or by an earlier run of a remote daemon
+                if 'exist' not in str(e).lower():
+                    raise
+                return
+            except (socket.error, ValueError):
+                self._throttle_error('RRDHandler: rrdcached unreachable at '
+                                     '%s, writing the RRD files in-process',
+                                     self.config['daemon'], exc_info=True)
+
+        if rrdtool is not None:
+            rrdtool.create(filename, "--no-overwrite",
+                           "--step", str(self._step), ds_spec, *RRA_SPECS)
+            return
+
         rrd_create_cmd = [
             "rrdtool", "create", filename,
             "--no-overwrite",
@@ -155,69 +292,131 @@ class RRDHandler(Handler):
         # we would like to have exceptions related to creating
         # the RRD file raised in the main thread.
         self._ensure_exists(filename, metric_name, metric.metric_type)
-        if self._queue(filename, metric.timestamp, metric.value) >= self._batch:
+        queued = self._queue(filename, metric.timestamp, metric.value)
+        if self._client is None and queued >= self._batch:
             self._flush_queue(filename)
 
     def _queue(self, filename, timestamp, value):
-        if filename not in self._queues:
-            queue = Queue.Queue()
-            self._queues[filename] = queue
-        else:
-            queue = self._queues[filename]
-        queue.put((timestamp, value))
-        return queue.qsize()
+        queue = self._queues.get(filename)
+        if queue is None:
+            queue = self._queues[filename] = []
+        queue.append((timestamp, value))
+        return len(queue)
 
     def flush(self):
+        if self._client is not None:
+            self._flush_daemon()
+            return
+
         # Grab all current queues.
         for filename in self._queues.keys():
             self._flush_queue(filename)
 
+    def _flush_daemon(self):
+        """
+        Send the updates of all the RRD files in one batch, write them
+        in-process if rrdcached does not take them
+        """
+        updates = []
+        for filename in self._queues.keys():
+            data_points = self._data_points(filename)
+            if data_points:
+                updates.append((filename, data_points))
+        if not updates:
+            return
+
+        commands = ['UPDATE %s %s' % (rrd_file, ' '.join(points))
+                    for rrd_file, points in updates]
+        try:
+            errors = self._call_daemon(self._client.batch, commands)
+        except (socket.error, ValueError, RRDCachedError):
+            self._throttle_error('RRDHandler: rrdcached unreachable at %s, '
+                                 'writing the RRD files in-process',
+                                 self.config['daemon'], exc_info=True)
+            for filename, data_points in updates:
+                self._update(filename, data_points)
+            return
+
+        for command, message in errors:
+            self._throttle_error('RRDHandler: rrdcached failed %s: %s',
+                                 command, message)
+
+    def _call_daemon(self, method, *args):
+        """
+        Call a method of the rrdcached client, again on a new connection if
+        the one kept open went stale
+        """
+        try:
+            return method(*args)
+        except (socket.error, ValueError):
+            self._client.close()
+        try:
+            return method(*args)
+        except (socket.error, ValueError):
+            self._client.close()
+            raise
+
     def _flush_queue(self, filename):
-        queue = self._queues[filename]
+        data_points = self._data_points(filename)
+        if data_points:
+            self._update(filename, data_points)
+
+    def _data_points(self, filename):
+        """
+        Take the pending updates of an RRD file, as a sorted list of
+        <time>:<value1>[:<value2>...]
+        """
+        queue = self._queues.pop(filename, None)
+        if not queue:
+            return []
 
         # Collect all pending updates.
         updates = {}
-        max_timestamp = 0
-        while True:
-            try:
-                (timestamp, value) = queue.get(block=False)
-                # RRD only supports granularity at a
-                # per-second level (not milliseconds, etc.).
-                timestamp = int(timestamp)
-
-                # Remember the latest update done.
-                last_update = self._last_update.get(filename, 0)
-                if last_update >= timestamp:
-                    # Yikes. RRDtool won't let us do this.
-                    # We need to drop this update and log a warning.
-                    self.log.warning(
-                        "Dropping update to %s. Too frequent!" % filename)
-                    continue
-                max_timestamp = max(timestamp, max_timestamp)
-
-                # Add this update.
-                if timestamp not in updates:
-                    updates[timestamp] = []
-                updates[timestamp].append(value)
-            except Queue.Empty:
-                break
+        last_update = self._last_update.get(filename, 0)
+        max_timestamp = last_update
+        for timestamp, value in queue:
+            # RRD only supports granularity at a
+            # per-second level (not milliseconds, etc.).
+            timestamp = int(timestamp)
+
+            # Remember the latest update done.
+            if last_update >= timestamp:
+                # Yikes. RRDtool won't let us do this.
+                # We need to drop this update and log a warning.
+                self.log.warning(
+                    "Dropping update to %s. Too frequent!" % filename)
+                continue
+            max_timestamp = max(timestamp, max_timestamp)
+
+            # Add this update.
+            if timestamp not in updates:
+                updates[timestamp] = []
+            updates[timestamp].append(value)
 
         # Save the last update time.
         self._last_update[filename] = max_timestamp
 
-        if len(updates) > 0:
-            # Construct our command line.
-            # This will look like <time>:<value1>[:<value2>...]
-            # The timestamps must be sorted, and we each of the
-            # <time> values must be unique (like a snowflake).
-            data_points = map(
-                lambda (timestamp, values): "%d:%s" %
-                (timestamp, ":".join(map(str, values))),
-                sorted(updates.items()))
-
-            # Optimisticly update.
-            # Nothing can really be done if we fail.
-            rrd_update_cmd = ["rrdupdate", filename, "--"]
-            rrd_update_cmd.extend(data_points)
-            self.log.info("update: %s" % str(rrd_update_cmd))
-            subprocess.call(rrd_update_cmd)
+        # The timestamps must be sorted, and we each of the
+        # <time> values must be unique (like a snowflake).
+        return ["%d:%s" % (update_time, ":".join(map(str, values)))
+                for update_time, values in sorted(updates.items())]
+
+    def _update(self, filename, data_points):
+        # Optimisticly update.
+        # Nothing can really be done if we fail.
+        if rrdtool is not None:
+            try:
+                rrdtool.update(filename, *data_points)
+            except Exception:
+                self._throttle_error('RRDHandler: Failed to update %s',
+                                     filename, exc_info=True)
+            return
+
+        rrd_update_cmd = ["rrdupdate", filename, "--"]
+        rrd_update_cmd.extend(data_points)
+        self.log.info("update: %s" % str(rrd_update_cmd))
+        subprocess.call(rrd_update_cmd)
+
+    def _close(self):
+        if self._client is not None:
+            self._client.close()
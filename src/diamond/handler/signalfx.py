@@ -16,34 +16,32 @@ Enable this handler
  * auth_token = SIGNALFX_AUTH_TOKEN
  * batch_size = [optional | 300 ] will wait for this many requests before
      posting
+ * batch_max_interval = [optional | 10 ] will post a smaller batch once its
+     oldest metric waited this many seconds
 """
 
+from Handler import BatchingMixin
 from Handler import Handler
 from diamond.util import get_diamond_version
 import json
 import logging
-import time
 import urllib2
 
 
-class SignalfxHandler(Handler):
+class SignalfxHandler(BatchingMixin, Handler):
 
     # Inititalize Handler with url and batch size
     def __init__(self, config=None):
         Handler.__init__(self, config)
         self.metrics = []
-        self.batch_size = int(self.config['batch'])
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_interval'])
         self.url = self.config['url']
         self.auth_token = self.config['auth_token']
-        self.batch_max_interval = self.config['batch_max_interval']
-        self.resetBatchTimeout()
         if self.auth_token == "":
             logging.error("Failed to load Signalfx module")
             return
 
-    def resetBatchTimeout(self):
-        self.batch_max_timestamp = int(time.time() + self.batch_max_interval)
-
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this handler
@@ -53,6 +51,8 @@ class SignalfxHandler(Handler):
         config.update({
             'url': 'Where to send metrics',
             'batch': 'How many to store before sending',
+            'batch_max_interval': 'Send the batch once its oldest metric '
+                                  'waited this many seconds even if not full',
             'auth_token': 'Org API token to use when sending metrics',
         })
 
@@ -79,12 +79,13 @@ class SignalfxHandler(Handler):
         Queue a metric.  Flushing queue if batch size reached
         """
         self.metrics.append(metric)
-        if self.should_flush():
-            self._send()
+        self._batch_added()
+
+    def _batch_length(self):
+        return len(self.metrics)
 
-    def should_flush(self):
-        return len(self.metrics) >= self.batch_size or \
-            time.time() >= self.batch_max_timestamp
+    def _send_batch(self):
+        self._send()
 
     def into_signalfx_point(self, metric):
         """
@@ -131,7 +132,6 @@ class SignalfxHandler(Handler):
                               {"Content-type": "application/json",
                                "X-SF-TOKEN": self.auth_token,
                                "User-Agent": self.user_agent()})
-        self.resetBatchTimeout()
         try:
             urllib2.urlopen(req)
         except urllib2.URLError:
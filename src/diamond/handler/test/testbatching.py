@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import logging
+import threading
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.Handler import BatchingMixin
+from diamond.handler.Handler import Handler
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.graphitepickle import GraphitePickleHandler
+from diamond.metric import Metric
+from diamond.utils.dispatch import InlineHandlerWorker
+from diamond.utils.dispatch import ThreadHandlerWorker
+
+
+class BufferHandler(BatchingMixin, Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self._init_batching(self.config['batch'],
+                            self.config['batch_max_latency'])
+        self.buffer = []
+        self.sent = []
+        self.fail = False
+        self.done = threading.Event()
+
+    def get_default_config(self):
+        config = super(BufferHandler, self).get_default_config()
+        config.update({
+            'batch': 3,
+            'batch_max_latency': 0,
+        })
+        return config
+
+    def process(self, metric):
+        self.buffer.append(metric.value)
+        self._batch_added()
+
+    def flush(self):
+        self._send_batch()
+
+    def _batch_length(self):
+        return len(self.buffer)
+
+    def _send_batch(self):
+        if self.fail:
+            return
+        self.sent.append(self.buffer)
+        self.buffer = []
+        self.done.set()
+
+
+def fake_connect(self):
+    self.socket = Mock()
+
+
+def get_metrics(*values):
+    return [Metric('servers.host.cpu.total', v, timestamp=1) for v in values]
+
+
+class TestBatchingMixin(unittest.TestCase):
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config.update(options)
+        return BufferHandler(config)
+
+    def test_size(self):
+        handler = self.get_handler()
+        handler._process_many(get_metrics(1, 2, 3, 4))
+
+        self.assertEqual(handler.sent, [[1, 2, 3]])
+        self.assertEqual(handler.buffer, [4])
+        # No latency threshold
+        self.assertEqual(handler.batch_deadline(), None)
+
+    def test_latency(self):
+        handler = self.get_handler(batch=100, batch_max_latency=5)
+        self.assertEqual(handler.batch_deadline(), None)
+
+        handler._process_many(get_metrics(1, 2))
+        deadline = handler.batch_deadline()
+        self.assertEqual(deadline, handler.batch_started + 5)
+
+        handler._tick(deadline - 1)
+        self.assertEqual(handler.sent, [])
+        handler._tick(deadline)
+        self.assertEqual(handler.sent, [[1, 2]])
+        self.assertEqual(handler.batch_deadline(), None)
+
+    def test_failed_send_waits(self):
+        handler = self.get_handler(batch=100, batch_max_latency=5)
+        handler.fail = True
+        handler._process_many(get_metrics(1))
+        deadline = handler.batch_deadline()
+
+        with patch('time.time', return_value=deadline + 1):
+            handler._tick(deadline + 1)
+        self.assertEqual(handler.batch_deadline(), deadline + 6)
+
+    def test_flush_starts_new_batch(self):
+        handler = self.get_handler(batch=100, batch_max_latency=5)
+        with patch('time.time', return_value=100):
+            handler._process_many(get_metrics(1))
+        handler._flush()
+
+        with patch('time.time', return_value=200):
+            handler._process_many(get_metrics(2))
+        self.assertEqual(handler.batch_deadline(), 205)
+
+    def test_workers(self):
+        log = logging.getLogger('diamond')
+        handler = self.get_handler(batch=100, batch_max_latency=5)
+        worker = InlineHandlerWorker(handler, log)
+        worker.put(get_metrics(1), False)
+        self.assertEqual(worker.deadline(), handler.batch_deadline())
+        worker.tick(worker.deadline())
+        self.assertEqual(handler.sent, [[1]])
+
+        # A thread sends on its own once the latency passed
+        handler = self.get_handler(batch=100, batch_max_latency=0.1)
+        worker = ThreadHandlerWorker(handler, log)
+        self.assertEqual(worker.deadline(), None)
+        worker.start()
+        worker.put(get_metrics(1, 2), False)
+        self.assertTrue(handler.done.wait(5))
+        self.assertEqual(handler.sent, [[1, 2]])
+
+
+class TestGraphiteBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = patch.object(GraphiteHandler, '_connect',
+                                    fake_connect)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_graphite(self):
+        config = configobj.ConfigObj()
+        config['batch'] = 100
+        config['batch_max_latency'] = 2
+        handler = GraphiteHandler(config)
+
+        handler._process_many(get_metrics(1, 2, 3))
+        self.assertEqual(handler.socket.sendall.call_count, 0)
+
+        handler._tick(handler.batch_deadline())
+        handler.socket.sendall.assert_called_once_with(
+            ''.join(str(m) for m in get_metrics(1, 2, 3)))
+        self.assertEqual(handler.batch_deadline(), None)
+
+    def test_pickle_flush(self):
+        config = configobj.ConfigObj()
+        config['batch'] = 100
+        handler = GraphitePickleHandler(config)
+
+        handler._process_many(get_metrics(1, 2, 3))
+        self.assertEqual(handler.socket.sendall.call_count, 0)
+
+        # A flush sends the batch even when not full
+        handler._flush()
+        self.assertTrue(handler.socket.sendall.call_args_list[0][0][0])
+        self.assertEqual(handler.batch, [])
+        self.assertEqual(handler.batch_deadline(), None)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
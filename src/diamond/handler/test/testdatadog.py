@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import zlib
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond.handler.datadog import DatadogHandler
+from diamond.metric import Metric
+
+
+class SeriesRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        self.server.connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.sizes.append(len(body))
+        if self.headers.get('Content-Encoding') == 'deflate':
+            body = zlib.decompress(body)
+        elif self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.requests.append((self.path, json.loads(body)))
+
+        status, data = self.server.response
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class SeriesStub(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server keeping the requests it receives
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           SeriesRequestHandler)
+        self.requests = []
+        self.sizes = []
+        self.connections = 0
+        self.response = (202, '{}')
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join(5)
+
+
+class TestDatadogHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = SeriesStub()
+
+    def tearDown(self):
+        self.stub.close()
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config['api_key'] = 'key'
+        config['url'] = 'http://127.0.0.1:%d/api/v1/series' % (
+            self.stub.server_address[1])
+        config.update(options)
+        self.handler = DatadogHandler(config)
+        self.addCleanup(self.handler._close)
+        return self.handler
+
+    def get_metrics(self, paths, points, timestamp=1000):
+        return [Metric('servers.host.cpu.cpu%d.idle' % path, point,
+                       timestamp=timestamp + point, host='host')
+                for point in range(points) for path in range(paths)]
+
+    def get_series(self):
+        series = {}
+        for path, body in self.stub.requests:
+            for entry in body['series']:
+                key = (entry['metric'], entry['host'])
+                series.setdefault(key, []).extend(entry['points'])
+        return series
+
+    def test_one_request_per_flush(self):
+        handler = self.get_handler()
+        handler._process_many(self.get_metrics(10, 100))
+        handler._flush()
+        self.assertEqual(len(self.stub.requests), 1)
+
+        handler._process_many(self.get_metrics(10, 1, timestamp=2000))
+        handler._flush()
+        handler._flush()
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.stub.connections, 1)
+
+        path, body = self.stub.requests[0]
+        self.assertEqual(path, '/api/v1/series?api_key=key')
+        self.assertEqual(len(body['series']), 10)
+        self.assertEqual(body['series'][0], {
+            'metric': 'servers.cpu.cpu0.idle',
+            'host': 'host',
+            'type': 'gauge',
+            'points': [[1000 + i, i] for i in range(100)],
+        })
+        # Compressed
+        self.assertTrue(self.stub.sizes[0] < 10 * 100 * 10)
+
+    def test_max_payload_size(self):
+        handler = self.get_handler(max_payload_size=2000,
+                                   compression='gzip')
+        handler._process_many(self.get_metrics(20, 10))
+        handler._flush()
+
+        self.assertTrue(len(self.stub.requests) > 1)
+        self.assertEqual(self.stub.connections, 1)
+        series = self.get_series()
+        self.assertEqual(len(series), 20)
+        for points in series.itervalues():
+            self.assertEqual(points, [[1000 + i, i] for i in range(10)])
+        for path, body in self.stub.requests:
+            self.assertTrue(len(json.dumps(body)) <= 2000)
+
+    def test_queue_size(self):
+        handler = self.get_handler(queue_size=5, compression='none')
+        handler._process_many(self.get_metrics(1, 12))
+        self.assertEqual(len(self.stub.requests), 2)
+        handler._flush()
+        self.assertEqual(len(self.get_series().values()[0]), 12)
+
+    def test_errors(self):
+        self.stub.response = (403, '{"errors": ["Forbidden"]}')
+        handler = self.get_handler()
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(1, 1))
+        handler._flush()
+        self.assertEqual(handler._throttle_error.call_count, 1)
+
+        # Reconnects once the server is gone, drops the metrics
+        self.stub.close()
+        handler._process_many(self.get_metrics(1, 1))
+        handler._flush()
+        self.assertEqual(handler._throttle_error.call_count, 2)
+        self.assertEqual(handler.queued, 0)
+        self.assertEqual(handler.errors, 0)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,9 @@
 # coding=utf-8
 ##########################################################################
 
+import shutil
+import socket
+import tempfile
 import time
 
 from test import unittest
@@ -177,6 +180,38 @@ class TestGraphiteHandler(unittest.TestCase):
         self.assertEqual(send_mock.call_count, 0)
         self.assertEqual(handler.metrics, expected_data)
 
+    def test_backlog_spool(self):
+        spool_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_path)
+
+        config = configobj.ConfigObj()
+        config['batch'] = 1
+        config['max_backlog_multiplier'] = 4
+        config['trim_backlog_multiplier'] = 3
+        config['spool_path'] = spool_path
+
+        metrics = [Metric('metricname%d' % i, 0, timestamp=123)
+                   for i in range(1, 9)]
+
+        # Trimmed metrics go to the spool while graphite is unreachable
+        mod.GraphiteHandler._connect = fake_bad_connect
+        handler = mod.GraphiteHandler(config)
+        for m in metrics:
+            handler.process(m)
+        self.assertEqual(len(handler.metrics), 3)
+        self.assertEqual(handler.spool.read(10), [
+            "metricname%d 0 123\n" % i for i in range(1, 6)])
+
+        # And are replayed once it is back
+        mod.GraphiteHandler._connect = fake_connect
+        handler.spool.last_replay -= 1
+        handler.flush()
+
+        data = ''.join(c[0][0] for c in handler.socket.sendall.call_args_list)
+        self.assertEqual(data, ''.join(
+            "metricname%d 0 123\n" % i for i in [6, 7, 8, 1, 2, 3, 4, 5]))
+        self.assertEqual(len(handler.spool), 0)
+
     def test_error_throttling(self):
         """
         This is more of a generic test checking that the _throttle_error method
@@ -276,6 +311,49 @@ class TestGraphiteHandler(unittest.TestCase):
         self.assertEqual(check_mock.call_count, 3)
         self.assertEqual(len(handler.config['__sockets_created']), 3)
 
+    def test_background_writer(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(16)
+
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = server.getsockname()[1]
+        config['writer'] = 'background'
+        config['batch'] = 2
+        handler = mod.GraphiteHandler(config)
+        try:
+            # Nothing is read yet, process still returns right away
+            start = time.time()
+            for i in range(4):
+                handler.process(Metric('foo.bar', i, timestamp=123))
+            self.assertTrue(time.time() - start < 1)
+
+            conn = server.accept()[0]
+            conn.settimeout(5)
+            expected = ''.join('foo.bar %d 123\n' % i for i in range(4))
+            data = ''
+            while len(data) < len(expected):
+                data += conn.recv(4096)
+            self.assertEqual(data, expected)
+            self.assertTrue(handler.is_connected())
+
+            # The writer thread counts what it sent right after sending it
+            for i in range(500):
+                stats = handler.stats()
+                if stats['bytes_queued'] == 0:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(stats['bytes_sent'], len(expected))
+            self.assertEqual(stats['bytes_dropped'], 0)
+            conn.close()
+        finally:
+            handler.writer.stop()
+            server.close()
+
+        self.assertRaises(ValueError, mod.GraphiteHandler,
+                          configobj.ConfigObj({'writer': 'select'}))
+
 
 if __name__ == "__main__":
     unittest.main()
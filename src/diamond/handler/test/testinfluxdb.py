@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import zlib
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond.handler.influxdbHandler import InfluxdbHandler
+from diamond.metric import Metric
+
+
+class WriteRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        self.server.connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.requests.append((self.path, body))
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WriteStub(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server keeping the bodies of the writes it receives
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           WriteRequestHandler)
+        self.requests = []
+        self.statuses = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def lines(self):
+        return [line for path, body in self.requests
+                for line in body.split('\n')]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join(5)
+
+
+class TestInfluxdbLineProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = WriteStub()
+
+    def tearDown(self):
+        self.stub.close()
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config['protocol'] = 'line'
+        config['hostname'] = '127.0.0.1'
+        config['port'] = self.stub.server_address[1]
+        config['batch_size'] = 1000
+        config.update(options)
+        handler = InfluxdbHandler(config)
+        self.addCleanup(handler._close)
+        return handler
+
+    def get_metrics(self, hosts, timestamp=1000):
+        return [Metric('servers.%s.cpu.%s' % (host, name), value,
+                       timestamp=timestamp, host=host)
+                for host in hosts
+                for name, value in (('total.idle', 97), ('total.user', 2.5))]
+
+    def test_lines(self):
+        handler = self.get_handler(tags=['dc=us 1', 'rack=r2'])
+        handler._process_many(self.get_metrics(['web1', 'web2']))
+        handler._process_many([Metric('servers.web1.network.eth0.rx', 1,
+                                      timestamp=1000, host='web1')])
+        handler._flush()
+
+        self.assertEqual(len(self.stub.requests), 1)
+        path, body = self.stub.requests[0]
+        self.assertEqual(path, '/write?db=graphite&precision=s&u=root&p=root')
+        self.assertEqual(body.split('\n'), [
+            'cpu,host=web1,dc=us\\ 1,rack=r2 total.idle=97,total.user=2.5 1000',
+            'cpu,host=web2,dc=us\\ 1,rack=r2 total.idle=97,total.user=2.5 1000',
+            'network,host=web1,dc=us\\ 1,rack=r2 eth0.rx=1 1000',
+        ])
+
+    def test_without_host(self):
+        handler = self.get_handler(tags=['dc=us1'])
+        handler._process_many([Metric('servers.web1.cpu.total.idle', 97,
+                                      timestamp=1000)])
+        handler._flush()
+        self.assertEqual(self.stub.lines(),
+                         ['cpu,dc=us1 total.idle=97 1000'])
+
+    def test_compression(self):
+        handler = self.get_handler(compression='none')
+        handler._process_many(self.get_metrics(['web1']))
+        handler._flush()
+        self.assertEqual(self.stub.lines(),
+                         ['cpu,host=web1 total.idle=97,total.user=2.5 1000'])
+
+        # Only gzip is understood by InfluxDB
+        self.assertRaises(ValueError, self.get_handler, compression='deflate')
+
+    def test_max_points(self):
+        handler = self.get_handler(max_points=2, time_precision='ms')
+        handler._process_many(self.get_metrics(['web1', 'web2', 'web3']))
+        handler._flush()
+        handler._process_many(self.get_metrics(['web1'], timestamp=1010))
+        handler._flush()
+
+        self.assertEqual([len(body.split('\n'))
+                          for path, body in self.stub.requests], [2, 1, 1])
+        self.assertEqual(self.stub.lines()[-1],
+                         'cpu,host=web1 total.idle=97,total.user=2.5 1010000')
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(handler.batch_count, 0)
+
+    def test_batch_size(self):
+        handler = self.get_handler(batch_size=4)
+        handler._process_many(self.get_metrics(['web1', 'web2', 'web3']))
+        self.assertEqual(len(self.stub.lines()), 2)
+        self.assertEqual(handler.batch_count, 2)
+
+    def test_retry(self):
+        self.stub.statuses = [500]
+        handler = self.get_handler()
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(['web1']))
+        handler._flush()
+        self.assertEqual(handler.batch_count, 2)
+        self.assertTrue(handler.retry_at > 0)
+
+        # Kept until the backoff passed
+        handler._flush()
+        self.assertEqual(len(self.stub.requests), 1)
+        handler.retry_at = 0
+        handler._flush()
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.stub.requests[0], self.stub.requests[1])
+        self.assertEqual(handler.batch_count, 0)
+
+    def test_cache_size(self):
+        self.stub.close()
+        handler = self.get_handler(cache_size=3)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(['web1', 'web2', 'web3']))
+        handler._flush()
+
+        # The oldest points go first
+        self.assertEqual(handler.batch_count, 2)
+        self.assertEqual([series for series, timestamp in handler.points],
+                         ['cpu,host=web3'])
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
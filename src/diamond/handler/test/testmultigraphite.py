@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.graphitepickle import GraphitePickleHandler
+from diamond.handler.multigraphite import MultiGraphiteHandler
+from diamond.handler.multigraphitepickle import MultiGraphitePickleHandler
+from diamond.metric import Metric
+from diamond.utils.hashing import ConsistentHashRing
+
+DOWN = set()
+
+
+def fake_connect(self):
+    if self.host in DOWN:
+        self.socket = None
+    else:
+        self.socket = Mock()
+
+
+def get_metrics(count):
+    return [Metric('servers.host%d.cpu.total.idle' % i, i, timestamp=1)
+            for i in range(count)]
+
+
+class TestConsistentHashRing(unittest.TestCase):
+
+    def test_get_node(self):
+        ring = ConsistentHashRing([('a', None), ('b', None), ('c', None)])
+        keys = ['servers.host%d.cpu.total.idle' % i for i in range(3000)]
+        owners = [ring.get_node(key) for key in keys]
+
+        for node in ring.nodes:
+            self.assertTrue(owners.count(node) > 600, owners.count(node))
+        self.assertEqual(owners, [ring.get_node(key) for key in keys])
+
+        # Only the keys of the removed node move
+        ring.remove_node(('b', None))
+        for key, owner in zip(keys, owners):
+            if owner != ('b', None):
+                self.assertEqual(ring.get_node(key), owner)
+
+    def test_get_nodes(self):
+        ring = ConsistentHashRing([('a', None), ('b', '1'), ('b', '2')])
+        nodes = list(ring.get_nodes('servers.host.cpu.total.idle'))
+        self.assertEqual(sorted(nodes), sorted(ring.nodes))
+        self.assertEqual(nodes[0], ring.get_node('servers.host.cpu.total.idle'))
+
+        self.assertEqual(list(ConsistentHashRing().get_nodes('key')), [])
+
+
+class TestMultiGraphiteHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = patch.object(GraphiteHandler, '_connect', fake_connect)
+        self.patcher.start()
+        DOWN.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def get_handler(self, cls=MultiGraphiteHandler, **options):
+        config = configobj.ConfigObj()
+        config['host'] = ['a', 'b', 'c:2004:x']
+        config.update(options)
+        return cls(config)
+
+    def get_sent(self, handler):
+        sent = {}
+        for h in handler.handlers:
+            if h.socket is not None:
+                sent[h.host] = set(c[0][0].split()[0]
+                                   for c in h.socket.sendall.call_args_list)
+        return sent
+
+    def test_broadcast(self):
+        handler = self.get_handler()
+        for metric in get_metrics(10):
+            handler.process(metric)
+
+        sent = self.get_sent(handler)
+        self.assertEqual(sorted(sent), ['a', 'b', 'c'])
+        for paths in sent.values():
+            self.assertEqual(len(paths), 10)
+
+    def test_destinations(self):
+        handler = self.get_handler()
+        self.assertEqual(sorted(handler.nodes),
+                         [('a', None), ('b', None), ('c', 'x')])
+        self.assertEqual(handler.nodes[('c', 'x')].port, 2004)
+        self.assertEqual(handler.nodes[('a', None)].port, 2003)
+
+        self.assertRaises(ValueError, self.get_handler, sharding='random')
+
+    def test_consistent_hashing(self):
+        handler = self.get_handler(sharding='consistent_hashing')
+        for metric in get_metrics(300):
+            handler.process(metric)
+
+        sent = self.get_sent(handler)
+        self.assertEqual(sum(len(paths) for paths in sent.values()), 300)
+        for host, paths in sent.iteritems():
+            self.assertTrue(len(paths) > 50, (host, len(paths)))
+            for path in paths:
+                self.assertEqual(handler.get_handlers(path)[0].host, host)
+
+    def test_replication_factor(self):
+        handler = self.get_handler(sharding='consistent_hashing',
+                                   replication_factor=2)
+        for metric in get_metrics(300):
+            handler.process(metric)
+
+        sent = self.get_sent(handler)
+        self.assertEqual(sum(len(paths) for paths in sent.values()), 600)
+        for metric in get_metrics(300):
+            hosts = [h for h, paths in sent.items() if metric.path in paths]
+            self.assertEqual(len(hosts), 2)
+
+    def test_rebalance_when_down(self):
+        handler = self.get_handler(sharding='consistent_hashing')
+        metrics = get_metrics(300)
+        owners = dict((m.path, handler.get_handlers(m.path)[0].host)
+                      for m in metrics)
+
+        # b goes down and is found out on the next flush
+        DOWN.add('b')
+        handler.handlers[1]._close()
+        handler.flush()
+        self.assertEqual(handler.down, set([('b', None)]))
+
+        for metric in metrics:
+            host = handler.get_handlers(metric.path)[0].host
+            if owners[metric.path] == 'b':
+                self.assertNotEqual(host, 'b')
+            else:
+                self.assertEqual(host, owners[metric.path])
+
+        # Back up once it reconnects
+        DOWN.clear()
+        handler.flush()
+        self.assertEqual(handler.down, set())
+        for metric in metrics:
+            self.assertEqual(handler.get_handlers(metric.path)[0].host,
+                             owners[metric.path])
+
+    def test_all_down(self):
+        DOWN.update(['a', 'b', 'c'])
+        handler = self.get_handler(sharding='consistent_hashing')
+        self.assertEqual(len(handler.down), 3)
+
+        # Metrics are still kept by their owner until it is back
+        metric = get_metrics(1)[0]
+        owner = handler.get_handlers(metric.path)[0]
+        handler.process(metric)
+        self.assertEqual(owner.metrics, [str(metric)])
+
+    def test_pickle(self):
+        handler = self.get_handler(cls=MultiGraphitePickleHandler,
+                                   sharding='consistent_hashing')
+        for h in handler.handlers:
+            self.assertTrue(isinstance(h, GraphitePickleHandler))
+        self.assertEqual(len(handler.ring.nodes), 3)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from test import run_only
+from mock import Mock
+from mock import patch
+import configobj
+
+import diamond.handler.mysql as mod
+from diamond.metric import Metric
+from diamond.utils.dispatch import InlineHandlerWorker
+
+
+def run_only_if_mysqldb_is_available(func):
+    def pred():
+        return mod.MySQLdb is not None
+    return run_only(func, pred)
+
+
+class TestMySQLHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        if mod.MySQLdb is not None:
+            self.patcher = patch.object(mod.MySQLdb, 'Connect',
+                                        side_effect=self.connect)
+            self.patcher.start()
+            self.addCleanup(self.patcher.stop)
+
+    def connect(self, **kwargs):
+        conn = Mock()
+        self.connections.append(conn)
+        return conn
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config.update({
+            'hostname': 'localhost',
+            'port': 3306,
+            'username': 'diamond',
+            'password': '',
+            'database': 'diamond',
+            'table': 'metrics',
+            'col_time': 'timestamp',
+            'col_metric': 'metric',
+            'col_value': 'value',
+            'batch_max_latency': 0,
+        })
+        config.update(options)
+        return mod.MySQLHandler(config)
+
+    def get_metrics(self, count):
+        return [Metric('servers.host.cpu.total.idle', i, timestamp=1000 + i,
+                       precision=1)
+                for i in range(count)]
+
+    def get_rows(self, conn):
+        cursor = conn.cursor.return_value
+        return [call[0][1] for call in cursor.executemany.call_args_list]
+
+    @patch.object(mod, 'MySQLdb', None)
+    def test_without_mysqldb(self):
+        handler = mod.MySQLHandler(configobj.ConfigObj())
+        worker = InlineHandlerWorker(handler, handler.log)
+        self.assertFalse(handler.enabled)
+        self.assertEqual(worker.deadline(), None)
+
+        worker.put(self.get_metrics(2), True)
+        worker.tick(0)
+        self.assertEqual(handler.rows, [])
+        self.assertEqual(handler.errors, 0)
+
+    @run_only_if_mysqldb_is_available
+    def test_one_transaction(self):
+        handler = self.get_handler(max_rows=4)
+        handler._process_many(self.get_metrics(10))
+        conn = self.connections[0]
+        self.assertFalse(conn.cursor.called)
+
+        handler._flush()
+        self.assertEqual([len(rows) for rows in self.get_rows(conn)],
+                         [4, 4, 2])
+        self.assertEqual(self.get_rows(conn)[0][1],
+                         ('servers.host.cpu.total.idle', 1001, '1.0'))
+        self.assertEqual(
+            conn.cursor.return_value.executemany.call_args[0][0],
+            'INSERT INTO metrics (metric, timestamp, value) '
+            'VALUES(%s, %s, %s)')
+        self.assertEqual(conn.commit.call_count, 1)
+
+        handler._flush()
+        self.assertEqual(conn.commit.call_count, 1)
+
+    @run_only_if_mysqldb_is_available
+    def test_batch(self):
+        handler = self.get_handler(batch=5)
+        handler._process_many(self.get_metrics(12))
+        conn = self.connections[0]
+        self.assertEqual(conn.commit.call_count, 2)
+        self.assertEqual(len(handler.rows), 2)
+
+    @run_only_if_mysqldb_is_available
+    def test_reconnect(self):
+        handler = self.get_handler()
+        handler._throttle_error = Mock()
+        cursor = self.connections[0].cursor.return_value
+        cursor.executemany.side_effect = mod.MySQLdb.OperationalError(
+            2006, 'MySQL server has gone away')
+
+        handler._process_many(self.get_metrics(3))
+        handler._flush()
+
+        # Rolled back, inserted again over a new connection
+        self.assertTrue(self.connections[0].rollback.called)
+        self.assertTrue(self.connections[0].close.called)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(len(self.get_rows(self.connections[1])[0]), 3)
+        self.assertEqual(self.connections[1].commit.call_count, 1)
+        self.assertEqual(handler.rows, [])
+
+    @run_only_if_mysqldb_is_available
+    def test_max_buffer(self):
+        mod.MySQLdb.Connect.side_effect = mod.MySQLdb.OperationalError(
+            2003, "Can't connect")
+        handler = self.get_handler(max_buffer=4)
+        handler._throttle_error = Mock()
+
+        handler._process_many(self.get_metrics(6))
+        handler._flush()
+        self.assertEqual([row[1] for row in handler.rows],
+                         [1002, 1003, 1004, 1005])
+        self.assertEqual(handler.conn, None)
+
+        mod.MySQLdb.Connect.side_effect = self.connect
+        handler._flush()
+        self.assertEqual(len(self.get_rows(self.connections[-1])[0]), 4)
+        self.assertEqual(handler.rows, [])
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import Queue
+
+from test import unittest
+import configobj
+
+from diamond.handler.queue import QueueHandler
+from diamond.metric import Metric
+from diamond.metric import MetricBatch
+
+
+class TestQueueHandler(unittest.TestCase):
+
+    def get_handler(self, queue, batch_size=None):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        if batch_size is not None:
+            config['server']['metric_batch_size'] = batch_size
+        return QueueHandler(config=config, queue=queue)
+
+    def test_one_batch_per_run(self):
+        queue = Queue.Queue()
+        handler = self.get_handler(queue)
+
+        for i in range(10):
+            handler._process(Metric('servers.host.cpu.total', i))
+        self.assertTrue(queue.empty())
+        handler._flush()
+
+        batch = queue.get(block=False)
+        self.assertTrue(isinstance(batch, MetricBatch))
+        self.assertTrue(batch.flush)
+        self.assertEqual([m.value for m in batch], range(10))
+        self.assertTrue(queue.empty())
+
+    def test_batch_size(self):
+        queue = Queue.Queue()
+        handler = self.get_handler(queue, batch_size=4)
+
+        for i in range(10):
+            handler._process(Metric('servers.host.cpu.total', i))
+        handler._flush()
+
+        batches = [queue.get(block=False) for i in range(3)]
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertEqual([b.flush for b in batches], [False, False, True])
+        self.assertTrue(queue.empty())
+
+    def test_process_many(self):
+        queue = Queue.Queue()
+        handler = self.get_handler(queue, batch_size=4)
+
+        handler._process_many([Metric('servers.host.cpu.total', i)
+                               for i in range(10)])
+        handler._flush()
+
+        batches = [queue.get(block=False) for i in range(3)]
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertEqual([m.value for b in batches for m in b], range(10))
+        self.assertTrue(queue.empty())
+
+    def test_queue_full_drops_batch(self):
+        queue = Queue.Queue(maxsize=1)
+        handler = self.get_handler(queue)
+
+        handler._process(Metric('servers.host.cpu.total', 1))
+        handler._flush()
+        handler._process(Metric('servers.host.cpu.total', 2))
+        handler._flush()
+
+        self.assertEqual([m.value for m in queue.get(block=False)], [1])
+        self.assertTrue(queue.empty())
+        self.assertEqual(handler.metrics, [])
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
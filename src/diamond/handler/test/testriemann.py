@@ -2,18 +2,23 @@
 # coding=utf-8
 ##########################################################################
 
+import socket
+import struct
+import threading
+
 from test import unittest
 from test import run_only
 from mock import Mock
 from mock import patch
-from mock import call
 import configobj
 
 import diamond.handler.riemann as mod
 from diamond.metric import Metric
+from diamond.utils.dispatch import InlineHandlerWorker
 
 try:
     from riemann_client.client import Client
+    from riemann_client import riemann_pb2
     riemann_client = True
 except ImportError:
     riemann_client = None
@@ -27,13 +32,87 @@ def run_only_if_riemann_client_is_available(func):
 
 def fake_connect(self):
     # used for 'we can connect' tests
-    self.transport = Mock()
+    self.socket = Mock()
+
+
+def read_exactly(conn, size):
+    data = ''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class RiemannStub(object):
+    """
+    A Riemann TCP server keeping the messages it receives and acknowledging
+    them, rejecting those whose first service is about reject
+    """
+
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.hang_up = False
+        self.received = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                conn = self.server.accept()[0]
+                self.connections += 1
+                self.serve(conn)
+                conn.close()
+        except socket.error:
+            pass
+
+    def serve(self, conn):
+        while True:
+            header = read_exactly(conn, 4)
+            if header is None:
+                return
+            message = riemann_pb2.Msg()
+            message.ParseFromString(
+                read_exactly(conn, struct.unpack('!I', header)[0]))
+            with self.received:
+                self.messages.append(message)
+                self.received.notify_all()
+
+            response = riemann_pb2.Msg()
+            response.ok = 'reject' not in message.events[0].service
+            if not response.ok:
+                response.error = 'rejected'
+            data = response.SerializeToString()
+            conn.sendall(struct.pack('!I', len(data)) + data)
+            if self.hang_up:
+                return
+
+    def wait(self, count):
+        with self.received:
+            while len(self.messages) < count:
+                self.received.wait(5)
+
+    def close(self):
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
+        self.thread.join(5)
 
 
 class TestRiemannHandler(unittest.TestCase):
 
     def setUp(self):
-        self.__connect_method = mod.RiemannHandler
+        self.__connect_method = mod.RiemannHandler._connect
         mod.RiemannHandler._connect = fake_connect
 
     def tearDown(self):
@@ -41,12 +120,11 @@ class TestRiemannHandler(unittest.TestCase):
         mod.RiemannHandler._connect = self.__connect_method
 
     @run_only_if_riemann_client_is_available
-    @patch('riemann_client.transport.TCPTransport.connect', Mock())
-    @patch('riemann_client.client.Client.send_event', Mock())
     def test_metric_to_riemann_event(self):
         config = configobj.ConfigObj()
         config['host'] = 'localhost'
         config['port'] = 5555
+        config['transport'] = 'udp'
         handler = mod.RiemannHandler(config)
 
         metric = Metric('servers.com.example.www.cpu.total.idle',
@@ -55,16 +133,126 @@ class TestRiemannHandler(unittest.TestCase):
                         host='com.example.www')
 
         handler.process(metric)
+        self.assertFalse(handler.socket.send.called)
+
+        handler.flush()
+        message = riemann_pb2.Msg()
+        message.ParseFromString(handler.socket.send.call_args[0][0])
+
+        event = Client.create_dict(message.events[0])
+        self.assertEqual(event, {
+            'host': u'com.example.www',
+            'service': u'servers.cpu.total.idle',
+            'time': 1234567L,
+            'metric_f': 0.0,
+        })
+
+    @patch.object(mod, 'riemann_client', None)
+    def test_without_riemann_client(self):
+        handler = mod.RiemannHandler(configobj.ConfigObj())
+        worker = InlineHandlerWorker(handler, handler.log)
+        self.assertFalse(handler.enabled)
+        self.assertEqual(worker.deadline(), None)
+
+        worker.put([Metric('servers.host.cpu.total.idle', 1, timestamp=1)],
+                   True)
+        worker.tick(0)
+        self.assertEqual(handler.events, [])
+        self.assertEqual(handler.errors, 0)
+
+
+class TestRiemannBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = RiemannStub()
 
-        for call in handler.client.send_event.mock_calls:
-            event = Client.create_dict(call[1][0])
+    def tearDown(self):
+        self.stub.close()
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = self.stub.port
+        config['batch_max_latency'] = 0
+        config.update(options)
+        return mod.RiemannHandler(config)
+
+    def get_metrics(self, count, service='cpu.total.idle'):
+        return [Metric('servers.host.%s' % service, i, timestamp=1000 + i,
+                       host='host')
+                for i in range(count)]
+
+    @run_only_if_riemann_client_is_available
+    def test_batch(self):
+        handler = self.get_handler(batch=3)
+        handler._process_many(self.get_metrics(7))
+        self.assertEqual(len(self.stub.messages), 2)
+        self.assertEqual(handler.pending_acks, 0)
+
+        handler._flush()
+        self.assertEqual([len(message.events)
+                          for message in self.stub.messages], [3, 3, 1])
+        self.assertEqual([event.time for message in self.stub.messages
+                          for event in message.events], range(1000, 1007))
+        self.assertEqual(self.stub.messages[0].events[0].service,
+                         'servers.cpu.total.idle')
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(handler.errors, 0)
+
+    @run_only_if_riemann_client_is_available
+    def test_async_acks(self):
+        handler = self.get_handler(batch=1, acks='async')
+        handler._process_many(self.get_metrics(5))
+        self.stub.wait(5)
+        self.assertEqual(len(self.stub.messages), 5)
+
+        # Whatever was not read yet is read on close
+        handler.close()
+        self.assertEqual(handler.pending_acks, 0)
+        self.assertEqual(handler.rejected, 0)
+
+    @run_only_if_riemann_client_is_available
+    def test_rejected(self):
+        handler = self.get_handler(batch=1)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(1, service='reject.me'))
+
+        self.assertEqual(handler.rejected, 1)
+        self.assertEqual(handler._throttle_error.call_count, 1)
+
+    @run_only_if_riemann_client_is_available
+    def test_reconnect(self):
+        self.stub.hang_up = True
+        handler = self.get_handler(batch=2, reconnect_backoff=30)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(2))
+        handler._process_many(self.get_metrics(2))
+
+        # Sent into the closed connection or refused, kept for later
+        self.assertEqual(handler.socket, None)
+        self.assertEqual(len(self.stub.messages), 1)
+        self.assertTrue(handler.retry_at > 0)
+        handler._flush()
+        self.assertEqual(self.stub.connections, 1)
+
+        # Reconnected once the backoff passed
+        handler.retry_at = 0
+        handler._flush()
+        self.assertEqual(len(self.stub.messages), 2)
+        self.assertEqual(len(handler.events), 0)
+        self.assertEqual(self.stub.connections, 2)
+
+    @run_only_if_riemann_client_is_available
+    def test_max_queue_size(self):
+        self.stub.close()
+        handler = self.get_handler(batch=10, max_queue_size=15)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(20))
+        handler._flush()
 
-            self.assertEqual(event, {
-                'host': u'com.example.www',
-                'service': u'servers.cpu.total.idle',
-                'time': 1234567L,
-                'metric_f': 0.0,
-            })
+        self.assertEqual(handler.socket, None)
+        self.assertEqual([event[2] for event in handler.events],
+                         range(1005, 1020))
 
 ##########################################################################
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+
+from test import unittest
+from mock import Mock
+from mock import patch
+import configobj
+
+import diamond.handler.rrdtool as mod
+from diamond.handler.rrdtool import RRDHandler
+from diamond.metric import Metric
+
+
+class RRDCachedRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.rstrip('\n')
+            server.commands.append(command)
+            if command == 'BATCH':
+                self.wfile.write("0 Go ahead.  End with dot '.' on its own "
+                                 "line.\n")
+                batch = []
+                for line in iter(self.rfile.readline, '.\n'):
+                    batch.append(line.rstrip('\n'))
+                server.batches.append(batch)
+                errors = [(i + 1, 'illegal attempt to update') for i, update
+                          in enumerate(batch) if ' 1:' in update]
+                self.wfile.write('%d errors\n' % len(errors))
+                for index, message in errors:
+                    self.wfile.write('%d %s\n' % (index, message))
+            elif command.startswith('CREATE'):
+                self.wfile.write('0 RRD created OK\n')
+            else:
+                self.wfile.write('-1 Unknown command\n')
+            self.wfile.flush()
+            if server.hang_up:
+                break
+
+
+class RRDCachedStub(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    """
+    Speaks enough of the rrdcached protocol for the handler, keeps the
+    commands and batches it receives
+    """
+    daemon_threads = True
+
+    def __init__(self, path):
+        SocketServer.UnixStreamServer.__init__(self, path,
+                                               RRDCachedRequestHandler)
+        self.commands = []
+        self.batches = []
+        self.connections = 0
+        self.hang_up = False
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join(5)
+
+
+class TestRRDHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.address = os.path.join(self.path, 'rrdcached.sock')
+        self.stub = RRDCachedStub(self.address)
+
+    def tearDown(self):
+        self.stub.close()
+        shutil.rmtree(self.path)
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config['basedir'] = os.path.join(self.path, 'rrd')
+        config.update(options)
+        return RRDHandler(config)
+
+    def get_metrics(self, timestamp):
+        return [Metric('servers.host.cpu.total.user', 1, timestamp=timestamp,
+                       host='host'),
+                Metric('servers.host.cpu.total.idle', 2.5,
+                       timestamp=timestamp, host='host')]
+
+    def get_filename(self, name):
+        return os.path.join(self.path, 'rrd', 'host', 'cpu', name + '.rrd')
+
+    def test_batch(self):
+        handler = self.get_handler(daemon='unix:' + self.address)
+        for timestamp in (1000, 1010):
+            handler._process_many(self.get_metrics(timestamp))
+        handler._flush()
+        handler._process_many(self.get_metrics(1020))
+        handler._flush()
+
+        user = self.get_filename('total_user')
+        idle = self.get_filename('total_idle')
+        creates = [command.split()[1] for command in self.stub.commands
+                   if command.startswith('CREATE')]
+        self.assertEqual(sorted(creates), sorted([user, idle]))
+        self.assertEqual(self.stub.commands.count('BATCH'), 2)
+        self.assertEqual(sorted(self.stub.batches[0]), [
+            'UPDATE %s 1000:2.5 1010:2.5' % idle,
+            'UPDATE %s 1000:1 1010:1' % user,
+        ])
+        self.assertEqual(sorted(self.stub.batches[1]), [
+            'UPDATE %s 1020:2.5' % idle,
+            'UPDATE %s 1020:1' % user,
+        ])
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(handler.errors, 0)
+
+    def test_errors(self):
+        handler = self.get_handler(daemon=self.address)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(1))
+        handler._flush()
+
+        self.assertEqual(len(self.stub.batches[0]), 2)
+        self.assertEqual(handler._throttle_error.call_count, 2)
+        self.assertEqual(handler.errors, 0)
+
+    @patch.object(mod, 'subprocess')
+    @patch.object(mod, 'rrdtool')
+    def test_reconnect(self, rrdtool, subprocess):
+        self.stub.hang_up = True
+        handler = self.get_handler(daemon=self.address)
+        handler._process_many(self.get_metrics(1000))
+        handler._flush()
+        handler._process_many(self.get_metrics(1010))
+        handler._flush()
+
+        self.assertEqual(len(self.stub.batches), 2)
+        self.assertEqual(self.stub.connections, 4)
+        self.assertFalse(rrdtool.create.called)
+        self.assertFalse(rrdtool.update.called)
+        self.assertEqual(handler.errors, 0)
+
+    @patch.object(mod, 'subprocess')
+    @patch.object(mod, 'rrdtool')
+    def test_fallback(self, rrdtool, subprocess):
+        self.stub.close()
+        handler = self.get_handler(daemon=self.address)
+        handler._throttle_error = Mock()
+        handler._process_many(self.get_metrics(1000))
+        handler._flush()
+
+        user = self.get_filename('total_user')
+        self.assertEqual(rrdtool.create.call_count, 2)
+        rrdtool.update.assert_any_call(user, '1000:1')
+        self.assertEqual(rrdtool.update.call_count, 2)
+        self.assertFalse(subprocess.call.called)
+        self.assertFalse(subprocess.check_call.called)
+        self.assertEqual(handler.errors, 0)
+
+    @patch.object(mod, 'subprocess')
+    @patch.object(mod, 'rrdtool', None)
+    def test_commands(self, subprocess):
+        handler = self.get_handler(batch=2)
+        handler._process_many(self.get_metrics(1000))
+        self.assertEqual(subprocess.check_call.call_count, 2)
+        self.assertFalse(subprocess.call.called)
+
+        handler._process_many(self.get_metrics(1010))
+        user = self.get_filename('total_user')
+        subprocess.call.assert_any_call(['rrdupdate', user, '--',
+                                         '1000:1', '1010:1'])
+        self.assertEqual(subprocess.call.call_count, 2)
+        self.assertEqual(subprocess.check_call.call_count, 2)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
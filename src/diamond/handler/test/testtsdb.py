@@ -418,6 +418,29 @@ class TestTSDBdHandler(unittest.TestCase):
             handler.process(metric)
             handler.socket.sendall.assert_called_with(expected_data)
 
+    def test_failed_batch_spooled_on_flush(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'localhost'
+        config['port'] = '9999'
+
+        handler = TSDBHandler(config)
+        handler._close()
+        handler._connect = Mock(side_effect=lambda: fake_bad_connect(handler))
+        handler._spool = Mock(return_value=True)
+
+        handler._process_many([
+            Metric('servers.myhostname.cpu.cpu_count', i, timestamp=1234567,
+                   host='myhostname')
+            for i in range(3)])
+        self.assertEqual(handler._connect.call_count, TSDBHandler.RETRY)
+        self.assertEqual(handler._spool.call_count, 0)
+
+        handler._flush()
+        handler._spool.assert_called_once_with([
+            'put cpu.cpu_count 1234567 %d hostname=myhostname\n' % i
+            for i in range(3)])
+        self.assertEqual(handler.failed, [])
+
     def test_with_invalid_tag(self):
         config = configobj.ConfigObj()
         config['host'] = 'localhost'
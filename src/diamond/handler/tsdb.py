@@ -1,4 +1,4 @@
-# coding=utf-8
+# coding=utf-8
 
 """
 Send metrics to a [OpenTSDB](http://opentsdb.net/) server.
@@ -52,6 +52,8 @@ yourself.
 
 from Handler import Handler
 from diamond.metric import Metric
+from diamond.utils.spool import SPOOL_DEFAULT_CONFIG
+from diamond.utils.spool import SPOOL_DEFAULT_CONFIG_HELP
 import socket
 
 
@@ -70,6 +72,8 @@ class TSDBHandler(Handler):
 
         # Initialize Data
         self.socket = None
+        # Lines that failed to send since the last flush, spooled on flush
+        self.failed = []
 
         # Initialize Options
         self.host = self.config['host']
@@ -112,6 +116,7 @@ class TSDBHandler(Handler):
             'cleanMetrics': True,
             'skipAggregates': True,
         })
+        config.update(SPOOL_DEFAULT_CONFIG_HELP)
 
         return config
 
@@ -131,6 +136,7 @@ class TSDBHandler(Handler):
             'cleanMetrics': True,
             'skipAggregates': True,
         })
+        config.update(SPOOL_DEFAULT_CONFIG)
 
         return config
 
@@ -165,10 +171,23 @@ class TSDBHandler(Handler):
         # Just send the data as a string
         self._send("put " + str(metric_str) + "\n")
 
+    def flush(self):
+        """
+        Spool the lines that failed to send, all at once
+        """
+        if self.failed:
+            self._spool(self.failed)
+            self.failed = []
+
     def _send(self, data):
         """
         Send data to TSDB. Data that can not be sent will be queued.
         """
+        # TSDB is away, the rest of the batch waits for the flush too
+        if self.failed:
+            self.failed.append(data)
+            return
+
         retry = self.RETRY
         # Attempt to send any data in the queue
         while retry > 0:
@@ -185,8 +204,10 @@ class TSDBHandler(Handler):
             try:
                 # Send data to socket
                 self.socket.sendall(data)
+                # Catch up with what was spooled while TSDB was away
+                self._replay_spool(self._send_spooled)
                 # Done
-                break
+                return
             except socket.error, e:
                 # Log Error
                 self.log.error("TSDBHandler: Failed sending data. %s.", e)
@@ -196,6 +217,25 @@ class TSDBHandler(Handler):
                 retry -= 1
                 # try again
                 continue
+        # Out of retries, keep the data for later if we can
+        self.failed.append(data)
+
+    def _spool_name(self):
+        return '%s-%s-%s' % (self.__class__.__name__, self.config['host'],
+                             self.config['port'])
+
+    def _send_spooled(self, records):
+        """
+        Send data replayed from the spool
+        """
+        if not self.socket:
+            return False
+        try:
+            self.socket.sendall(''.join(records))
+        except socket.error:
+            self._close()
+            return False
+        return True
 
     def _connect(self):
         """
@@ -359,6 +399,10 @@ class MetricWrapper(Metric):
         self.precision = delegate.precision
         self.ttl = delegate.ttl
         self.metric_type = delegate.metric_type
+        # The path components of the delegate, so they are not parsed again
+        self.path_prefix = delegate.getPathPrefix()
+        self.collector_path = delegate.getCollectorPath()
+        self.metric_path = delegate.getMetricPath()
         self.delegate = delegate
         self.tags = {}
         self.aggregate = False
@@ -368,3 +412,8 @@ class MetricWrapper(Metric):
         handler = self.handlers.get(self.getCollectorPath(),
                                     self.handlers['default'])
         handler(self)
+        # A rewritten path is parsed for its components again
+        if self.path != delegate.path:
+            self.path_prefix = None
+            self.collector_path = None
+            self.metric_path = None
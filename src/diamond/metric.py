@@ -3,6 +3,7 @@
 import time
 import re
 import logging
+from array import array
 from error import DiamondException
 
 
@@ -11,13 +12,20 @@ class Metric(object):
     # due to the queue system that moves objects between processes and can end
     # up storing a large number of objects in the queue waiting for the
     # handlers to flush.
+    #
+    # path_prefix, collector_path and metric_path are the components of the
+    # path as getPathPrefix, getCollectorPath and getMetricPath return them.
+    # Collectors know them when they build the path, for other metrics they
+    # are None and worked out from the path when asked for.
     __slots__ = [
         'path', 'value', 'raw_value', 'timestamp', 'precision',
-        'host', 'metric_type', 'ttl'
+        'host', 'metric_type', 'ttl',
+        'path_prefix', 'collector_path', 'metric_path',
         ]
 
     def __init__(self, path, value, raw_value=None, timestamp=None, precision=0,
-                 host=None, metric_type='COUNTER', ttl=None):
+                 host=None, metric_type='COUNTER', ttl=None,
+                 path_prefix=None, collector_path=None, metric_path=None):
         """
         Create new instance of the Metric class
 
@@ -27,6 +35,8 @@ class Metric(object):
             timestamp=[float|int]: the timestamp, in seconds since the epoch
             (as from time.time()) precision=int: the precision to apply.
             Generally the default (2) should work fine.
+            path_prefix, collector_path, metric_path=string: the components
+            of path, when known
         """
 
         # Validate the path, value and metric_type submitted
@@ -69,6 +79,9 @@ class Metric(object):
         self.host = host
         self.metric_type = metric_type
         self.ttl = ttl
+        self.path_prefix = path_prefix
+        self.collector_path = collector_path
+        self.metric_path = metric_path
 
     def __repr__(self):
         """
@@ -93,6 +106,10 @@ class Metric(object):
         )
 
     def __setstate__(self, state):
+        # Metrics pickled before the path components existed lack them
+        self.path_prefix = None
+        self.collector_path = None
+        self.metric_path = None
         for slot, value in state.items():
             setattr(self, slot, value)
 
@@ -121,6 +138,9 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "servers"
         """
+        if self.path_prefix is not None:
+            return self.path_prefix
+
         # If we don't have a host name, assume it's just the first part of the
         # metric path
         if self.host is None:
@@ -135,6 +155,9 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "cpu"
         """
+        if self.collector_path is not None:
+            return self.collector_path
+
         # If we don't have a host name, assume it's just the third part of the
         # metric path
         if self.host is None:
@@ -151,6 +174,9 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "total.idle"
         """
+        if self.metric_path is not None:
+            return self.metric_path
+
         # If we don't have a host name, assume it's just the fourth+ part of the
         # metric path
         if self.host is None:
@@ -162,3 +188,196 @@ class Metric(object):
 
         offset = len(prefix) + 1
         return self.path[offset:]
+
+
+# Kinds of the numeric columns of the compact metric encoding
+_FLOAT, _INT, _NONE, _OBJECT = range(4)
+
+
+def _pack_numbers(numbers):
+    """
+    Pack a column of numbers into machine arrays. Anything that is not exactly
+    a float, an int or None is kept aside as is.
+    """
+    kinds = array('B')
+    floats = array('d')
+    ints = array('l')
+    objects = []
+    for number in numbers:
+        kind = type(number)
+        if kind is float:
+            kinds.append(_FLOAT)
+            floats.append(number)
+        elif kind is int:
+            kinds.append(_INT)
+            ints.append(number)
+        elif number is None:
+            kinds.append(_NONE)
+        else:
+            kinds.append(_OBJECT)
+            objects.append(number)
+    return (kinds.tostring(), floats.tostring(), ints.tostring(), objects)
+
+
+def _unpack_numbers(packed):
+    """
+    Reverse of _pack_numbers
+    """
+    kinds, floats, ints, objects = packed
+    kinds = array('B', kinds)
+    floats = array('d', floats)
+    ints = array('l', ints)
+    columns = (iter(floats).next, iter(ints).next, lambda: None,
+               iter(objects).next)
+    return [columns[kind]() for kind in kinds]
+
+
+def _intern(table, index, string):
+    """
+    Return the position of string in table, adding it if needed
+    """
+    if string is None:
+        return -1
+    position = index.get(string)
+    if position is None:
+        position = index[string] = len(table)
+        table.append(string)
+    return position
+
+
+def encode_metrics(metrics):
+    """
+    Encode a list of Metric objects into a compact, picklable tuple.
+
+    The path is split into the part up to its last dot, which is shared by
+    most metrics of a collector run, and the leaf name. Prefixes, hosts,
+    metric types and path components are interned into a string table for the
+    whole list and the numeric fields are packed into arrays. The metric path
+    component is a suffix of the path and is kept as its offset in the path.
+    """
+    strings = []
+    index = {}
+    names = []
+    prefixes = array('i')
+    hosts = array('i')
+    types = array('i')
+    path_prefixes = array('i')
+    collector_paths = array('i')
+    metric_paths = array('i')
+
+    for metric in metrics:
+        path = metric.path
+        offset = path.rfind('.') + 1
+        prefixes.append(_intern(strings, index, path[:offset]))
+        names.append(path[offset:])
+        hosts.append(_intern(strings, index, metric.host))
+        types.append(_intern(strings, index, metric.metric_type))
+        path_prefixes.append(_intern(strings, index, metric.path_prefix))
+        collector_paths.append(_intern(strings, index,
+                                       metric.collector_path))
+        if metric.metric_path is None:
+            metric_paths.append(-1)
+        else:
+            metric_paths.append(len(path) - len(metric.metric_path))
+
+    return (
+        strings,
+        '\n'.join(names),
+        prefixes.tostring(),
+        hosts.tostring(),
+        types.tostring(),
+        path_prefixes.tostring(),
+        collector_paths.tostring(),
+        metric_paths.tostring(),
+        _pack_numbers([m.value for m in metrics]),
+        _pack_numbers([m.raw_value for m in metrics]),
+        _pack_numbers([m.timestamp for m in metrics]),
+        _pack_numbers([m.precision for m in metrics]),
+        _pack_numbers([m.ttl for m in metrics]),
+    )
+
+
+def decode_metrics(state):
+    """
+    Rebuild the list of Metric objects encoded by encode_metrics
+    """
+    (strings, names, prefixes, hosts, types,
+     path_prefixes, collector_paths, metric_paths,
+     values, raw_values, timestamps, precisions, ttls) = state
+
+    # Position -1 is the None of the optional fields
+    strings = list(strings) + [None]
+    prefixes = array('i', prefixes)
+    names = names.split('\n') if prefixes else []
+    hosts = array('i', hosts)
+    types = array('i', types)
+    path_prefixes = array('i', path_prefixes)
+    collector_paths = array('i', collector_paths)
+    metric_paths = array('i', metric_paths)
+    values = _unpack_numbers(values)
+    raw_values = _unpack_numbers(raw_values)
+    timestamps = _unpack_numbers(timestamps)
+    precisions = _unpack_numbers(precisions)
+    ttls = _unpack_numbers(ttls)
+
+    metrics = []
+    new = Metric.__new__
+    for i in xrange(len(names)):
+        # The values were validated when the metric was first created
+        metric = new(Metric)
+        metric.path = path = strings[prefixes[i]] + names[i]
+        metric.value = values[i]
+        metric.raw_value = raw_values[i]
+        metric.timestamp = timestamps[i]
+        metric.precision = precisions[i]
+        metric.host = strings[hosts[i]]
+        metric.metric_type = strings[types[i]]
+        metric.ttl = ttls[i]
+        metric.path_prefix = strings[path_prefixes[i]]
+        metric.collector_path = strings[collector_paths[i]]
+        if metric_paths[i] < 0:
+            metric.metric_path = None
+        else:
+            metric.metric_path = path[metric_paths[i]:]
+        metrics.append(metric)
+    return metrics
+
+
+class MetricBatch(object):
+    """
+    The metrics of one collector run, moved between processes as a single
+    queue item. Handlers are flushed once the batch is processed unless flush
+    is False, which is the case when a run outgrew the batch size and more
+    metrics follow.
+    """
+    __slots__ = ['metrics', 'flush']
+
+    def __init__(self, metrics=None, flush=True):
+        if metrics is None:
+            metrics = []
+        self.metrics = metrics
+        self.flush = flush
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def __iter__(self):
+        return iter(self.metrics)
+
+    def __getstate__(self):
+        # Only plain Metric objects with newline free paths, ending with their
+        # metric path when they have one, take the compact encoding. Anything
+        # else is pickled as is
+        for metric in self.metrics:
+            if ((type(metric) is not Metric or '\n' in metric.path or
+                 (metric.metric_path is not None and
+                  not metric.path.endswith(metric.metric_path)))):
+                return (self.metrics, self.flush)
+        return (self.flush, encode_metrics(self.metrics))
+
+    def __setstate__(self, state):
+        if isinstance(state[0], list):
+            self.metrics, self.flush = state
+        else:
+            self.flush, encoded = state
+            self.metrics = decode_metrics(encoded)
@@ -3,37 +3,51 @@
 import logging
 import multiprocessing
 import os
+import Queue
 import signal
 import sys
 import time
 
-try:
-    from setproctitle import getproctitle, setproctitle
-except ImportError:
-    setproctitle = None
-
 # Path Fix
 sys.path.append(
     os.path.abspath(
         os.path.join(
             os.path.dirname(__file__), "../")))
 
+from diamond.utils.classes import CollectorLoader
 from diamond.utils.classes import initialize_collector
-from diamond.utils.classes import load_collectors
 from diamond.utils.classes import load_dynamic_class
 from diamond.utils.classes import load_handlers
 from diamond.utils.classes import load_include_path
 
-from diamond.utils.config import load_config
+from diamond.utils.config import ConfigDiff
+from diamond.utils.config import ConfigSnapshot
+from diamond.utils.config import get_enabled_collectors
+from diamond.utils.config import get_handler_names
+
+from diamond.utils.dispatch import create_handler_worker
+from diamond.utils.dispatch import ReloadHandlers
 
+from diamond.utils.scheduler import collector_pool_process
 from diamond.utils.scheduler import collector_process
 from diamond.utils.scheduler import handler_process
 
+from diamond.utils.telemetry import create_telemetry
+
+from diamond.utils.transport import MetricTransport
+from diamond.utils.transport import TRANSPORTS
+
 from diamond.handler.Handler import Handler
 
 from diamond.utils.signals import signal_to_exception
 from diamond.utils.signals import SIGHUPException
 
+# Server options a reload applies, the others need a restart
+RELOADABLE_SERVER_OPTIONS = set([
+    'collectors_load_delay',
+    'handlers',
+])
+
 
 class Server(object):
     """
@@ -45,20 +59,188 @@ class Server(object):
         self.log = logging.getLogger('diamond')
         # Initialize Members
         self.configfile = configfile
+        self.config_snapshot = None
         self.config = None
         self.handlers = []
-        self.handler_queue = []
+        self.handler_queue = {}
         self.modules = {}
         self.metric_queue = None
+        self.queue_handler_class = None
+        self.pool_collectors = set()
+        self.pool_processes = []
+        self.collector_loader = None
+        self.collector_loader_config = None
+        self.control_queue = None
+
+    def _load_collector_index(self):
+        """
+        Index the collector modules, only reading the ones that changed when
+        the collector paths are the same as before
+        """
+        loader_config = (self.config['server']['collectors_path'],
+                         self.config['server'].get('collectors_index_path'))
+        if loader_config == self.collector_loader_config:
+            self.collector_loader.refresh()
+        else:
+            self.collector_loader = CollectorLoader(
+                loader_config[0], index_path=loader_config[1] or None)
+            self.collector_loader_config = loader_config
+
+    def _get_execution(self, process_name):
+        """
+        How a collector runs: in a process of its own or in a pool process
+        """
+        config = self.config['collectors']
+        if process_name in config and 'execution' in config[process_name]:
+            return config[process_name]['execution']
+        return config.get('default', {}).get('execution', 'process')
+
+    def _initialize_collector(self, process_name, collector_classes):
+        """
+        Create the collector behind process_name, publishing through its own
+        queue handler
+        """
+        # To handle running multiple collectors concurrently, we
+        # split on white space and use the first word as the
+        # collector name to spin
+        collector_name = process_name.split()[0]
+
+        if 'Collector' not in collector_name:
+            return None
+
+        if collector_name not in collector_classes:
+            self.log.error('Can not find collector %s', collector_name)
+            return None
 
-        # We do this weird process title swap around to get the sync manager
-        # title correct for ps
-        if setproctitle:
-            oldproctitle = getproctitle()
-            setproctitle('%s - SyncManager' % getproctitle())
-        self.manager = multiprocessing.Manager()
-        if setproctitle:
-            setproctitle(oldproctitle)
+        if process_name not in self.handler_queue:
+            try:
+                queue = self.metric_queue.producer(process_name)
+            except Exception:
+                self.log.exception('Failed to get a metric queue for %s',
+                                   process_name)
+                return None
+            self.handler_queue[process_name] = self.queue_handler_class(
+                config=self.config, queue=queue, log=self.log)
+
+        collector = initialize_collector(
+            collector_classes[collector_name],
+            name=process_name,
+            configfile=self.config_snapshot,
+            handlers=[self.handler_queue[process_name]])
+
+        if collector is None:
+            self.log.error('Failed to load collector %s', process_name)
+
+        return collector
+
+    def _start_collector_pools(self, process_names, collector_classes):
+        """
+        (Re)start the pool processes running the collectors in process_names
+        on a thread pool
+        """
+        for process in self.pool_processes:
+            process.terminate()
+            process.join()
+            self.metric_queue.release(process.name)
+        self.pool_processes = []
+
+        for process_name in self.pool_collectors - process_names:
+            self.handler_queue.pop(process_name, None)
+            self.metric_queue.release(process_name)
+        self.pool_collectors = set(process_names)
+
+        collectors = []
+        for process_name in sorted(process_names):
+            collector = self._initialize_collector(process_name,
+                                                   collector_classes)
+            if collector is not None:
+                collectors.append(collector)
+
+        if not collectors:
+            return
+
+        pools = int(self.config['server'].get('collector_pool_processes', 1))
+        threads = int(self.config['server'].get('collector_pool_threads', 4))
+        pools = max(min(pools, len(collectors)), 1)
+
+        for i in range(pools):
+            name = 'CollectorPool-%d' % i
+            telemetry = create_telemetry(self.config, name)
+            telemetry_handler = None
+            if telemetry is not None:
+                telemetry_handler = self.queue_handler_class(
+                    config=self.config, queue=self.metric_queue.producer(name),
+                    log=self.log)
+            process = multiprocessing.Process(
+                name=name,
+                target=collector_pool_process,
+                args=(collectors[i::pools], self.metric_queue, self.log,
+                      threads, telemetry, telemetry_handler)
+            )
+            process.daemon = True
+            process.start()
+            self.pool_processes.append(process)
+
+    def _stop_collector_process(self, process_name):
+        """
+        Stop the process of a collector, the main loop starts it again if it
+        is still enabled
+        """
+        for process in multiprocessing.active_children():
+            if process.name == process_name:
+                process.terminate()
+                process.join(5)
+
+    def _reload_handlers(self, diff):
+        """
+        Have the handler process stop the handlers removed or changed and
+        start the ones added or changed
+        """
+        names = diff.handlers_removed | diff.handlers_changed
+        reload = ReloadHandlers(
+            remove=set(name.split('.')[-1] for name in names),
+            add=[(name, diff.handlers[name])
+                 for name in get_handler_names(self.config)
+                 if name in diff.handlers_added | diff.handlers_changed])
+        try:
+            if self.control_queue is None:
+                self.control_queue = self.metric_queue.producer('Server')
+            self.control_queue.put(reload, block=True, timeout=5)
+        except Queue.Full:
+            self.log.error('Failed to reload the handlers, metric queue full')
+
+    def _apply_config_diff(self, diff):
+        """
+        Restart or reconfigure only what a config reload changed. Collectors
+        added or removed are started or stopped by the main loop.
+        """
+        pool_collectors = set(
+            process_name
+            for process_name in get_enabled_collectors(self.config)
+            if self._get_execution(process_name) == 'pool')
+
+        reload_pools = False
+        for process_name in diff.collectors_changed:
+            if process_name in pool_collectors:
+                reload_pools = True
+            else:
+                self._stop_collector_process(process_name)
+
+        # Pools reload the config of their collectors in place, unless the
+        # main loop restarts them for a change of their collectors
+        if reload_pools and pool_collectors == self.pool_collectors:
+            for process in self.pool_processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGHUP)
+
+        if ((diff.handlers_added or diff.handlers_removed or
+             diff.handlers_changed)):
+            self._reload_handlers(diff)
+
+        restart = diff.server_changed - RELOADABLE_SERVER_OPTIONS
+        if restart:
+            self.log.warning('Restart diamond to apply the server options %s',
+                             ', '.join(sorted(restart)))
 
     def run(self):
         """
@@ -68,18 +250,25 @@ class Server(object):
         #######################################################################
         # Config
         #######################################################################
-        self.config = load_config(self.configfile)
+        self.config_snapshot = ConfigSnapshot(self.configfile)
+        self.config = self.config_snapshot.config
 
-        collectors = load_collectors(self.config['server']['collectors_path'])
-        metric_queue_size = int(self.config['server'].get('metric_queue_size',
-                                                          16384))
-        self.metric_queue = self.manager.Queue(maxsize=metric_queue_size)
-        self.log.debug('metric_queue_size: %d', metric_queue_size)
+        self._load_collector_index()
+
+        #######################################################################
+        # Metric transport
+        #######################################################################
+
+        transport = self.config['server'].get('metric_transport', 'manager')
+        self.log.debug('metric_transport: %s', transport)
+        MetricTransportClass = load_dynamic_class(
+            TRANSPORTS.get(transport, transport),
+            MetricTransport
+        )
+        self.metric_queue = MetricTransportClass(self.config['server'])
 
         #######################################################################
         # Handlers
-        #
-        # TODO: Eventually move each handler to it's own process space?
         #######################################################################
 
         if 'handlers_path' in self.config['server']:
@@ -89,7 +278,6 @@ class Server(object):
             if isinstance(handlers_path, basestring):
                 handlers_path = handlers_path.split(',')
                 handlers_path = map(str.strip, handlers_path)
-                self.config['server']['handlers_path'] = handlers_path
 
             load_include_path(handlers_path)
 
@@ -97,28 +285,32 @@ class Server(object):
             self.log.critical('handlers missing from server section in config')
             sys.exit(1)
 
-        handlers = self.config['server'].get('handlers')
-        if isinstance(handlers, basestring):
-            handlers = [handlers]
-
         # Prevent the Queue Handler from being a normal handler
-        if 'diamond.handler.queue.QueueHandler' in handlers:
-            handlers.remove('diamond.handler.queue.QueueHandler')
+        handlers = get_handler_names(self.config)
 
         self.handlers = load_handlers(self.config, handlers)
 
-        QueueHandler = load_dynamic_class(
+        # Process workers are started from here as the handler process is not
+        # allowed to have children
+        handler_workers = []
+        for handler in self.handlers:
+            try:
+                handler_workers.append(create_handler_worker(handler,
+                                                             self.log))
+            except ValueError, e:
+                self.log.critical(str(e))
+                sys.exit(1)
+
+        self.queue_handler_class = load_dynamic_class(
             'diamond.handler.queue.QueueHandler',
             Handler
         )
 
-        self.handler_queue = QueueHandler(
-            config=self.config, queue=self.metric_queue, log=self.log)
-
         process = multiprocessing.Process(
             name="Handlers",
             target=handler_process,
-            args=(self.handlers, self.metric_queue, self.log),
+            args=(handler_workers, self.metric_queue, self.log,
+                  create_telemetry(self.config, 'Handlers')),
         )
 
         process.daemon = True
@@ -145,51 +337,49 @@ class Server(object):
                 # Collectors
                 ##############################################################
 
-                running_collectors = []
-                for collector, config in self.config['collectors'].iteritems():
-                    if config.get('enabled', False) is not True:
-                        continue
-                    running_collectors.append(collector)
-                running_collectors = set(running_collectors)
+                running_collectors = get_enabled_collectors(self.config)
+
+                # Collectors sharing the pool processes
+                pool_collectors = set(
+                    process_name for process_name in running_collectors
+                    if self._get_execution(process_name) == 'pool')
 
                 # Collectors that are running but shouldn't be
-                for process_name in running_processes - running_collectors:
+                for process_name in running_processes - (running_collectors -
+                                                         pool_collectors):
                     if 'Collector' not in process_name:
                         continue
+                    if process_name.startswith('CollectorPool-'):
+                        continue
+                    stopped = None
                     for process in active_children:
                         if process.name == process_name:
                             process.terminate()
-
-                collector_classes = dict(
-                    (cls.__name__.split('.')[-1], cls)
-                    for cls in collectors.values()
-                )
+                            process.join(5)
+                            stopped = process
+                    self.handler_queue.pop(process_name, None)
+                    # The ring of the process is only reused once it is dead
+                    self.metric_queue.release(process_name, stopped)
+
+                # Only the modules of the enabled collectors are imported
+                collector_classes = self.collector_loader.load(set(
+                    process_name.split()[0]
+                    for process_name in running_collectors
+                    if 'Collector' in process_name))
+
+                if ((pool_collectors != self.pool_collectors or
+                     not all(process.is_alive()
+                             for process in self.pool_processes))):
+                    self._start_collector_pools(pool_collectors,
+                                                collector_classes)
 
                 load_delay = self.config['server'].get('collectors_load_delay',
                                                        1.0)
-                for process_name in running_collectors - running_processes:
-                    # To handle running multiple collectors concurrently, we
-                    # split on white space and use the first word as the
-                    # collector name to spin
-                    collector_name = process_name.split()[0]
-
-                    if 'Collector' not in collector_name:
-                        continue
-
-                    if collector_name not in collector_classes:
-                        self.log.error('Can not find collector %s',
-                                       collector_name)
-                        continue
-
-                    collector = initialize_collector(
-                        collector_classes[collector_name],
-                        name=process_name,
-                        configfile=self.configfile,
-                        handlers=[self.handler_queue])
-
+                for process_name in (running_collectors - pool_collectors -
+                                     running_processes):
+                    collector = self._initialize_collector(process_name,
+                                                           collector_classes)
                     if collector is None:
-                        self.log.error('Failed to load collector %s',
-                                       process_name)
                         continue
 
                     # Splay the loads
@@ -198,7 +388,8 @@ class Server(object):
                     process = multiprocessing.Process(
                         name=process_name,
                         target=collector_process,
-                        args=(collector, self.metric_queue, self.log)
+                        args=(collector, self.metric_queue, self.log,
+                              create_telemetry(self.config, process_name))
                     )
                     process.daemon = True
                     process.start()
@@ -213,8 +404,15 @@ class Server(object):
                 signal.signal(signal.SIGHUP, signal.SIG_IGN)
 
                 self.log.info('Reloading state due to HUP')
-                self.config = load_config(self.configfile)
-                collectors = load_collectors(
-                    self.config['server']['collectors_path'])
+                old_config = self.config
+                if self.config_snapshot.refresh():
+                    self.config = self.config_snapshot.config
+                    diff = ConfigDiff(old_config, self.config)
+                    self.log.info('Config version %d: %s',
+                                  self.config_snapshot.version, diff)
+                    self._apply_config_diff(diff)
+                else:
+                    self.log.info('Config unchanged')
+                self._load_collector_index()
                 # restore SIGHUP handler
                 signal.signal(signal.SIGHUP, original_sighup_handler)
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+import urllib2
+
+from test import unittest
+import configobj
+
+from diamond.collector import AsyncCollector
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer /<name>/<seconds> with name after sleeping for seconds
+    """
+
+    def do_GET(self):
+        name, delay = self.path.strip('/').split('/')
+        time.sleep(float(delay))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(name)))
+        self.end_headers()
+        self.wfile.write(name)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class FetchCollector(AsyncCollector):
+
+    def __init__(self, urls, **options):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = options
+        super(FetchCollector, self).__init__(config, [])
+        self.urls = urls
+        self.results = None
+
+    def fetch(self, url):
+        return urllib2.urlopen(url, timeout=self.get_request_timeout()).read()
+
+    def collect(self):
+        self.results = self.run_concurrently([(self.fetch, (url,))
+                                              for url in self.urls])
+
+
+class TestAsyncCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_urls(self, count, delay):
+        return ['http://127.0.0.1:%d/instance%d/%s' % (
+            self.server.server_address[1], i, delay) for i in range(count)]
+
+    def run_collector(self, collector):
+        start = time.time()
+        collector.collect()
+        return time.time() - start
+
+    def test_wall_time_is_max_latency(self):
+        collector = FetchCollector(self.get_urls(8, 0.3), concurrency=8)
+        elapsed = self.run_collector(collector)
+
+        self.assertEqual(collector.results,
+                         ['instance%d' % i for i in range(8)])
+        # Serially this takes 2.4 seconds
+        self.assertTrue(elapsed < 1.2, elapsed)
+
+    def test_concurrency_limit(self):
+        collector = FetchCollector(self.get_urls(4, 0.2), concurrency=2)
+        elapsed = self.run_collector(collector)
+
+        self.assertEqual(len(collector.results), 4)
+        self.assertTrue(elapsed >= 0.4, elapsed)
+
+    def test_request_timeout(self):
+        urls = self.get_urls(1, 0) + self.get_urls(1, 2)
+        collector = FetchCollector(urls, request_timeout=0.5)
+        elapsed = self.run_collector(collector)
+
+        self.assertEqual(collector.results, ['instance0', None])
+        self.assertTrue(elapsed < 1.5, elapsed)
+
+    def test_deadline(self):
+        collector = FetchCollector(self.get_urls(1, 2), request_timeout=10)
+        collector.deadline = time.time() + 0.3
+        elapsed = self.run_collector(collector)
+
+        self.assertEqual(collector.results, [None])
+        self.assertTrue(elapsed < 1, elapsed)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
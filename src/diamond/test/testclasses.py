@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from test import unittest
+
+from diamond.utils.classes import CollectorLoader
+
+GOOD = """
+import diamond.collector
+
+
+class LazyGoodCollector(diamond.collector.Collector):
+
+    def collect(self):
+        pass
+"""
+
+BROKEN = """
+import diamond.collector
+import lazy_module_that_does_not_exist
+
+
+class LazyBrokenCollector(diamond.collector.Collector):
+    pass
+"""
+
+DYNAMIC = """
+import diamond.collector
+
+LazyDynamicCollector = type('LazyDynamicCollector',
+                            (diamond.collector.Collector,), {})
+"""
+
+
+class TestCollectorLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.path, 'collectors.index')
+        self.write('good/lazygood.py', GOOD)
+        self.write('broken/lazybroken.py', BROKEN)
+        self.write('broken/test/testlazybroken.py', BROKEN)
+        self.modules = set(sys.modules)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        for name in set(sys.modules) - self.modules:
+            del sys.modules[name]
+        for path in list(sys.path):
+            if path.startswith(self.path):
+                sys.path.remove(path)
+
+    def write(self, name, source, mtime=None):
+        fpath = os.path.join(self.path, name)
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        with open(fpath, 'w') as f:
+            f.write(source)
+        if mtime is not None:
+            os.utime(fpath, (mtime, mtime))
+        return fpath
+
+    def get_loader(self):
+        return CollectorLoader(self.path, index_path=self.index_path)
+
+    def test_index(self):
+        loader = self.get_loader()
+        self.assertEqual(sorted(loader.modules), ['LazyBrokenCollector',
+                                                  'LazyGoodCollector'])
+        self.assertEqual(loader.loaded, {})
+
+        with open(self.index_path) as f:
+            index = json.load(f)['modules']
+        self.assertEqual(sorted(os.path.basename(fpath) for fpath in index),
+                         ['lazybroken.py', 'lazygood.py'])
+
+    def test_load_only_enabled(self):
+        loader = self.get_loader()
+        collectors = loader.load(['LazyGoodCollector'])
+
+        self.assertEqual(collectors.keys(), ['LazyGoodCollector'])
+        self.assertEqual(collectors['LazyGoodCollector'].__name__,
+                         'LazyGoodCollector')
+        self.assertTrue('lazygood' in sys.modules)
+        self.assertFalse('lazybroken' in sys.modules)
+
+        # Imported once
+        module = sys.modules['lazygood']
+        loader.load(['LazyGoodCollector'])
+        self.assertTrue(sys.modules['lazygood'] is module)
+
+    def test_changed_module(self):
+        fpath = self.write('good/lazygood.py', GOOD, mtime=1000)
+        loader = self.get_loader()
+        self.assertEqual(loader.index[fpath]['mtime'], 1000)
+        loader.load(['LazyGoodCollector'])
+
+        self.write('good/lazygood.py',
+                   GOOD.replace('LazyGood', 'LazyRenamed'), mtime=2000)
+        # A new loader reads only the changed module, from the saved index
+        self.assertEqual(sorted(self.get_loader().modules),
+                         ['LazyBrokenCollector', 'LazyRenamedCollector'])
+
+        loader.refresh()
+        collectors = loader.load(['LazyRenamedCollector'])
+        self.assertEqual(collectors.keys(), ['LazyRenamedCollector'])
+
+    def test_not_indexed(self):
+        self.write('dynamic/lazydynamic.py', DYNAMIC)
+        loader = self.get_loader()
+        self.assertFalse('LazyDynamicCollector' in loader.modules)
+
+        collectors = loader.load(['LazyDynamicCollector', 'MissingCollector'])
+        self.assertEqual(collectors.keys(), ['LazyDynamicCollector'])
+        self.assertTrue(loader.scanned)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
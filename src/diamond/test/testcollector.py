@@ -2,11 +2,65 @@
 # coding=utf-8
 ##########################################################################
 
+import time
+
 from mock import patch
 from test import unittest
 import configobj
 
 from diamond.collector import Collector
+from diamond.metric import Metric
+
+
+class NullHandler(object):
+
+    def __init__(self):
+        self.count = 0
+        self.batches = 0
+
+    def _process(self, metric):
+        self.count += 1
+
+    def _process_many(self, metrics):
+        self.count += len(metrics)
+        self.batches += 1
+
+    def _flush(self):
+        pass
+
+
+def benchmark_publish(count, rounds=5):
+    """
+    Measure how many metrics per second publish and publish_counter get
+    through to a handler doing nothing
+    """
+    config = configobj.ConfigObj()
+    config['collectors'] = {}
+    config['collectors']['default'] = {
+        'hostname': 'com.example.www',
+        'path': 'bench',
+    }
+    collector = Collector(config, [NullHandler()])
+    names = ['metric%d.value' % i for i in range(count)]
+
+    results = {}
+    for method in ('publish', 'publish_counter'):
+        publish = getattr(collector, method)
+        start = time.time()
+        for i in range(rounds):
+            for name in names:
+                publish(name, i)
+        elapsed = (time.time() - start) / rounds
+        results[method] = count / max(elapsed, 1e-9)
+
+    for method in ('publish_many', 'publish_counters'):
+        publish = getattr(collector, method)
+        start = time.time()
+        for i in range(rounds):
+            publish([(name, i) for name in names])
+        elapsed = (time.time() - start) / rounds
+        results[method] = count / max(elapsed, 1e-9)
+    return results
 
 
 class BaseCollectorTest(unittest.TestCase):
@@ -108,3 +162,140 @@ class BaseCollectorTest(unittest.TestCase):
         result = Collector(config, []).get_metric_path('foo')
 
         self.assertEqual('poof.bar.xyz.foo', result)
+
+    def test_metric_path_cache(self):
+        config = configobj.ConfigObj()
+        config['collectors'] = {}
+        config['collectors']['default'] = {
+            'hostname': 'bar',
+            'path_prefix': 'poof',
+            'path': 'xyz',
+        }
+        collector = Collector(config, [])
+        self.assertEqual('poof.bar.xyz.foo', collector.get_metric_path('foo'))
+        self.assertEqual('instances.i-1.xyz.foo',
+                         collector.get_metric_path('foo', instance='i-1'))
+
+        # Only a config reload changes the path
+        config['collectors']['default']['hostname'] = 'baz'
+        self.assertEqual('poof.bar.xyz.foo', collector.get_metric_path('foo'))
+        self.assertEqual('bar', collector.get_hostname())
+        collector.load_config(override_config=config)
+        self.assertEqual('poof.baz.xyz.foo', collector.get_metric_path('foo'))
+        self.assertEqual('baz', collector.get_hostname())
+
+    def test_metric_path_components(self):
+        configs = [
+            {'hostname': 'bar', 'path': 'xyz'},
+            {'hostname': 'bar', 'path': 'xyz', 'path_suffix': 'sfx'},
+            {'hostname': 'bar', 'path': '.'},
+            {'hostname': 'bar', 'path': 'xyz', 'path_prefix': ''},
+            {'hostname': 'bar', 'path': 'x.y.z', 'path_prefix': 'a.b'},
+            {'hostname': 'com.example.www', 'path': 'xyz'},
+        ]
+        for options in configs:
+            config = configobj.ConfigObj()
+            config['collectors'] = {}
+            config['collectors']['default'] = options
+            collector = Collector(config, [])
+
+            with patch.object(Collector, 'publish_metric') as publish_metric:
+                collector.publish('foo.baz', 1)
+            metric = publish_metric.call_args[0][0]
+
+            # The components given match what would be parsed from the path
+            parsed = Metric(metric.path, metric.value, host=metric.host)
+            self.assertEqual(metric.getPathPrefix(), parsed.getPathPrefix())
+            self.assertEqual(metric.getCollectorPath(),
+                             parsed.getCollectorPath())
+            self.assertEqual(metric.getMetricPath(), parsed.getMetricPath())
+
+        self.assertEqual(collector.get_path_components('foo'),
+                         ('servers', 'xyz', 'foo'))
+        self.assertEqual(collector.get_path_components('foo', instance='i'),
+                         (None, None, None))
+
+    def get_collector(self, **options):
+        config = configobj.ConfigObj()
+        config['collectors'] = {}
+        config['collectors']['default'] = {
+            'hostname': 'bar',
+            'path': 'xyz',
+        }
+        config['collectors']['default'].update(options)
+        return Collector(config, [NullHandler()])
+
+    def test_publish_many(self):
+        collector = self.get_collector()
+        handler = collector.handlers[0]
+        collector.publish_many({'a': 1, 'b': 2.5}, precision=1)
+        collector.publish_many([('c', 3)], instance='i-1')
+        collector.publish_many([])
+
+        self.assertEqual(handler.count, 3)
+        self.assertEqual(handler.batches, 2)
+
+    def test_publish_many_metrics(self):
+        collector = self.get_collector(metrics_blacklist='^b')
+        with patch.object(Collector, 'publish_metrics') as publish_metrics:
+            collector.publish_many([('a', 1), ('b', 2), ('c', '3')],
+                                   precision=2)
+        metrics = publish_metrics.call_args[0][0]
+
+        self.assertEqual([m.path for m in metrics],
+                         ['servers.bar.xyz.a', 'servers.bar.xyz.c'])
+        self.assertEqual([m.value for m in metrics], [1, 3.0])
+        self.assertEqual(set(m.precision for m in metrics), set([2]))
+        self.assertEqual(set(m.metric_type for m in metrics),
+                         set(['GAUGE']))
+        self.assertEqual(set(m.ttl for m in metrics), set([600.0]))
+
+    def test_publish_many_invalid(self):
+        collector = self.get_collector()
+        with patch.object(collector, 'log') as log:
+            collector.publish_many([('a', 1), ('b', 'nan value'), ('c', 3)])
+
+        self.assertEqual(collector.handlers[0].count, 2)
+        self.assertEqual(log.error.call_count, 1)
+
+    def test_publish_counters(self):
+        collector = self.get_collector(interval=10, metrics_whitelist='^a')
+        with patch.object(Collector, 'publish_metrics') as publish_metrics:
+            collector.publish_counters({'a': 100, 'b': 1})
+            collector.publish_counters({'a': 150, 'b': 2})
+        metrics = publish_metrics.call_args[0][0]
+
+        self.assertEqual(len(metrics), 1)
+        self.assertEqual(metrics[0].value, 5)
+        self.assertEqual(metrics[0].raw_value, 150)
+        self.assertEqual(metrics[0].metric_type, 'COUNTER')
+
+    def test_forget_counters(self):
+        collector = self.get_collector(interval=10, counter_ttl=2)
+        series = [{'a': 10, 'b': 10}, {'a': 20}, {'a': 30}, {'a': 40, 'b': 50}]
+        collector.collect = lambda: collector.publish_counters(series.pop(0))
+
+        collector._run()
+        self.assertEqual(len(collector.last_values), 2)
+        collector._run()
+        collector._run()
+        # b was not published for two runs
+        self.assertEqual(collector.last_values.keys(), ['servers.bar.xyz.a'])
+        self.assertEqual(collector.last_values.expired, 1)
+
+        # Starts over rather than a rate from the value of three runs ago
+        with patch.object(Collector, 'publish_metrics') as publish_metrics:
+            collector._run()
+        values = dict((m.path, m.value)
+                      for m in publish_metrics.call_args[0][0])
+        self.assertEqual(values, {'servers.bar.xyz.a': 1,
+                                  'servers.bar.xyz.b': 0})
+
+    def test_publish_benchmark(self):
+        results = benchmark_publish(100, rounds=1)
+        self.assertTrue(results['publish'] > 0)
+
+##########################################################################
+if __name__ == "__main__":
+    for method, rate in sorted(benchmark_publish(10000).iteritems()):
+        print '%-15s %10d metrics/s' % (method, rate)
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+from mock import patch
+import configobj
+
+from diamond.collector import Collector
+from diamond.utils import config as config_module
+from diamond.utils.config import ConfigDiff
+from diamond.utils.config import ConfigSnapshot
+from diamond.utils.config import load_config
+
+
+class TestConfigSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.collectors_path = os.path.join(self.path, 'collectors')
+        os.mkdir(self.collectors_path)
+        self.configfile = self.write('diamond.conf', '\n'.join([
+            '[server]',
+            'collectors_config_path = %s' % self.collectors_path,
+            '[collectors]',
+            '[[default]]',
+            'interval = 30',
+        ]), mtime=1000)
+        self.write('collectors/CPUCollector.conf', 'enabled = True\n',
+                   mtime=1000)
+        os.utime(self.collectors_path, (1000, 1000))
+
+        self.patcher = patch.object(config_module, 'load_config',
+                                    side_effect=load_config)
+        self.load_config = self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.path)
+
+    def write(self, name, content, mtime=None):
+        fpath = os.path.join(self.path, name)
+        with open(fpath, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(fpath, (mtime, mtime))
+        return fpath
+
+    def test_parsed_once(self):
+        snapshot = ConfigSnapshot(self.configfile)
+        self.assertEqual(snapshot.version, 1)
+        self.assertTrue(snapshot.config['collectors']['CPUCollector'][
+            'enabled'])
+
+        self.assertFalse(snapshot.refresh())
+        self.assertTrue(snapshot.load() is snapshot.config)
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(self.load_config.call_count, 1)
+
+    def test_changed_files(self):
+        snapshot = ConfigSnapshot(self.configfile)
+
+        # A changed file
+        self.write('collectors/CPUCollector.conf', 'enabled = False\n',
+                   mtime=2000)
+        self.assertTrue(snapshot.changed())
+        self.assertFalse(snapshot.load()['collectors']['CPUCollector'][
+            'enabled'])
+        self.assertEqual(snapshot.version, 2)
+
+        # A new file in a config directory
+        self.write('collectors/MemoryCollector.conf', 'enabled = True\n')
+        os.utime(self.collectors_path, (3000, 3000))
+        self.assertTrue(snapshot.refresh())
+        self.assertTrue('MemoryCollector' in snapshot.config['collectors'])
+        self.assertEqual(snapshot.version, 3)
+
+        # A removed file
+        os.unlink(os.path.join(self.collectors_path, 'MemoryCollector.conf'))
+        self.assertTrue(snapshot.refresh())
+        self.assertFalse('MemoryCollector' in snapshot.config['collectors'])
+        self.assertEqual(self.load_config.call_count, 4)
+
+    def test_shared_by_collectors(self):
+        snapshot = ConfigSnapshot(self.configfile)
+        collectors = [Collector(name='CPUCollector', configfile=snapshot,
+                                handlers=[])
+                      for i in range(10)]
+        for collector in collectors:
+            collector.load_config()
+
+        self.assertEqual(self.load_config.call_count, 1)
+        for collector in collectors:
+            self.assertEqual(collector.config['interval'], '30')
+            self.assertTrue(collector.config['enabled'])
+            self.assertEqual(collector.config_version, 1)
+            self.assertEqual(collector.configfile, self.configfile)
+
+        self.write('diamond.conf', '\n'.join([
+            '[server]',
+            '[collectors]',
+            '[[default]]',
+            'interval = 10',
+        ]), mtime=2000)
+        collectors[0].load_config()
+        self.assertEqual(collectors[0].config['interval'], '10')
+        self.assertEqual(collectors[0].config_version, 2)
+        self.assertFalse(collectors[0].config['enabled'])
+
+    def test_lists_not_shared(self):
+        class ListCollector(Collector):
+            def process_config(self):
+                super(ListCollector, self).process_config()
+                self.config['hosts'].append('localhost')
+
+        self.write('collectors/ListCollector.conf', 'hosts = db1, db2\n')
+        snapshot = ConfigSnapshot(self.configfile)
+        collector = ListCollector(configfile=snapshot, handlers=[])
+        collector.load_config()
+        collector.load_config()
+
+        self.assertEqual(collector.config['hosts'],
+                         ['db1', 'db2', 'localhost'])
+        self.assertEqual(
+            snapshot.config['collectors']['ListCollector']['hosts'],
+            ['db1', 'db2'])
+
+
+def get_config(collectors, handlers, **server):
+    config = configobj.ConfigObj()
+    config['server'] = {'handlers': sorted(handlers)}
+    config['server'].update(server)
+    config['handlers'] = {'default': {}}
+    for fqn, section in handlers.items():
+        config['handlers'][fqn.split('.')[-1]] = section
+    config['collectors'] = {'default': {'interval': 10}}
+    config['collectors'].update(collectors)
+    return config
+
+
+class TestConfigDiff(unittest.TestCase):
+
+    def test_diff(self):
+        old = get_config({
+            'CPUCollector': {'enabled': True},
+            'MemoryCollector': {'enabled': True, 'interval': 5},
+            'DiskSpaceCollector': {'enabled': True},
+            'LoadAverageCollector': {'enabled': False},
+        }, {
+            'diamond.handler.graphite.GraphiteHandler': {'host': 'a'},
+            'diamond.handler.archive.ArchiveHandler': {'days': 7},
+        }, metric_queue_size=100)
+        new = get_config({
+            'CPUCollector': {'enabled': True},
+            'MemoryCollector': {'enabled': True, 'interval': 60},
+            'LoadAverageCollector': {'enabled': True},
+        }, {
+            'diamond.handler.graphite.GraphiteHandler': {'host': 'b'},
+            'diamond.handler.stats_d.StatsdHandler': {},
+        }, metric_queue_size=100)
+
+        diff = ConfigDiff(old, new)
+        self.assertEqual(diff.collectors_added, set(['LoadAverageCollector']))
+        self.assertEqual(diff.collectors_removed,
+                         set(['DiskSpaceCollector']))
+        self.assertEqual(diff.collectors_changed, set(['MemoryCollector']))
+        self.assertEqual(diff.handlers_added,
+                         set(['diamond.handler.stats_d.StatsdHandler']))
+        self.assertEqual(diff.handlers_removed,
+                         set(['diamond.handler.archive.ArchiveHandler']))
+        self.assertEqual(diff.handlers_changed,
+                         set(['diamond.handler.graphite.GraphiteHandler']))
+        self.assertEqual(
+            diff.handlers['diamond.handler.graphite.GraphiteHandler'],
+            {'host': 'b'})
+        self.assertEqual(diff.server_changed, set(['handlers']))
+        self.assertTrue(diff)
+        self.assertTrue('collectors changed: MemoryCollector' in str(diff))
+
+    def test_default_section(self):
+        old = get_config({'CPUCollector': {'enabled': True}}, {})
+        new = get_config({'CPUCollector': {'enabled': True}}, {})
+        self.assertFalse(ConfigDiff(old, new))
+        self.assertEqual(str(ConfigDiff(old, new)), 'nothing changed')
+
+        # A change of the defaults changes every collector
+        new['collectors']['default']['interval'] = 20
+        self.assertEqual(ConfigDiff(old, new).collectors_changed,
+                         set(['CPUCollector']))
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+
+from diamond.utils.counters import CounterStore
+
+
+class TestCounterStore(unittest.TestCase):
+
+    def test_ttl(self):
+        store = CounterStore(ttl=2, max_size=0)
+        store['a'] = 1
+        store['b'] = 1
+        self.assertEqual(store.expire(), 0)
+
+        store['a'] = 2
+        self.assertEqual(store.expire(), 0)
+        self.assertEqual(sorted(store), ['a', 'b'])
+
+        store['a'] = 3
+        self.assertEqual(store.expire(), 1)
+        self.assertEqual(store.keys(), ['a'])
+        self.assertEqual(store['a'], 3)
+        self.assertFalse('b' in store)
+        self.assertEqual(store.get('a'), 3)
+        self.assertEqual(store.get('b', 0), 0)
+        self.assertEqual(store.expired, 1)
+        self.assertEqual(store.evicted, 0)
+
+    def test_max_size(self):
+        store = CounterStore(ttl=0, max_size=3)
+        for run in range(5):
+            store['series.%d' % run] = run
+            store['series.0'] = 0
+            store.expire()
+
+        # The least recently updated go first
+        self.assertEqual(sorted(store), ['series.0', 'series.3', 'series.4'])
+        self.assertEqual(store.evicted, 2)
+        self.assertEqual(store.expired, 0)
+        self.assertEqual(len(store), 3)
+
+    def test_interned(self):
+        store = CounterStore()
+        store[''.join(['servers.', 'host.cpu'])] = 1
+        self.assertTrue(store.keys()[0] is intern('servers.host.cpu'))
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
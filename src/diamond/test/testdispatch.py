@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import logging
+import multiprocessing
+import threading
+import time
+
+from test import unittest
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+from diamond.utils.dispatch import create_handler_worker
+from diamond.utils.dispatch import InlineHandlerWorker
+from diamond.utils.dispatch import ProcessHandlerWorker
+from diamond.utils.dispatch import reload_handler_workers
+from diamond.utils.dispatch import ReloadHandlers
+from diamond.utils.dispatch import ThreadHandlerWorker
+
+
+class RecordingHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.done = threading.Event()
+        self.events = []
+
+    def process(self, metric):
+        self.gate.wait()
+        self.events.append(metric.value)
+
+    def flush(self):
+        self.events.append('flush')
+        self.done.set()
+
+
+class PipeHandler(Handler):
+
+    def __init__(self, config=None, conn=None):
+        Handler.__init__(self, config)
+        self.conn = conn
+        self.values = []
+
+    def process(self, metric):
+        if metric.value < 0:
+            raise ValueError(metric.value)
+        self.values.append(metric.value)
+
+    def flush(self):
+        self.conn.send(self.values)
+
+
+def get_metrics(*values):
+    return [Metric('servers.host.cpu.total', v) for v in values]
+
+
+class TestHandlerWorkers(unittest.TestCase):
+
+    def get_handler(self, **options):
+        config = configobj.ConfigObj()
+        config.update(options)
+        return RecordingHandler(config)
+
+    def test_create(self):
+        log = logging.getLogger('diamond')
+        self.assertTrue(isinstance(
+            create_handler_worker(self.get_handler(), log),
+            InlineHandlerWorker))
+        self.assertTrue(isinstance(
+            create_handler_worker(self.get_handler(dispatch='thread'), log),
+            ThreadHandlerWorker))
+        self.assertRaises(ValueError, create_handler_worker,
+                          self.get_handler(dispatch='fork'), log)
+        self.assertRaises(ValueError, create_handler_worker,
+                          self.get_handler(dispatch='thread',
+                                           dispatch_overflow='explode'), log)
+
+    def test_thread(self):
+        handler = self.get_handler(dispatch='thread')
+        worker = create_handler_worker(handler, logging.getLogger('diamond'))
+        worker.start()
+
+        worker.put(get_metrics(1, 2), False)
+        worker.put(get_metrics(3), True)
+
+        self.assertTrue(handler.done.wait(5))
+        self.assertEqual(handler.events, [1, 2, 3, 'flush'])
+        self.assertEqual(worker.stats(),
+                         {'queue_depth': 0, 'dropped': 0, 'errors': 0})
+
+    def test_thread_drop_new(self):
+        handler = self.get_handler(dispatch='thread', dispatch_queue_size=1)
+        worker = ThreadHandlerWorker(handler, logging.getLogger('diamond'))
+
+        worker.put(get_metrics(1), False)
+        worker.put(get_metrics(2, 3), True)
+        self.assertEqual(worker.depth(), 2)
+        self.assertEqual(worker.dropped, 2)
+
+        worker.start()
+        self.assertTrue(handler.done.wait(5))
+        self.assertEqual(handler.events, [1, 'flush'])
+
+    def test_thread_drop_old(self):
+        handler = self.get_handler(dispatch='thread', dispatch_queue_size=1,
+                                   dispatch_overflow='drop_old')
+        worker = ThreadHandlerWorker(handler, logging.getLogger('diamond'))
+
+        worker.put(get_metrics(1), True)
+        worker.put(get_metrics(2, 3), False)
+        self.assertEqual(worker.depth(), 1)
+        self.assertEqual(worker.dropped, 1)
+
+        worker.start()
+        self.assertTrue(handler.done.wait(5))
+        self.assertEqual(handler.events, [2, 3, 'flush'])
+
+    def test_slow_handler_does_not_block(self):
+        slow = self.get_handler(dispatch='thread', dispatch_queue_size=2)
+        slow.gate.clear()
+        fast = self.get_handler(dispatch='thread')
+        log = logging.getLogger('diamond')
+        workers = [create_handler_worker(slow, log),
+                   create_handler_worker(fast, log)]
+        for worker in workers:
+            worker.start()
+
+        for i in range(10):
+            for worker in workers:
+                worker.put(get_metrics(i), i == 9)
+
+        self.assertTrue(fast.done.wait(5))
+        self.assertEqual(fast.events, range(10) + ['flush'])
+        self.assertTrue(workers[0].dropped > 0)
+        slow.gate.set()
+
+    def test_process(self):
+        parent, child = multiprocessing.Pipe()
+        config = configobj.ConfigObj()
+        config['dispatch'] = 'process'
+        handler = PipeHandler(config, conn=child)
+        worker = ProcessHandlerWorker(handler, logging.getLogger('diamond'))
+        try:
+            worker.put(get_metrics(1, 2), False)
+            worker.put(get_metrics(-1, 3), True)
+            self.assertTrue(parent.poll(5))
+            self.assertEqual(parent.recv(), [1, 2, 3])
+
+            # Errors of the worker process are counted by the handler process
+            for i in range(500):
+                if worker.stats()['errors']:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(worker.stats()['errors'], 1)
+            self.assertEqual(worker.handler_stats(), {})
+        finally:
+            worker.process.terminate()
+            worker.process.join()
+
+    def test_thread_stop(self):
+        handler = self.get_handler(dispatch='thread')
+        handler.gate.clear()
+        worker = create_handler_worker(handler, logging.getLogger('diamond'))
+        worker.start()
+        worker.put(get_metrics(1, 2), False)
+
+        # What is queued is processed before the handler is closed
+        handler.gate.set()
+        worker.stop()
+        self.assertFalse(worker.thread.is_alive())
+        self.assertEqual(handler.events, [1, 2, 'flush'])
+
+    def test_reload(self):
+        log = logging.getLogger('diamond')
+        kept = create_handler_worker(self.get_handler(), log)
+        removed = create_handler_worker(self.get_handler(dispatch='thread'),
+                                        log)
+        removed.name = 'GraphiteHandler'
+        removed.start()
+
+        workers = reload_handler_workers([kept, removed], ReloadHandlers(
+            remove=set(['GraphiteHandler']),
+            add=[('diamond.handler.null.NullHandler', {'dispatch': 'thread'}),
+                 ('diamond.handler.null.NullHandler', {'dispatch': 'process'}),
+                 ('diamond.handler.missing.MissingHandler', {})]), log)
+
+        self.assertEqual(len(workers), 2)
+        self.assertTrue(workers[0] is kept)
+        self.assertFalse(removed.thread.is_alive())
+        self.assertEqual(removed.handler.events, ['flush'])
+
+        # Added handlers are started, process dispatch needs a restart
+        self.assertTrue(isinstance(workers[1], ThreadHandlerWorker))
+        self.assertEqual(workers[1].name, 'NullHandler')
+        self.assertTrue(workers[1].thread.is_alive())
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
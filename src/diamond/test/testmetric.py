@@ -93,6 +93,34 @@ class TestMetric(unittest.TestCase):
         message = 'Actual %s, expected %s' % (actual_value, expected_value)
         self.assertEqual(actual_value, expected_value, message)
 
+    def test_path_components(self):
+        metric = Metric('servers.com.example.www.cpu.total.idle', 0,
+                        host='com.example.www', path_prefix='servers',
+                        collector_path='cpu', metric_path='total.idle')
+        self.assertEqual(metric.getPathPrefix(), 'servers')
+        self.assertEqual(metric.getCollectorPath(), 'cpu')
+        self.assertEqual(metric.getMetricPath(), 'total.idle')
+
+        # Components are used as given rather than parsed out of the path
+        metric.path = 'other.path'
+        self.assertEqual(metric.getCollectorPath(), 'cpu')
+
+    def test_path_components_parse(self):
+        metric = Metric.parse('servers.host.cpu.total.idle 1 1400000000')
+        self.assertEqual(metric.path_prefix, None)
+        self.assertEqual(metric.getPathPrefix(), 'servers')
+        self.assertEqual(metric.getCollectorPath(), 'cpu')
+        self.assertEqual(metric.getMetricPath(), 'total.idle')
+
+    def test_setstate_without_components(self):
+        metric = Metric.__new__(Metric)
+        metric.__setstate__({'path': 'servers.host.cpu.total', 'value': 1,
+                             'raw_value': None, 'timestamp': 0,
+                             'precision': 0, 'host': 'host',
+                             'metric_type': 'GAUGE', 'ttl': None})
+        self.assertEqual(metric.metric_path, None)
+        self.assertEqual(metric.getMetricPath(), 'total')
+
     def test_issue_723(self):
         metrics = [
             9.97143369909e-05,
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle as pickle
+
+from test import unittest
+
+from diamond.metric import Metric
+from diamond.metric import MetricBatch
+
+
+def get_metrics(count):
+    """
+    Metrics shaped like the output of a collector run
+    """
+    metrics = []
+    for i in range(count):
+        path = 'servers.com.example.www.diskspace.sda%d.byte_%s' % (
+            i / 4, ('used', 'free', 'avail', 'percentfree')[i % 4])
+        metrics.append(Metric(path, i * 1.5, raw_value=i * 1024,
+                              timestamp=1400000000 + i, precision=2,
+                              host='com.example.www', metric_type='GAUGE',
+                              ttl=600.0))
+    return metrics
+
+
+def benchmark(count, rounds=5):
+    """
+    Compare the compact MetricBatch encoding against pickling the metrics one
+    by one through Metric.__getstate__
+    """
+    metrics = get_metrics(count)
+    encoders = {
+        'metric_pickle': lambda: [pickle.dumps(m, pickle.HIGHEST_PROTOCOL)
+                                  for m in metrics],
+        'batch_compact': lambda: [pickle.dumps(MetricBatch(metrics),
+                                               pickle.HIGHEST_PROTOCOL)],
+    }
+
+    results = {}
+    for name, encode in encoders.iteritems():
+        start = time.time()
+        for i in range(rounds):
+            payloads = encode()
+        encode_time = (time.time() - start) / rounds
+
+        start = time.time()
+        for i in range(rounds):
+            for payload in payloads:
+                pickle.loads(payload)
+        decode_time = (time.time() - start) / rounds
+
+        results[name] = {
+            'bytes_per_metric': sum(map(len, payloads)) / float(count),
+            'encode_per_sec': count / max(encode_time, 1e-9),
+            'decode_per_sec': count / max(decode_time, 1e-9),
+        }
+    return results
+
+
+class TestMetricBatch(unittest.TestCase):
+
+    def roundtrip(self, batch):
+        return pickle.loads(pickle.dumps(batch, pickle.HIGHEST_PROTOCOL))
+
+    def assertMetricsEqual(self, actual, expected):
+        self.assertEqual(len(actual), len(expected))
+        for a, e in zip(actual, expected):
+            for slot in Metric.__slots__:
+                self.assertEqual(getattr(a, slot), getattr(e, slot))
+                self.assertEqual(type(getattr(a, slot)),
+                                 type(getattr(e, slot)))
+
+    def test_roundtrip(self):
+        metrics = get_metrics(10) + [
+            Metric('nodots', 1, timestamp=123),
+            Metric('trailing.', 2L ** 70, raw_value='raw', host=None),
+            Metric('servers.host.cpu.total', 3, ttl=None,
+                   metric_type='COUNTER', raw_value=None),
+            Metric('servers.host.cpu.total.idle', 4, host='host',
+                   path_prefix='servers', collector_path='cpu',
+                   metric_path='total.idle'),
+        ]
+        batch = self.roundtrip(MetricBatch(metrics, flush=False))
+
+        self.assertFalse(batch.flush)
+        self.assertMetricsEqual(batch.metrics, metrics)
+
+    def test_roundtrip_empty(self):
+        batch = self.roundtrip(MetricBatch())
+        self.assertTrue(batch.flush)
+        self.assertEqual(batch.metrics, [])
+
+    def test_roundtrip_fallback(self):
+        metrics = [Metric('servers.host.cpu\ntotal', 1)]
+        batch = self.roundtrip(MetricBatch(metrics))
+        self.assertMetricsEqual(batch.metrics, metrics)
+
+        # A metric path that is not the end of the path
+        metrics = [Metric('servers.host.cpu.total', 1, metric_path='idle')]
+        batch = self.roundtrip(MetricBatch(metrics))
+        self.assertMetricsEqual(batch.metrics, metrics)
+
+    def test_benchmark(self):
+        results = benchmark(1000, rounds=1)
+        self.assertTrue(results['batch_compact']['bytes_per_metric'] <
+                        results['metric_pickle']['bytes_per_metric'])
+
+##########################################################################
+if __name__ == "__main__":
+    for name, result in sorted(benchmark(10000).iteritems()):
+        print '%-15s %6.1f bytes/metric %10d encode/s %10d decode/s' % (
+            name, result['bytes_per_metric'], result['encode_per_sec'],
+            result['decode_per_sec'])
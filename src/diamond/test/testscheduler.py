@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import logging
+import threading
+import time
+
+from test import unittest
+
+from diamond.utils.scheduler import CollectorScheduler
+
+
+class FakeCollector(object):
+
+    def __init__(self, name, interval, hang=None):
+        self.name = name
+        self.config = {'interval': interval}
+        self.hang = hang
+        self.deadline = None
+        self.runs = 0
+
+    def load_config(self):
+        pass
+
+    def _run(self):
+        self.runs += 1
+        if self.hang is not None:
+            self.hang.wait()
+
+
+class TestCollectorScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger('diamond')
+
+    def run_scheduler(self, scheduler, duration):
+        thread = threading.Thread(target=scheduler.run)
+        thread.daemon = True
+        thread.start()
+        time.sleep(duration)
+        scheduler.stop()
+        thread.join()
+
+    def test_sub_second_intervals(self):
+        fast = FakeCollector('Fast', 0.1)
+        slow = FakeCollector('Slow', 10)
+        scheduler = CollectorScheduler([fast, slow], 2, self.log)
+
+        self.run_scheduler(scheduler, 1.05)
+        self.assertTrue(8 <= fast.runs <= 12, fast.runs)
+        self.assertTrue(slow.runs <= 1, slow.runs)
+
+    def test_invalid_interval(self):
+        scheduler = CollectorScheduler([FakeCollector('Bad', 0)], 1,
+                                       self.log)
+        self.assertEqual(scheduler.entries, [])
+
+    def test_hung_collector_is_replaced(self):
+        hang = threading.Event()
+        stuck = FakeCollector('Stuck', 0.2, hang=hang)
+        other = FakeCollector('Other', 0.1)
+        scheduler = CollectorScheduler([stuck, other], 1, self.log)
+
+        try:
+            self.run_scheduler(scheduler, 1.5)
+            stats = scheduler.stats()
+
+            # The stuck collector ran once, its later runs were skipped and
+            # the other collector kept running on a replacement worker
+            self.assertEqual(stuck.runs, 1)
+            self.assertEqual(stats['Stuck']['timeouts'], 1)
+            self.assertTrue(stats['Stuck']['skipped'] > 0)
+            self.assertTrue(other.runs >= 8, other.runs)
+            self.assertEqual(len(scheduler.workers), 1)
+        finally:
+            hang.set()
+
+        # Once done the stuck collector is scheduled again
+        scheduler.stopped = False
+        self.run_scheduler(scheduler, 0.5)
+        self.assertTrue(stuck.runs > 1)
+
+    def test_tick(self):
+        collector = FakeCollector('Tick', 1)
+        scheduler = CollectorScheduler([collector], 1, self.log)
+        entry = scheduler.entries[0]
+        next_run = entry.next_run()
+
+        # Nothing due yet
+        self.assertTrue(scheduler.tick(next_run - 0.5) <= next_run)
+        self.assertTrue(scheduler.jobs.empty())
+
+        scheduler.tick(next_run)
+        self.assertEqual(scheduler.jobs.get_nowait(), entry)
+        self.assertEqual(entry.next_run(), next_run + 1)
+
+        # Still running when due again, then the clock jumps ahead
+        scheduler.tick(next_run + 1)
+        self.assertEqual(entry.skipped, 1)
+        scheduler.running.clear()
+        scheduler.tick(next_run + 5.5)
+        self.assertEqual(entry.skipped, 4)
+        self.assertTrue(entry.next_run() > next_run + 5.5)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import Queue
+import signal
+
+from test import unittest
+from mock import Mock
+from mock import patch
+import configobj
+
+from diamond.server import Server
+from diamond.utils.config import ConfigDiff
+
+
+def get_config(collectors, graphite_host='a', **server):
+    config = configobj.ConfigObj()
+    config['server'] = {
+        'handlers': ['diamond.handler.graphite.GraphiteHandler',
+                     'diamond.handler.archive.ArchiveHandler'],
+    }
+    config['server'].update(server)
+    config['handlers'] = {
+        'default': {},
+        'GraphiteHandler': {'host': graphite_host},
+        'ArchiveHandler': {},
+    }
+    config['collectors'] = {'default': {}}
+    config['collectors'].update(collectors)
+    return config
+
+
+def get_process(name, pid):
+    process = Mock()
+    process.name = name
+    process.pid = pid
+    process.is_alive.return_value = True
+    return process
+
+
+class TestServerReload(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(configfile='diamond.conf')
+        self.server.metric_queue = Mock()
+        self.control = Queue.Queue()
+        self.server.metric_queue.producer.return_value = self.control
+
+        self.processes = [get_process('CPUCollector', 1),
+                          get_process('MemoryCollector', 2)]
+        self.pool = get_process('CollectorPool-0', 3)
+        self.server.pool_processes = [self.pool]
+        self.server.pool_collectors = set(['DiskSpaceCollector',
+                                           'LoadAverageCollector'])
+
+        self.patchers = [
+            patch('multiprocessing.active_children',
+                  return_value=self.processes + [self.pool]),
+            patch('os.kill'),
+        ]
+        self.kill = self.patchers[1].start()
+        self.patchers[0].start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def reload(self, old, new):
+        self.server.config = new
+        diff = ConfigDiff(old, new)
+        self.server._apply_config_diff(diff)
+        return diff
+
+    def get_collectors(self, memory_interval=10, load_interval=10):
+        return {
+            'CPUCollector': {'enabled': True},
+            'MemoryCollector': {'enabled': True, 'interval': memory_interval},
+            'DiskSpaceCollector': {'enabled': True, 'execution': 'pool'},
+            'LoadAverageCollector': {'enabled': True, 'execution': 'pool',
+                                     'interval': load_interval},
+        }
+
+    def test_only_changed_collectors(self):
+        self.reload(get_config(self.get_collectors()),
+                    get_config(self.get_collectors(memory_interval=60)))
+
+        self.assertFalse(self.processes[0].terminate.called)
+        self.assertTrue(self.processes[1].terminate.called)
+        self.assertFalse(self.kill.called)
+        self.assertTrue(self.control.empty())
+
+    def test_pool_reconfigured(self):
+        self.reload(get_config(self.get_collectors()),
+                    get_config(self.get_collectors(load_interval=60)))
+
+        self.kill.assert_called_once_with(3, signal.SIGHUP)
+        self.assertFalse(self.pool.terminate.called)
+        for process in self.processes:
+            self.assertFalse(process.terminate.called)
+
+    def test_changed_handlers(self):
+        self.reload(get_config(self.get_collectors()),
+                    get_config(self.get_collectors(), graphite_host='b'))
+
+        reload = self.control.get(block=False)
+        self.assertEqual(reload.remove, set(['GraphiteHandler']))
+        self.assertEqual(reload.add, [
+            ('diamond.handler.graphite.GraphiteHandler', {'host': 'b'})])
+        for process in self.processes:
+            self.assertFalse(process.terminate.called)
+
+    def test_unchanged(self):
+        diff = self.reload(get_config(self.get_collectors()),
+                           get_config(self.get_collectors()))
+        self.assertFalse(diff)
+        self.assertFalse(self.kill.called)
+        self.assertTrue(self.control.empty())
+        for process in self.processes:
+            self.assertFalse(process.terminate.called)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
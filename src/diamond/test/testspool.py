@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import os
+import shutil
+import tempfile
+import time
+
+from test import unittest
+from mock import patch
+
+from diamond.utils.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_spool(self, **kwargs):
+        return Spool(os.path.join(self.path, 'spool'), **kwargs)
+
+    def test_append_read_ack(self):
+        spool = self.get_spool()
+        spool.append(['a', 'b', 'c'])
+
+        self.assertEqual(spool.read(2), ['a', 'b'])
+        # Nothing is consumed until acked
+        self.assertEqual(spool.read(2), ['a', 'b'])
+        spool.ack()
+        self.assertEqual(spool.read(2), ['c'])
+        spool.ack()
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.read(2), [])
+
+    def test_segments(self):
+        spool = self.get_spool(segment_size=20)
+        spool.append(['record%d' % i for i in range(10)])
+        self.assertTrue(len(spool) > 1)
+
+        records = []
+        while len(spool):
+            records.extend(spool.read(3))
+            spool.ack()
+        self.assertEqual(records, ['record%d' % i for i in range(10)])
+
+    def test_resume_after_restart(self):
+        spool = self.get_spool()
+        spool.append(['a', 'b', 'c'])
+        spool.read(1)
+        spool.ack()
+        spool.writer.close()
+
+        spool = self.get_spool()
+        spool.append(['d'])
+        self.assertEqual(spool.read(10), ['b', 'c'])
+        spool.ack()
+        self.assertEqual(spool.read(10), ['d'])
+
+    def test_max_size(self):
+        spool = self.get_spool(segment_size=20, max_size=60)
+        spool.append(['record%d' % i for i in range(10)])
+        self.assertTrue(spool.size() <= 60)
+
+        records = []
+        while len(spool):
+            records.extend(spool.read(10))
+            spool.ack()
+        self.assertEqual(records[-1], 'record9')
+        self.assertFalse('record0' in records)
+
+    def test_size_kept_up_to_date(self):
+        spool = self.get_spool(segment_size=20, max_size=1000)
+        with patch('os.path.getsize') as getsize:
+            for i in range(10):
+                spool.append(['record%d' % i])
+        self.assertEqual(getsize.call_count, 0)
+
+        spool.writer.flush()
+        on_disk = sum(os.path.getsize(os.path.join(spool.path, segment))
+                      for segment in spool.segments)
+        self.assertEqual(spool.size(), on_disk)
+
+        spool.read(10)
+        spool.ack()
+        self.assertEqual(spool.size(), on_disk - 4 - len('record0'))
+
+        # Read back from the disk after a restart
+        spool.writer.close()
+        self.assertEqual(self.get_spool().size(), spool.size())
+
+    def test_max_age(self):
+        spool = self.get_spool(segment_size=10, max_age=60)
+        spool.append(['old1', 'old2'])
+        with patch('time.time', return_value=time.time() + 120):
+            spool.append(['new'])
+        self.assertEqual(spool.read(10), ['new'])
+
+    def test_replay_rate(self):
+        spool = self.get_spool(replay_rate=2)
+        spool.append(['a', 'b', 'c', 'd'])
+        sent = []
+
+        def send(records):
+            sent.extend(records)
+            return True
+
+        with patch('time.time', return_value=spool.last_replay + 1):
+            spool.replay(send)
+        self.assertEqual(sent, ['a', 'b'])
+
+        with patch('time.time', return_value=spool.last_replay + 10):
+            spool.replay(send)
+        self.assertEqual(sent, ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(spool), 0)
+
+    def test_replay_failure_keeps_records(self):
+        spool = self.get_spool(replay_rate=10)
+        spool.append(['a', 'b'])
+
+        with patch('time.time', return_value=spool.last_replay + 1):
+            self.assertFalse(spool.replay(lambda records: False))
+        self.assertEqual(spool.read(10), ['a', 'b'])
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import logging
+
+from test import unittest
+import configobj
+
+from diamond.collector import Collector
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+from diamond.utils.dispatch import InlineHandlerWorker
+from diamond.utils.scheduler import publish_handler_telemetry
+from diamond.utils.telemetry import create_telemetry
+from diamond.utils.telemetry import get_rss
+from diamond.utils.telemetry import Histogram
+from diamond.utils.telemetry import Telemetry
+
+
+class ListHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.metrics = []
+        self.flushes = 0
+
+    def process(self, metric):
+        if metric.value < 0:
+            raise ValueError(metric.value)
+        self.metrics.append(metric)
+
+    def flush(self):
+        self.flushes += 1
+
+    def stats(self):
+        return {'bytes_sent': 120, 'bytes_dropped': 0}
+
+
+class FakeTransport(object):
+
+    def stats(self):
+        return {'queue_depth': 7}
+
+
+class SampleCollector(Collector):
+
+    def collect(self):
+        self.publish('a', 1)
+        self.publish_many({'b': 2, 'c': 3})
+
+
+def get_values(metrics):
+    return dict((m.path, m.value) for m in metrics)
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(size=10)
+        for value in range(1, 101):
+            histogram.add(value)
+        summary = histogram.summary()
+
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['min'], 1)
+        self.assertEqual(summary['max'], 100)
+        self.assertEqual(summary['mean'], 50.5)
+        self.assertEqual(len(histogram.samples), 10)
+        self.assertTrue(summary['p50'] <= summary['p90'] <= summary['p99'])
+
+    def test_collect(self):
+        telemetry = Telemetry('Handlers', prefix='diamond', hostname='host',
+                              interval=60)
+        telemetry.record(('collectors', 'CPUCollector', 'run_time_ms'), 10)
+        telemetry.record(('collectors', 'CPUCollector', 'run_time_ms'), 30)
+        telemetry.increment(('collectors', 'CPUCollector', 'killed'))
+        telemetry.gauge(('handlers', 'GraphiteHandler', 'queue_depth'), 4)
+        telemetry.gauge(('transport', 'queued bytes'), 8)
+
+        metrics = telemetry.collect(now=1000)
+        values = get_values(metrics)
+        prefix = 'diamond.host.collectors.CPUCollector.'
+        self.assertEqual(values[prefix + 'run_time_ms.count'], 2)
+        self.assertEqual(values[prefix + 'run_time_ms.mean'], 20)
+        self.assertEqual(values[prefix + 'run_time_ms.max'], 30)
+        self.assertEqual(values[prefix + 'killed'], 1)
+        self.assertEqual(
+            values['diamond.host.handlers.GraphiteHandler.queue_depth'], 4)
+        self.assertEqual(values['diamond.host.transport.queued_bytes'], 8)
+        self.assertTrue(values['diamond.host.processes.Handlers.rss_bytes'] > 0)
+
+        for metric in metrics:
+            self.assertEqual(metric.host, 'host')
+            self.assertEqual(metric.timestamp, 1000)
+            if metric.path.endswith('killed'):
+                self.assertEqual(metric.metric_type, 'COUNTER')
+            else:
+                self.assertEqual(metric.metric_type, 'GAUGE')
+
+        # Histograms and gauges start over, counters keep going
+        self.assertFalse(telemetry.due(1059))
+        self.assertTrue(telemetry.due(1060))
+        telemetry.increment(('collectors', 'CPUCollector', 'killed'))
+        values = get_values(telemetry.collect(now=1060))
+        self.assertEqual(values[prefix + 'killed'], 2)
+        self.assertFalse(prefix + 'run_time_ms.count' in values)
+        self.assertFalse(
+            'diamond.host.handlers.GraphiteHandler.queue_depth' in values)
+
+    def test_get_rss(self):
+        self.assertTrue(get_rss() > 0)
+
+    def test_create_telemetry(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['collectors'] = {'default': {'hostname': 'host'}}
+        self.assertEqual(create_telemetry(config, 'Handlers'), None)
+
+        config['server'].update({
+            'telemetry': 'True',
+            'telemetry_prefix': 'self',
+            'telemetry_interval': '10',
+        })
+        telemetry = create_telemetry(config, 'Handlers')
+        self.assertEqual(telemetry.prefix, 'self.host')
+        self.assertEqual(telemetry.interval, 10)
+
+    def test_collector_run(self):
+        config = configobj.ConfigObj()
+        config['collectors'] = {'default': {'hostname': 'host'}}
+        collector = SampleCollector(config, [])
+        collector.telemetry = Telemetry('SampleCollector')
+        collector._run()
+        collector._run()
+
+        histograms = collector.telemetry.histograms
+        key = ('collectors', 'SampleCollector', 'metrics')
+        self.assertEqual(histograms[key].count, 2)
+        self.assertEqual(histograms[key].summary()['max'], 3)
+        key = ('collectors', 'SampleCollector', 'run_time_ms')
+        self.assertEqual(histograms[key].count, 2)
+
+    def test_handler_process(self):
+        handler = ListHandler(configobj.ConfigObj())
+        worker = InlineHandlerWorker(handler, logging.getLogger('diamond'))
+        telemetry = Telemetry('Handlers', prefix='diamond', hostname='host')
+        worker.telemetry = telemetry
+
+        metrics = [Metric('servers.host.cpu.total', value, timestamp=1)
+                   for value in (1, -1, 2)]
+        worker.put(metrics, True)
+        self.assertEqual(handler.errors, 1)
+
+        histograms = telemetry.histograms
+        self.assertEqual(
+            histograms[('handlers', worker.name, 'process_time_ms')].count, 1)
+        self.assertEqual(
+            histograms[('handlers', worker.name, 'flush_time_ms')].count, 1)
+
+        # Published to the handlers themselves
+        publish_handler_telemetry(telemetry, [worker], FakeTransport())
+        values = get_values(handler.metrics)
+        prefix = 'diamond.host.handlers.ListHandler.'
+        self.assertEqual(values[prefix + 'errors'], 1)
+        self.assertEqual(values[prefix + 'dropped'], 0)
+        self.assertEqual(values[prefix + 'queue_depth'], 0)
+        self.assertEqual(values[prefix + 'process_time_ms.count'], 1)
+        self.assertEqual(values[prefix + 'bytes_sent'], 120)
+        self.assertEqual(values[prefix + 'bytes_dropped'], 0)
+        self.assertEqual(values['diamond.host.transport.queue_depth'], 7)
+        self.assertEqual(handler.flushes, 2)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
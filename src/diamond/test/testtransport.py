@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import multiprocessing
+import Queue
+
+from test import unittest
+
+from diamond.metric import Metric
+from diamond.utils.transport import RingBufferTransport
+
+
+def produce(transport, name, count):
+    queue = transport.producer(name)
+    for i in range(count):
+        queue.put(Metric('servers.host.cpu.%s' % name, i, timestamp=123),
+                  block=False)
+    queue.put(None, block=False)
+
+
+class TestRingBufferTransport(unittest.TestCase):
+
+    def get_transport(self, size=4096, slots=4):
+        return RingBufferTransport({
+            'metric_ring_buffer_size': size,
+            'metric_ring_buffer_slots': slots,
+        })
+
+    def test_put_get(self):
+        transport = self.get_transport()
+        queue = transport.producer('CPUCollector')
+
+        queue.put(Metric('servers.host.cpu.total', 1, timestamp=123))
+        queue.put(None)
+
+        metric = transport.get(block=False)
+        self.assertEqual(metric.path, 'servers.host.cpu.total')
+        self.assertEqual(metric.value, 1)
+        self.assertEqual(transport.get(block=False), None)
+        self.assertRaises(Queue.Empty, transport.get, block=False)
+        self.assertRaises(Queue.Empty, transport.get, timeout=0.01)
+
+    def test_full_drops(self):
+        transport = self.get_transport(size=256)
+        queue = transport.producer('CPUCollector')
+
+        sent = 0
+        try:
+            while True:
+                queue.put(Metric('servers.host.cpu.total', sent))
+                sent += 1
+        except Queue.Full:
+            pass
+
+        self.assertTrue(sent > 0)
+        for i in range(sent):
+            self.assertEqual(transport.get(block=False).value, i)
+        self.assertRaises(Queue.Empty, transport.get, block=False)
+
+    def test_wrap_around(self):
+        transport = self.get_transport(size=300)
+        queue = transport.producer('CPUCollector')
+
+        for i in range(100):
+            queue.put(Metric('servers.host.cpu.total', i))
+            self.assertEqual(transport.get(block=False).value, i)
+
+    def test_producer_slots(self):
+        transport = self.get_transport(slots=2)
+
+        first = transport.producer('CPUCollector')
+        self.assertTrue(first is transport.producer('CPUCollector'))
+        second = transport.producer('MemoryCollector')
+        self.assertFalse(first is second)
+        self.assertRaises(Exception, transport.producer, 'DiskCollector')
+
+        transport.release('CPUCollector')
+        self.assertTrue(first is transport.producer('DiskCollector'))
+
+    def test_released_slot_reused_once_dead(self):
+        transport = self.get_transport(slots=2)
+        first = transport.producer('CPUCollector')
+        second = transport.producer('MemoryCollector')
+
+        # A producer still exiting keeps its ring
+        alive = multiprocessing.Event()
+        process = multiprocessing.Process(target=alive.wait, args=(10,))
+        process.start()
+        transport.release('CPUCollector', process)
+        self.assertRaises(Exception, transport.producer, 'DiskCollector')
+
+        alive.set()
+        process.join(5)
+        self.assertTrue(first is transport.producer('DiskCollector'))
+
+        # A producer already gone hands its ring over right away
+        transport.release('MemoryCollector', process)
+        self.assertTrue(second is transport.producer('LoadCollector'))
+
+    def test_across_processes(self):
+        transport = self.get_transport(size=65536)
+        transport.producer('CPUCollector')
+        transport.producer('MemoryCollector')
+
+        processes = [
+            multiprocessing.Process(target=produce,
+                                    args=(transport, name, 100))
+            for name in ('CPUCollector', 'MemoryCollector')]
+        for process in processes:
+            process.start()
+
+        received = {}
+        flushes = 0
+        while flushes < 2:
+            metric = transport.get(block=True, timeout=10)
+            if metric is None:
+                flushes += 1
+            else:
+                received.setdefault(metric.path, []).append(metric.value)
+
+        for process in processes:
+            process.join()
+
+        self.assertEqual(received, {
+            'servers.host.cpu.CPUCollector': range(100),
+            'servers.host.cpu.MemoryCollector': range(100),
+        })
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
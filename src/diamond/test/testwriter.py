@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import socket
+import threading
+import time
+
+from test import unittest
+
+from diamond.utils.writer import BackgroundWriter
+
+
+class Sink(object):
+    """
+    A TCP server keeping what it receives, reading only once started
+    """
+
+    def __init__(self, port=0):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', port))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.data = []
+        self.reading = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                conn = self.server.accept()[0]
+                self.reading.wait()
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    self.data.append(data)
+                conn.close()
+        except socket.error:
+            pass
+
+    def received(self):
+        return ''.join(self.data)
+
+    def close(self):
+        self.reading.set()
+        # Wake up the accept, a plain close leaves the port listening
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
+        self.thread.join(5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = Sink()
+        self.sink.reading.set()
+        self.writers = []
+
+    def tearDown(self):
+        for writer in self.writers:
+            writer.stop()
+        self.sink.close()
+
+    def get_writer(self, port=None, start=True, **kwargs):
+        if port is None:
+            port = self.sink.port
+
+        def connect():
+            return socket.create_connection(('127.0.0.1', port), 1)
+
+        writer = BackgroundWriter(connect, **kwargs)
+        if start:
+            writer.start()
+        self.writers.append(writer)
+        return writer
+
+    def test_write(self):
+        writer = self.get_writer()
+        lines = ['servers.host.cpu.total %d 1\n' % i for i in range(1000)]
+        for line in lines:
+            self.assertEqual(writer.write(line), [])
+
+        self.assertTrue(wait_for(
+            lambda: self.sink.received() == ''.join(lines)))
+        stats = writer.stats()
+        self.assertEqual(stats['bytes_queued'], 0)
+        self.assertEqual(stats['bytes_sent'], len(''.join(lines)))
+        self.assertEqual(stats['bytes_dropped'], 0)
+        self.assertTrue(stats['flush_latency'] < 5)
+
+    def test_started_by_first_write(self):
+        writer = self.get_writer(start=False)
+        self.assertEqual(writer.thread, None)
+
+        writer.write('servers.host.cpu.total 1 1\n')
+        self.assertTrue(writer.thread.is_alive())
+        self.assertTrue(wait_for(
+            lambda: self.sink.received() == 'servers.host.cpu.total 1 1\n'))
+
+    def test_slow_reader_never_blocks(self):
+        self.sink.reading.clear()
+        writer = self.get_writer(max_buffer=1024 * 1024)
+        data = 'x' * 65535 + '\n'
+
+        start = time.time()
+        dropped = []
+        for i in range(512):
+            dropped.extend(writer.write(data))
+        self.assertTrue(time.time() - start < 1)
+
+        # The socket buffers filled up, the writer buffer kept the newest
+        self.assertTrue(dropped)
+        self.assertTrue(all(chunk == data for chunk in dropped))
+        stats = writer.stats()
+        self.assertTrue(stats['bytes_queued'] <= 1024 * 1024)
+        self.assertEqual(stats['bytes_dropped'], len(data) * len(dropped))
+
+        # Everything kept is sent in whole lines once the reader catches up
+        self.sink.reading.set()
+        self.assertTrue(wait_for(lambda: writer.stats()['bytes_queued'] == 0))
+        sent = writer.stats()['bytes_sent']
+        self.assertTrue(wait_for(lambda: len(self.sink.received()) == sent))
+        self.assertEqual(self.sink.received().count('\n'),
+                         512 - len(dropped))
+
+    def test_reconnect(self):
+        self.sink.close()
+        writer = self.get_writer(port=self.sink.port, backoff=0.05)
+        writer.write('early\n')
+
+        # Refused until the sink is back, with a growing backoff
+        self.assertTrue(wait_for(lambda: writer.retry_backoff > 0.1))
+        self.assertFalse(writer.connected)
+
+        self.sink = Sink(self.sink.port)
+        self.sink.reading.set()
+        self.assertTrue(wait_for(lambda: self.sink.received() == 'early\n'))
+        self.assertTrue(writer.connected)
+        self.assertEqual(writer.retry_backoff, 0.05)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
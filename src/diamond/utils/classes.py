@@ -1,15 +1,17 @@
 # coding=utf-8
 
-import configobj
 import os
+import re
 import sys
 import logging
 import inspect
 import traceback
 import pkg_resources
 import imp
+import json
 
 from diamond.util import load_class_from_name
+from diamond.utils.config import get_handler_config
 from diamond.collector import Collector
 from diamond.handler.Handler import Handler
 
@@ -68,23 +70,8 @@ def load_handlers(config, handler_names):
             cls = load_dynamic_class(handler, Handler)
             cls_name = cls.__name__
 
-            # Initialize Handler config
-            handler_config = configobj.ConfigObj()
-            # Merge default Handler default config
-            handler_config.merge(config['handlers']['default'])
-            # Check if Handler config exists
-            if cls_name in config['handlers']:
-                # Merge Handler config section
-                handler_config.merge(config['handlers'][cls_name])
-
-            # Check for config file in config directory
-            if 'handlers_config_path' in config['server']:
-                configfile = os.path.join(
-                    config['server']['handlers_config_path'],
-                    cls_name) + '.conf'
-                if os.path.exists(configfile):
-                    # Merge Collector config file
-                    handler_config.merge(configobj.ConfigObj(configfile))
+            # Handler defaults, section and config file
+            handler_config = get_handler_config(config, cls_name)
 
             # Initialize Handler class
             h = cls(handler_config)
@@ -181,6 +168,202 @@ def load_collectors_from_paths(paths):
     return collectors
 
 
+# Top level class statements, found without importing the module
+CLASS_DEFINITION = re.compile(r'^class\s+(\w+)\s*[(:]', re.MULTILINE)
+
+
+def is_collector_module(f):
+    """
+    Whether the file name f is a collector module load_collectors_from_paths
+    would import
+    """
+    return (len(f) > 3 and
+            f[-3:] == '.py' and
+            f[0:4] != 'test' and
+            f[0] != '.')
+
+
+class CollectorLoader(object):
+    """
+    Import collector modules on demand.
+
+    The collector paths are indexed by the classes each module defines, read
+    from the sources without importing them, so only the modules of the
+    collectors asked for are imported. The index is kept in index_path if
+    given and a module is read again only when its mtime changed. Modules
+    that changed since they were imported are imported again.
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, paths, index_path=None):
+        if isinstance(paths, basestring):
+            paths = map(str.strip, paths.split(','))
+        self.paths = paths
+        self.index_path = index_path
+
+        # module file -> {'mtime': mtime, 'classes': [class names]}
+        self.index = {}
+        # class name -> module file
+        self.modules = {}
+        # module file -> (mtime when imported, {class name: class})
+        self.loaded = {}
+        self.entry_points = None
+        self.scanned = False
+
+        self._read_index()
+        self.refresh()
+
+    def _read_index(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            logger.warning('Failed to read the collector index %s',
+                           self.index_path, exc_info=True)
+            return
+        if index.get('version') == self.INDEX_VERSION:
+            self.index = index['modules']
+
+    def _write_index(self):
+        if not self.index_path:
+            return
+        tmp_path = '%s.%d' % (self.index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': self.INDEX_VERSION,
+                           'modules': self.index}, f)
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError):
+            logger.warning('Failed to write the collector index %s',
+                           self.index_path, exc_info=True)
+
+    def _find_modules(self, path, files):
+        if not os.path.exists(path):
+            raise OSError("Directory does not exist: %s" % path)
+        if path.endswith('tests') or path.endswith('fixtures'):
+            return
+        for f in os.listdir(path):
+            fpath = os.path.join(path, f)
+            if os.path.isdir(fpath):
+                self._find_modules(fpath, files)
+            elif is_collector_module(f) and os.path.isfile(fpath):
+                files.append(fpath)
+
+    def refresh(self):
+        """
+        Index the modules added or changed since the last refresh
+        """
+        load_include_path(self.paths)
+
+        files = []
+        for path in self.paths:
+            self._find_modules(path, files)
+
+        index = {}
+        changed = len(files) != len(self.index)
+        for fpath in files:
+            try:
+                mtime = os.path.getmtime(fpath)
+            except OSError:
+                continue
+            entry = self.index.get(fpath)
+            if entry is None or entry['mtime'] != mtime:
+                changed = True
+                try:
+                    with open(fpath) as f:
+                        classes = CLASS_DEFINITION.findall(f.read())
+                except IOError:
+                    continue
+                entry = {'mtime': mtime, 'classes': classes}
+            index[fpath] = entry
+
+        self.index = index
+        self.modules = {}
+        for fpath, entry in sorted(index.iteritems()):
+            for name in entry['classes']:
+                self.modules.setdefault(name, fpath)
+        self.entry_points = None
+        self.scanned = False
+
+        if changed:
+            self._write_index()
+
+    def _import(self, fpath):
+        """
+        Import the module in fpath unless imported since it last changed.
+
+        :returns: the collector classes of the module
+        """
+        mtime = self.index[fpath]['mtime']
+        if fpath in self.loaded and self.loaded[fpath][0] == mtime:
+            return self.loaded[fpath][1]
+
+        path, f = os.path.split(fpath)
+        modname = f[:-3]
+        fp, pathname, description = imp.find_module(modname, [path])
+        classes = {}
+        try:
+            mod = imp.load_module(modname, fp, pathname, description)
+        except (KeyboardInterrupt, SystemExit), err:
+            logger.error(
+                "System or keyboard interrupt "
+                "while loading module %s"
+                % modname)
+            if isinstance(err, SystemExit):
+                sys.exit(err.code)
+            raise KeyboardInterrupt
+        except Exception:
+            logger.error("Failed to import module: %s. %s",
+                         modname,
+                         traceback.format_exc())
+        else:
+            classes = dict(get_collectors_from_module(mod))
+        finally:
+            if fp:
+                fp.close()
+
+        self.loaded[fpath] = (mtime, classes)
+        return classes
+
+    def load(self, names):
+        """
+        Return the collector classes called names that could be loaded, by
+        class name
+        """
+        if self.entry_points is None:
+            self.entry_points = load_collectors_from_entry_point(
+                'diamond.collectors')
+
+        collectors = {}
+        missing = []
+        for name in names:
+            fpath = self.modules.get(name)
+            if fpath is not None:
+                cls = self._import(fpath).get(name)
+                if cls is not None:
+                    collectors[name] = cls
+                    continue
+            if name in self.entry_points:
+                collectors[name] = self.entry_points[name]
+                continue
+            missing.append(name)
+
+        if missing and not self.scanned:
+            # Defined in a way the index does not see, import everything
+            logger.debug('Collectors %s not indexed, loading all modules',
+                         ', '.join(missing))
+            self.scanned = True
+            for fpath in sorted(self.index):
+                for name, cls in self._import(fpath).iteritems():
+                    self.modules[name] = fpath
+                    if name in missing:
+                        collectors[name] = cls
+        return collectors
+
+
 def load_collectors_from_entry_point(path):
     """
     Load collectors that were installed into an entry_point.
@@ -228,7 +411,7 @@ def get_collectors_from_module(mod):
 
 def initialize_collector(cls, name=None, configfile=None, handlers=[]):
     """
-    Initialize collector
+    Initialize collector, configfile may be a path or a ConfigSnapshot
     """
     collector = None
 
@@ -21,12 +21,17 @@ def str_to_bool(value):
     return value
 
 
-def load_config(configfile):
+def load_config(configfile, files=None):
     """
     Load the full config / merge splitted configs if configured
+
+    :param files: if given, a list the files and directories read are added to
     """
+    if files is None:
+        files = []
 
     configfile = os.path.abspath(configfile)
+    files.append(configfile)
     config = configobj.ConfigObj(configfile)
 
     config_extension = '.conf'
@@ -40,12 +45,14 @@ def load_config(configfile):
 
         # Load other configs
         if 'path' in config['configs']:
+            files.append(os.path.abspath(config['configs']['path']))
             for cfgfile in os.listdir(config['configs']['path']):
                 cfgfile = os.path.join(config['configs']['path'],
                                        cfgfile)
                 cfgfile = os.path.abspath(cfgfile)
                 if not cfgfile.endswith(config_extension):
                     continue
+                files.append(cfgfile)
                 newconfig = configobj.ConfigObj(cfgfile)
                 config.merge(newconfig)
 
@@ -63,12 +70,14 @@ def load_config(configfile):
 
     if 'handlers_config_path' in config['server']:
         handlers_config_path = config['server']['handlers_config_path']
+        files.append(os.path.abspath(handlers_config_path))
         if os.path.exists(handlers_config_path):
             for cfgfile in os.listdir(handlers_config_path):
                 cfgfile = os.path.join(handlers_config_path, cfgfile)
                 cfgfile = os.path.abspath(cfgfile)
                 if not cfgfile.endswith(config_extension):
                     continue
+                files.append(cfgfile)
                 filename = os.path.basename(cfgfile)
                 handler = os.path.splitext(filename)[0]
 
@@ -87,12 +96,14 @@ def load_config(configfile):
 
     if 'collectors_config_path' in config['server']:
         collectors_config_path = config['server']['collectors_config_path']
+        files.append(os.path.abspath(collectors_config_path))
         if os.path.exists(collectors_config_path):
             for cfgfile in os.listdir(collectors_config_path):
                 cfgfile = os.path.join(collectors_config_path, cfgfile)
                 cfgfile = os.path.abspath(cfgfile)
                 if not cfgfile.endswith(config_extension):
                     continue
+                files.append(cfgfile)
                 filename = os.path.basename(cfgfile)
                 collector = os.path.splitext(filename)[0]
 
@@ -117,3 +128,172 @@ def load_config(configfile):
     #########################################################################
 
     return config
+
+
+class ConfigSnapshot(object):
+    """
+    The config load_config reads from configfile, parsed once and shared by
+    the server and all its collectors.
+
+    The files and directories it was read from are remembered along with
+    their mtime and size, and load only parses the config again once one of
+    them changed, was added or went away. Every parse bumps the version.
+    """
+
+    def __init__(self, configfile):
+        self.configfile = os.path.abspath(configfile)
+        self.config = None
+        self.version = 0
+        self.signature = None
+        self.refresh()
+
+    def _signature(self, files):
+        signature = []
+        for path in files:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return signature
+
+    def changed(self):
+        """
+        Whether a file the config was read from changed since
+        """
+        return self.signature is None or self.signature != self._signature(
+            [entry[0] for entry in self.signature])
+
+    def refresh(self):
+        """
+        Parse the config again if it changed.
+
+        :returns: whether it was parsed again
+        """
+        if not self.changed():
+            return False
+        files = []
+        config = load_config(self.configfile, files)
+        self.config = config
+        self.signature = self._signature(files)
+        self.version += 1
+        return True
+
+    def load(self):
+        """
+        Return the current config
+        """
+        self.refresh()
+        return self.config
+
+
+def get_collector_config(config, name):
+    """
+    The config of the collector section name merged over the collector
+    defaults, as a plain dict
+    """
+    collector_config = configobj.ConfigObj()
+    collectors = config.get('collectors', {})
+    if 'default' in collectors:
+        collector_config.merge(collectors['default'])
+    if name in collectors:
+        collector_config.merge(collectors[name])
+    return collector_config.dict()
+
+
+def get_enabled_collectors(config):
+    """
+    Names of the collector sections that are enabled
+    """
+    return set(name for name, section in config.get('collectors', {}).items()
+               if section.get('enabled', False) is True)
+
+
+def get_handler_config(config, name):
+    """
+    The config of the handler class name: the handler defaults, its section
+    and its file in handlers_config_path
+    """
+    handler_config = configobj.ConfigObj()
+    handler_config.merge(config['handlers'].get('default', {}))
+    if name in config['handlers']:
+        handler_config.merge(config['handlers'][name])
+
+    if 'handlers_config_path' in config['server']:
+        configfile = os.path.join(
+            config['server']['handlers_config_path'], name) + '.conf'
+        if os.path.exists(configfile):
+            handler_config.merge(configobj.ConfigObj(configfile))
+    return handler_config
+
+
+def get_handler_names(config):
+    """
+    The fully qualified class names of the handlers the server runs
+    """
+    handlers = config['server'].get('handlers', [])
+    if isinstance(handlers, basestring):
+        handlers = [handlers]
+    return [handler for handler in handlers
+            if handler != 'diamond.handler.queue.QueueHandler']
+
+
+class ConfigDiff(object):
+    """
+    What changed between two configs, collector by collector and handler by
+    handler
+    """
+
+    def __init__(self, old, new):
+        old_enabled = get_enabled_collectors(old)
+        new_enabled = get_enabled_collectors(new)
+        self.collectors_added = new_enabled - old_enabled
+        self.collectors_removed = old_enabled - new_enabled
+        self.collectors_changed = set(
+            name for name in old_enabled & new_enabled
+            if get_collector_config(old, name) !=
+            get_collector_config(new, name))
+
+        old_handlers = self.get_handlers(old)
+        new_handlers = self.get_handlers(new)
+        self.handlers_added = set(new_handlers) - set(old_handlers)
+        self.handlers_removed = set(old_handlers) - set(new_handlers)
+        self.handlers_changed = set(
+            name for name in set(old_handlers) & set(new_handlers)
+            if old_handlers[name] != new_handlers[name])
+        self.handlers = new_handlers
+
+        old_server = old.get('server', {})
+        new_server = new.get('server', {})
+        self.server_changed = set(
+            key for key in set(old_server) | set(new_server)
+            if old_server.get(key) != new_server.get(key))
+
+    @staticmethod
+    def get_handlers(config):
+        """
+        Handler configs by fully qualified class name
+        """
+        return dict((name, get_handler_config(config,
+                                              name.split('.')[-1]).dict())
+                    for name in get_handler_names(config))
+
+    def __nonzero__(self):
+        return any((self.collectors_added, self.collectors_removed,
+                    self.collectors_changed, self.handlers_added,
+                    self.handlers_removed, self.handlers_changed,
+                    self.server_changed))
+
+    def __str__(self):
+        parts = []
+        for label, names in (
+                ('collectors added', self.collectors_added),
+                ('collectors removed', self.collectors_removed),
+                ('collectors changed', self.collectors_changed),
+                ('handlers added', self.handlers_added),
+                ('handlers removed', self.handlers_removed),
+                ('handlers changed', self.handlers_changed),
+                ('server options changed', self.server_changed)):
+            if names:
+                parts.append('%s: %s' % (label, ', '.join(sorted(names))))
+        return '; '.join(parts) or 'nothing changed'
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+"""
+The last values of the counters of a collector, used to compute derivatives.
+
+Series come and go on container hosts (containers, cgroups, veth interfaces,
+process groups), so the values of series no longer published are dropped
+after ttl runs of the collector, and the least recently seen series are
+dropped when there are more than max_size of them.
+"""
+
+
+class CounterStore(object):
+    """
+    A mapping of metric paths to their last value, with the run of the
+    collector that last updated them. Paths are interned so that the keys of
+    all the collectors of a process share their strings.
+    """
+
+    def __init__(self, ttl=10, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # (value, run) per path
+        self.values = {}
+        self.run = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __contains__(self, path):
+        return path in self.values
+
+    def __getitem__(self, path):
+        return self.values[path][0]
+
+    def __setitem__(self, path, value):
+        if type(path) is str:
+            path = intern(path)
+        self.values[path] = (value, self.run)
+
+    def __delitem__(self, path):
+        del self.values[path]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def get(self, path, default=None):
+        entry = self.values.get(path)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def keys(self):
+        return self.values.keys()
+
+    def clear(self):
+        self.values.clear()
+
+    def expire(self):
+        """
+        End a run of the collector: drop the series not updated for ttl runs,
+        then the least recently updated ones above max_size. Returns how many
+        series were dropped.
+        """
+        dropped = 0
+        if self.ttl:
+            oldest = self.run - self.ttl
+            expired = [path for path, (value, run) in self.values.iteritems()
+                       if run <= oldest]
+            for path in expired:
+                del self.values[path]
+            self.expired += len(expired)
+            dropped += len(expired)
+
+        if self.max_size and len(self.values) > self.max_size:
+            excess = len(self.values) - self.max_size
+            paths = sorted(self.values,
+                           key=lambda path: self.values[path][1])[:excess]
+            for path in paths:
+                del self.values[path]
+            self.evicted += excess
+            dropped += excess
+
+        self.run += 1
+        return dropped
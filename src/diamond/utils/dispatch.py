@@ -0,0 +1,350 @@
+# coding=utf-8
+
+"""
+Handler workers decouple the handlers from each other inside the handler
+process. Depending on the `dispatch` option of a handler its metrics are
+processed inline by the handler process, by a dedicated thread or by a
+dedicated process, each with its own bounded queue.
+"""
+
+import collections
+import multiprocessing
+import Queue
+import threading
+import time
+
+try:
+    from setproctitle import getproctitle, setproctitle
+except ImportError:
+    setproctitle = None
+
+from diamond.handler.Handler import Handler
+from diamond.metric import MetricBatch
+from diamond.utils.classes import load_dynamic_class
+
+OVERFLOW_POLICIES = ('drop_new', 'drop_old', 'block')
+
+
+class HandlerWorker(object):
+    """
+    Feed a handler the metrics of the handler process
+    """
+
+    def __init__(self, handler, log):
+        self.handler = handler
+        self.log = log
+        self.name = handler.__class__.__name__
+
+        self.queue_size = int(handler.config.get('dispatch_queue_size', 1024))
+        self.overflow = handler.config.get('dispatch_overflow', 'drop_new')
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError('%s: unknown dispatch_overflow %s' % (
+                self.name, self.overflow))
+
+        # Metrics dropped because the queue was full
+        self.dropped = 0
+
+        # Self telemetry of the handler process, if enabled
+        self.telemetry = None
+
+    def start(self):
+        """
+        Called once from the handler process before any metric is dispatched
+        """
+        pass
+
+    def stop(self):
+        """
+        Stop feeding the handler and close it, called when a config reload
+        removed or replaced it
+        """
+        self.handler.close()
+
+    def depth(self):
+        """
+        Number of batches waiting to be processed
+        """
+        return 0
+
+    def deadline(self):
+        """
+        When the handler process timer should call tick next, None if never.
+        Workers with a loop of their own run the handler timer themselves.
+        """
+        return None
+
+    def tick(self, now):
+        pass
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth(),
+            'dropped': self.dropped,
+            'errors': self.handler.errors,
+        }
+
+    def handler_stats(self):
+        """
+        The stats the handler keeps itself, see Handler.stats
+        """
+        return self.handler.stats()
+
+    def put(self, metrics, flush):
+        """
+        Queue a list of metrics, followed by a flush of the handler if flush
+        is set
+        """
+        raise NotImplementedError
+
+    def _dispatch(self, metrics, flush):
+        telemetry = self.telemetry
+        if metrics:
+            start = time.time()
+            self.handler._process_many(metrics)
+            if telemetry is not None:
+                telemetry.record(('handlers', self.name, 'process_time_ms'),
+                                 (time.time() - start) * 1000)
+        if flush:
+            start = time.time()
+            self.handler._flush()
+            if telemetry is not None:
+                telemetry.record(('handlers', self.name, 'flush_time_ms'),
+                                 (time.time() - start) * 1000)
+
+    def _drop(self, metrics):
+        self.dropped += len(metrics)
+        self.handler._throttle_error(
+            '%s: dispatch queue full, dropping metrics', self.name)
+
+
+class InlineHandlerWorker(HandlerWorker):
+    """
+    Process the metrics right away in the handler process loop
+    """
+
+    def put(self, metrics, flush):
+        self._dispatch(metrics, flush)
+
+    def deadline(self):
+        return self.handler.batch_deadline()
+
+    def tick(self, now):
+        self.handler._tick(now)
+
+
+class ThreadHandlerWorker(HandlerWorker):
+    """
+    Process the metrics in a thread of the handler process
+    """
+
+    def __init__(self, handler, log):
+        HandlerWorker.__init__(self, handler, log)
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        self.thread = threading.Thread(name=self.name, target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        # What is queued is processed first
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        HandlerWorker.stop(self)
+
+    def depth(self):
+        return len(self.queue)
+
+    def put(self, metrics, flush):
+        with self.condition:
+            while len(self.queue) >= self.queue_size:
+                if self.overflow == 'block':
+                    self.condition.wait()
+                elif self.overflow == 'drop_old':
+                    old_metrics, old_flush = self.queue.popleft()
+                    self._drop(old_metrics)
+                    # Keep the flush the dropped batch carried
+                    flush = flush or old_flush
+                else:
+                    self._drop(metrics)
+                    if not flush:
+                        return
+                    metrics = []
+                    break
+            self.queue.append((metrics, flush))
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            item = None
+            with self.condition:
+                if self.stopped and not self.queue:
+                    return
+                while not self.queue and not self.stopped:
+                    deadline = self.handler.batch_deadline()
+                    if deadline is None:
+                        self.condition.wait()
+                        continue
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.queue:
+                    item = self.queue.popleft()
+                    self.condition.notify_all()
+            if item is None:
+                self.handler._tick(time.time())
+            else:
+                self._dispatch(*item)
+
+
+class ProcessHandlerWorker(HandlerWorker):
+    """
+    Process the metrics in a process of its own.
+
+    The process is started on creation, which has to happen in the server
+    process as the handler process is daemonic and can not have children.
+
+    The error count of the handler is shared back with the handler process.
+    The processing times and the stats the handler keeps itself stay in the
+    worker process and are not part of the telemetry.
+    """
+
+    def __init__(self, handler, log):
+        HandlerWorker.__init__(self, handler, log)
+        self.errors = multiprocessing.Value('L', 0)
+        self.queue = multiprocessing.Queue(maxsize=self.queue_size)
+        self.process = multiprocessing.Process(
+            name='Handler: %s' % self.name,
+            target=self.run)
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+    def depth(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return 0
+
+    def stats(self):
+        stats = HandlerWorker.stats(self)
+        stats['errors'] = self.errors.value
+        return stats
+
+    def handler_stats(self):
+        return {}
+
+    def put(self, metrics, flush):
+        batch = MetricBatch(metrics, flush=flush)
+        try:
+            self.queue.put(batch, block=self.overflow == 'block')
+            return
+        except Queue.Full:
+            pass
+
+        if self.overflow == 'drop_old':
+            try:
+                old = self.queue.get(block=False)
+                self._drop(old.metrics)
+                batch.flush = batch.flush or old.flush
+                self.queue.put(batch, block=False)
+                return
+            except (Queue.Empty, Queue.Full):
+                pass
+
+        self._drop(metrics)
+
+    def run(self):
+        if setproctitle:
+            setproctitle('%s - %s' % (getproctitle(),
+                                      multiprocessing.current_process().name))
+        while True:
+            deadline = self.handler.batch_deadline()
+            try:
+                if deadline is None:
+                    batch = self.queue.get(block=True)
+                else:
+                    batch = self.queue.get(
+                        block=True, timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
+                self.handler._tick(time.time())
+            else:
+                self._dispatch(batch.metrics, batch.flush)
+            self.errors.value = self.handler.errors
+
+
+HANDLER_WORKERS = {
+    'inline': InlineHandlerWorker,
+    'thread': ThreadHandlerWorker,
+    'process': ProcessHandlerWorker,
+}
+
+
+def create_handler_worker(handler, log):
+    """
+    Wrap a handler into the worker selected by its dispatch option
+    """
+    dispatch = handler.config.get('dispatch', 'inline')
+    if dispatch not in HANDLER_WORKERS:
+        raise ValueError('%s: unknown dispatch %s' % (
+            handler.__class__.__name__, dispatch))
+    return HANDLER_WORKERS[dispatch](handler, log)
+
+
+class ReloadHandlers(object):
+    """
+    Sent by the server to the handler process over the metric transport when
+    a config reload added, removed or changed handlers. The other handlers
+    keep running untouched, with their connections.
+    """
+
+    def __init__(self, remove, add):
+        # Class names of the handlers to stop
+        self.remove = remove
+        # (fully qualified class name, config) of the handlers to create
+        self.add = add
+
+
+def reload_handler_workers(workers, reload, log, telemetry=None):
+    """
+    Apply a ReloadHandlers to the workers of the handler process.
+
+    :returns: the new list of workers
+    """
+    kept = []
+    for worker in workers:
+        if worker.name not in reload.remove:
+            kept.append(worker)
+            continue
+        log.info('Stopping handler %s', worker.name)
+        try:
+            worker.stop()
+        except Exception:
+            log.exception('Failed to stop handler %s', worker.name)
+
+    for fqn, config in reload.add:
+        if config.get('dispatch', 'inline') == 'process':
+            log.error('Handler %s: can not start a process dispatched '
+                      'handler on reload, restart diamond', fqn)
+            continue
+        log.info('Starting handler %s', fqn)
+        try:
+            cls = load_dynamic_class(fqn, Handler)
+            worker = create_handler_worker(cls(config), log)
+        except Exception:
+            log.exception('Failed to start handler %s', fqn)
+            continue
+        worker.telemetry = telemetry
+        worker.start()
+        kept.append(worker)
+    return kept
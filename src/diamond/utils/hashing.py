@@ -0,0 +1,71 @@
+# coding=utf-8
+
+"""
+The consistent hash ring carbon-relay uses to pick destinations for a metric,
+so diamond can shard metrics over carbon caches the same way a relay would.
+"""
+
+import bisect
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+
+class ConsistentHashRing(object):
+    """
+    Nodes are placed on a ring of 2^16 positions replica_count times each,
+    a key belongs to the first node found clockwise from its own position
+    """
+
+    def __init__(self, nodes=None, replica_count=100):
+        self.ring = []
+        self.positions = set()
+        self.nodes = []
+        self.replica_count = replica_count
+        for node in nodes or []:
+            self.add_node(node)
+
+    def compute_ring_position(self, key):
+        return int(md5(key).hexdigest()[:4], 16)
+
+    def add_node(self, node):
+        """
+        Add a node, a (server, instance) tuple for carbon compatibility
+        """
+        self.nodes.append(node)
+        for i in range(self.replica_count):
+            position = self.compute_ring_position('%s:%d' % (node, i))
+            while position in self.positions:
+                position += 1
+            self.positions.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def remove_node(self, node):
+        self.nodes.remove(node)
+        self.ring = [entry for entry in self.ring if entry[1] != node]
+        self.positions = set(entry[0] for entry in self.ring)
+
+    def get_node(self, key):
+        for node in self.get_nodes(key):
+            return node
+        return None
+
+    def get_nodes(self, key):
+        """
+        Yield the distinct nodes clockwise from the position of key, the
+        first one owns the key and the next ones take over when it is down
+        """
+        if not self.ring:
+            return
+        seen = set()
+        index = bisect.bisect_left(self.ring,
+                                   (self.compute_ring_position(key), None))
+        for i in xrange(len(self.ring)):
+            node = self.ring[(index + i) % len(self.ring)][1]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
@@ -0,0 +1,85 @@
+# coding=utf-8
+
+"""
+HTTP helpers for the handlers posting metrics: a connection kept alive across
+requests and request body compression.
+"""
+
+import httplib
+import socket
+import urlparse
+import zlib
+
+
+def compress(data, encoding):
+    """
+    Compress data for a Content-Encoding of gzip or deflate, any other
+    encoding leaves it as is
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'deflate':
+        return zlib.compress(data)
+    return data
+
+
+class KeepAliveConnection(object):
+    """
+    An HTTP or HTTPS connection to the server of url, kept open across
+    requests and opened again when the server closed it
+    """
+
+    def __init__(self, url, timeout=10):
+        parsed = urlparse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = parsed.path or '/'
+        self.query = parsed.query
+        self.timeout = timeout
+        self.connection = None
+        self.connections = 0
+
+    def _connect(self):
+        if self.scheme == 'https':
+            cls = httplib.HTTPSConnection
+        else:
+            cls = httplib.HTTPConnection
+        self.connection = cls(self.netloc, timeout=self.timeout)
+        self.connections += 1
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+
+    def request(self, method, body=None, headers={}, query=None):
+        """
+        Send a request to the path of the url, with query added to the query
+        string of the url.
+
+        :returns: the status and the body of the response
+        """
+        url = self.path
+        query = '&'.join(part for part in (self.query, query) if part)
+        if query:
+            url += '?' + query
+
+        while True:
+            # A request failing on a connection kept from earlier requests is
+            # tried again once, the server may have closed it meanwhile
+            reused = self.connection is not None
+            if not reused:
+                self._connect()
+            try:
+                self.connection.request(method, url, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, data
@@ -1,24 +1,53 @@
 # coding=utf-8
 
 import time
+import heapq
 import math
 import multiprocessing
 import os
+import Queue
 import random
 import sys
 import signal
+import threading
 
 try:
     from setproctitle import getproctitle, setproctitle
 except ImportError:
     setproctitle = None
 
+from diamond.handler.Handler import Handler
+from diamond.metric import MetricBatch
+from diamond.utils.dispatch import InlineHandlerWorker
+from diamond.utils.dispatch import reload_handler_workers
+from diamond.utils.dispatch import ReloadHandlers
 from diamond.utils.signals import signal_to_exception
 from diamond.utils.signals import SIGALRMException
 from diamond.utils.signals import SIGHUPException
 
 
-def collector_process(collector, metric_queue, log):
+def publish_collector_telemetry(telemetry, collectors, handlers):
+    """
+    Publish the telemetry of a collector process through handlers, along
+    with what the queue handlers of collectors dropped and the counter values
+    they keep
+    """
+    for collector in collectors:
+        dropped = sum(getattr(handler, 'dropped', 0)
+                      for handler in collector.handlers)
+        telemetry.counter(('collectors', collector.name, 'queue_dropped'),
+                          dropped)
+        counters = collector.last_values
+        telemetry.gauge(('collectors', collector.name, 'counters'),
+                        len(counters))
+        telemetry.counter(('collectors', collector.name, 'counters_expired'),
+                          counters.expired)
+        telemetry.counter(('collectors', collector.name, 'counters_evicted'),
+                          counters.evicted)
+    telemetry.publish(handlers)
+
+
+def collector_process(collector, metric_queue, log, telemetry=None):
     """
     """
     proc = multiprocessing.current_process()
@@ -30,6 +59,7 @@ def collector_process(collector, metric_queue, log):
     signal.signal(signal.SIGUSR2, signal_to_exception)
 
     interval = float(collector.config['interval'])
+    collector.telemetry = telemetry
 
     log.debug('Starting')
     log.debug('Interval: %s seconds', interval)
@@ -68,15 +98,23 @@ def collector_process(collector, metric_queue, log):
 
             # Ensure collector run times fit into the collection window
             signal.alarm(max_time)
+            collector.deadline = time.time() + max_time
 
             # Collect!
             collector._run()
 
             # Success! Disable the alarm
             signal.alarm(0)
+            collector.deadline = None
+
+            if telemetry is not None and telemetry.due():
+                publish_collector_telemetry(telemetry, [collector],
+                                            collector.handlers)
 
         except SIGALRMException:
             log.error('Took too long to run! Killed!')
+            if telemetry is not None:
+                telemetry.increment(('collectors', collector.name, 'killed'))
 
             # Adjust  the stagger_offset to allow for more time to run the
             # collector
@@ -100,17 +138,406 @@ def collector_process(collector, metric_queue, log):
             break
 
 
-def handler_process(handlers, metric_queue, log):
+class ScheduledCollector(object):
+    """
+    Scheduling state of a collector driven by CollectorScheduler
+    """
+
+    def __init__(self, collector, index, now):
+        self.collector = collector
+        self.index = index
+        self.name = collector.name
+        self.set_interval(float(collector.config['interval']), now)
+
+        # Current run
+        self.scheduled = None
+        self.started = None
+        self.deadline = None
+        self.worker = None
+        self.timed_out = False
+
+        # Counters
+        self.runs = 0
+        self.skipped = 0
+        self.late = 0
+        self.timeouts = 0
+
+    def set_interval(self, interval, now):
+        if interval <= 0:
+            raise ValueError('interval of %s is not valid!' % interval)
+        self.interval = interval
+        # Start the next execution at the next window plus some stagger delay
+        # to avoid having all collectors running at the same time
+        self.next_window = math.floor(now / interval) * interval
+        self.stagger_offset = random.uniform(0, max(interval - 1,
+                                                    interval / 2.0))
+        self.update_max_time()
+
+    def update_max_time(self):
+        # Allocate time till the end of the window for the collector to run.
+        # With a minimum of 1 second, or the interval if shorter
+        self.max_time = max(self.interval - self.stagger_offset,
+                            min(self.interval, 1))
+
+    def next_run(self):
+        return self.next_window + self.stagger_offset
+
+    def advance(self, now):
+        self.next_window += self.interval
+        if self.next_run() < now:
+            # clock has jumped or we fell behind, lets skip missed intervals
+            missed = int((now - self.next_run()) / self.interval) + 1
+            self.skipped += missed
+            self.next_window += missed * self.interval
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'late': self.late,
+            'timeouts': self.timeouts,
+        }
+
+
+class SchedulerWorker(object):
+    """
+    A worker thread, abandoned when stuck on a run past its deadline
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.abandoned = False
+        self.thread = None
+
+
+class CollectorScheduler(object):
+    """
+    Drive many collectors from a heap of next run times, running them on a
+    pool of worker threads.
+
+    Nothing relies on SIGALRM, so it works from any thread and at sub-second
+    intervals. A run has a deadline at the end of its window: the collector
+    sees it as collector.deadline to stop early on its own, and once it is
+    past the worker is abandoned to the run and replaced by a fresh one so the
+    other collectors keep their threads. A collector is never run twice at
+    the same time; runs falling due meanwhile are skipped and counted, as are
+    runs started late for lack of a free worker.
+    """
+
+    def __init__(self, collectors, threads, log, name='Scheduler',
+                 telemetry=None, telemetry_handlers=()):
+        self.log = log
+        self.name = name
+        self.telemetry = telemetry
+        self.telemetry_handlers = telemetry_handlers
+        self.threads = max(int(threads), 1)
+        self.jobs = Queue.Queue()
+        self.lock = threading.Lock()
+        self.entries = []
+        self.schedule = []
+        self.running = {}
+        self.workers = []
+        self.sequence = 0
+        self.stopped = False
+
+        now = time.time()
+        for collector in collectors:
+            self.add(collector, now)
+
+    def add(self, collector, now=None):
+        if now is None:
+            now = time.time()
+        try:
+            entry = ScheduledCollector(collector, len(self.entries), now)
+        except ValueError, e:
+            self.log.critical('%s: %s', collector.name, e)
+            return
+        collector.telemetry = self.telemetry
+        self.entries.append(entry)
+        heapq.heappush(self.schedule, (entry.next_run(), entry.index))
+
+    def stats(self):
+        return dict((entry.name, entry.stats()) for entry in self.entries)
+
+    def publish_telemetry(self):
+        """
+        Publish the telemetry of the pool along with the scheduler counters
+        """
+        for name, stats in self.stats().iteritems():
+            for key, value in stats.iteritems():
+                self.telemetry.counter(('collectors', name, key), value)
+        publish_collector_telemetry(
+            self.telemetry, [entry.collector for entry in self.entries],
+            self.telemetry_handlers)
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        while len(self.workers) < self.threads:
+            self._start_worker()
+
+    def _start_worker(self):
+        self.sequence += 1
+        worker = SchedulerWorker('%s-%d' % (self.name, self.sequence))
+        worker.thread = threading.Thread(name=worker.name, target=self._work,
+                                         args=(worker,))
+        worker.thread.daemon = True
+        self.workers.append(worker)
+        worker.thread.start()
+
+    def _work(self, worker):
+        while not worker.abandoned:
+            entry = self.jobs.get()
+            collector = entry.collector
+
+            now = time.time()
+            with self.lock:
+                entry.worker = worker
+                entry.started = now
+                entry.deadline = now + entry.max_time
+                entry.runs += 1
+                if now - entry.scheduled > min(entry.interval / 10.0, 1):
+                    entry.late += 1
+            collector.deadline = entry.deadline
+
+            try:
+                collector._run()
+            except Exception:
+                self.log.exception('%s: Collector failed!', entry.name)
+            finally:
+                collector.deadline = None
+                with self.lock:
+                    entry.worker = None
+                    entry.started = None
+                    entry.deadline = None
+                    del self.running[entry.name]
+
+    def _enforce_deadlines(self, now):
+        """
+        Replace the workers stuck on a run past its deadline
+        """
+        abandoned = 0
+        with self.lock:
+            for entry in self.running.values():
+                if ((entry.deadline is None or entry.timed_out or
+                     now < entry.deadline)):
+                    continue
+                self.log.error('%s: Took too long to run! Replacing its '
+                               'worker', entry.name)
+                entry.timed_out = True
+                entry.timeouts += 1
+                entry.worker.abandoned = True
+                self.workers.remove(entry.worker)
+                abandoned += 1
+
+                # Adjust the stagger_offset to allow for more time to run the
+                # collector
+                entry.stagger_offset *= 0.9
+                entry.update_max_time()
+        for i in range(abandoned):
+            self._start_worker()
+
+    def tick(self, now):
+        """
+        Dispatch the collectors due at now and enforce the deadlines.
+
+        :returns: the time of the next event to handle
+        """
+        self._enforce_deadlines(now)
+
+        while self.schedule and self.schedule[0][0] <= now:
+            next_run, index = heapq.heappop(self.schedule)
+            entry = self.entries[index]
+
+            with self.lock:
+                busy = entry.name in self.running
+                if not busy:
+                    self.running[entry.name] = entry
+                    entry.scheduled = now
+                    entry.timed_out = False
+
+            if busy:
+                self.log.warning('%s: Still running, skipping', entry.name)
+                entry.skipped += 1
+            else:
+                self.jobs.put(entry)
+
+            entry.advance(now)
+            heapq.heappush(self.schedule, (entry.next_run(), entry.index))
+
+        wake = [now + 60]
+        if self.schedule:
+            wake.append(self.schedule[0][0])
+        with self.lock:
+            for entry in self.running.values():
+                if entry.timed_out:
+                    continue
+                if entry.deadline is not None:
+                    wake.append(entry.deadline)
+                else:
+                    # Not started yet, the deadline will be later than this
+                    wake.append(now + entry.max_time)
+        return min(wake)
+
+    def reload(self):
+        """
+        Reload the config of the collectors and follow interval changes
+        """
+        now = time.time()
+        for entry in self.entries:
+            entry.collector.load_config()
+            interval = float(entry.collector.config['interval'])
+            if interval == entry.interval:
+                continue
+            try:
+                entry.set_interval(interval, now)
+            except ValueError, e:
+                self.log.critical('%s: %s', entry.name, e)
+                continue
+        self.schedule = [(entry.next_run(), entry.index)
+                         for entry in self.entries]
+        heapq.heapify(self.schedule)
+
+    def stop(self):
+        """
+        Make run return once the current tick is done, runs in progress are
+        left to finish on their own
+        """
+        self.stopped = True
+
+    def run(self):
+        """
+        Run the collectors until stopped
+        """
+        self.start()
+        while self.schedule and not self.stopped:
+            wake = self.tick(time.time())
+            if self.telemetry is not None:
+                if self.telemetry.due():
+                    self.publish_telemetry()
+                wake = min(wake, self.telemetry.next_publish)
+            time_to_sleep = wake - time.time()
+            if time_to_sleep > 0:
+                time.sleep(min(time_to_sleep, 1))
+
+
+def collector_pool_process(collectors, metric_queue, log, threads=4,
+                           telemetry=None, telemetry_handler=None):
+    """
+    Run many collectors on a pool of threads in a single process. The pool
+    publishes its telemetry through a queue handler of its own.
+    """
+    proc = multiprocessing.current_process()
+    if setproctitle:
+        setproctitle('%s - %s' % (getproctitle(), proc.name))
+
+    signal.signal(signal.SIGHUP, signal_to_exception)
+
+    log.debug('Starting %d collectors on %d threads',
+              len(collectors), threads)
+
+    telemetry_handlers = []
+    if telemetry_handler is not None:
+        telemetry_handlers.append(telemetry_handler)
+    scheduler = CollectorScheduler(collectors, threads, log, name=proc.name,
+                                   telemetry=telemetry,
+                                   telemetry_handlers=telemetry_handlers)
+
+    # Setup stderr/stdout as /dev/null so random print statements in thrid
+    # party libs do not fail and prevent collectors from running.
+    sys.stdout = open(os.devnull, 'w')
+    sys.stderr = open(os.devnull, 'w')
+
+    while True:
+        try:
+            scheduler.run()
+            break
+        except SIGHUPException:
+            log.info('Reloading config reload due to HUP')
+            scheduler.reload()
+            log.info('Config reloaded')
+
+
+def publish_handler_telemetry(telemetry, workers, metric_queue):
+    """
+    Publish the telemetry of the handler process to every handler
+    """
+    for worker in workers:
+        stats = worker.stats()
+        telemetry.gauge(('handlers', worker.name, 'queue_depth'),
+                        stats['queue_depth'])
+        telemetry.counter(('handlers', worker.name, 'dropped'),
+                          stats['dropped'])
+        telemetry.counter(('handlers', worker.name, 'errors'),
+                          stats['errors'])
+        for key, value in worker.handler_stats().iteritems():
+            telemetry.gauge(('handlers', worker.name, key), value)
+    for key, value in metric_queue.stats().iteritems():
+        telemetry.gauge(('transport', key), value)
+
+    metrics = telemetry.collect()
+    for worker in workers:
+        worker.put(metrics, True)
+
+
+def handler_process(handlers, metric_queue, log, telemetry=None):
     proc = multiprocessing.current_process()
     if setproctitle:
         setproctitle('%s - %s' % (getproctitle(), proc.name))
 
     log.debug('Starting process %s', proc.name)
 
+    # Plain handlers are processed inline
+    workers = []
+    for handler in handlers:
+        if isinstance(handler, Handler):
+            handler = InlineHandlerWorker(handler, log)
+        handler.telemetry = telemetry
+        workers.append(handler)
+
+    for worker in workers:
+        worker.start()
+
     while(True):
-        metric = metric_queue.get(block=True, timeout=None)
-        for handler in handlers:
-            if metric is not None:
-                handler._process(metric)
-            else:
-                handler._flush()
+        # Send the batches of the handlers that waited long enough and wake
+        # up in time for the next ones
+        now = time.time()
+        timeout = None
+        for worker in workers:
+            deadline = worker.deadline()
+            if deadline is not None and deadline <= now:
+                worker.tick(now)
+                deadline = worker.deadline()
+            if deadline is not None:
+                wait = max(0, deadline - now)
+                if timeout is None or wait < timeout:
+                    timeout = wait
+
+        if telemetry is not None:
+            if telemetry.due(now):
+                publish_handler_telemetry(telemetry, workers, metric_queue)
+            wait = max(0, telemetry.next_publish - now)
+            if timeout is None or wait < timeout:
+                timeout = wait
+
+        try:
+            metric = metric_queue.get(block=True, timeout=timeout)
+        except Queue.Empty:
+            continue
+        if isinstance(metric, ReloadHandlers):
+            workers = reload_handler_workers(workers, metric, log, telemetry)
+            continue
+        if isinstance(metric, MetricBatch):
+            metrics, flush = metric.metrics, metric.flush
+        elif metric is None:
+            metrics, flush = [], True
+        else:
+            metrics, flush = [metric], False
+
+        for worker in workers:
+            worker.put(metrics, flush)
+
+        if flush:
+            for worker in workers:
+                log.debug('Handler %s: %s', worker.name, worker.stats())
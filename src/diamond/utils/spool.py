@@ -0,0 +1,260 @@
+# coding=utf-8
+
+"""
+A write-ahead spool handlers can park data in while their backend is down.
+
+Records are opaque strings appended to segment files in a directory. Segments
+are capped in size, the spool as a whole in size and age (the oldest segments
+are dropped first) and the spooled records are replayed oldest first at a
+limited rate once the backend accepts data again.
+"""
+
+import logging
+import os
+import struct
+import time
+
+SPOOL_DEFAULT_CONFIG = {
+    'spool_path': '',
+    'spool_segment_size': 1048576,
+    'spool_max_size': 104857600,
+    'spool_max_age': 86400,
+    'spool_replay_rate': 1000,
+}
+
+SPOOL_DEFAULT_CONFIG_HELP = {
+    'spool_path': 'Directory to spool data to while the backend is down. '
+                  'Disabled when empty',
+    'spool_segment_size': 'Size in bytes of a spool segment file',
+    'spool_max_size': 'Maximum size in bytes of the spool, the oldest data '
+                      'is dropped first',
+    'spool_max_age': 'Spooled data older than this many seconds is dropped',
+    'spool_replay_rate': 'How many spooled records to replay per second once '
+                         'the backend is back',
+}
+
+
+class Spool(object):
+    """
+    Append-only segment files with a persisted replay position
+    """
+
+    SUFFIX = '.spool'
+    OFFSET_FILE = 'replay.offset'
+    RECORD = struct.Struct('!I')
+
+    def __init__(self, path, segment_size=1048576, max_size=104857600,
+                 max_age=86400, replay_rate=1000, log=None):
+        if log is None:
+            self.log = logging.getLogger('diamond')
+        else:
+            self.log = log
+
+        self.path = path
+        self.segment_size = int(segment_size)
+        self.max_size = int(max_size)
+        self.max_age = float(max_age)
+        self.replay_rate = float(replay_rate)
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Segments left by a previous run are replayed, new data always goes
+        # to a new segment
+        self.segments = sorted(f for f in os.listdir(self.path)
+                               if f.endswith(self.SUFFIX))
+        self.sequence = 0
+        if self.segments:
+            self.sequence = int(self.segments[-1].split('-')[1].split('.')[0])
+
+        # Size of each segment, kept up to date instead of asking the disk
+        self.sizes = {}
+        for segment in self.segments:
+            try:
+                self.sizes[segment] = os.path.getsize(
+                    os.path.join(self.path, segment))
+            except OSError:
+                self.sizes[segment] = 0
+        self.total_size = sum(self.sizes.itervalues())
+
+        self.writer = None
+        self.writer_segment = None
+        self.writer_size = 0
+
+        self.read_segment, self.read_offset = self._load_offset()
+        self.pending_offset = None
+
+        self.last_replay = time.time()
+        self.tokens = 0.0
+
+    def __len__(self):
+        """
+        Number of segments holding data
+        """
+        return len(self.segments)
+
+    def size(self):
+        """
+        Total size in bytes of the segments
+        """
+        return self.total_size
+
+    def _load_offset(self):
+        try:
+            with open(os.path.join(self.path, self.OFFSET_FILE)) as f:
+                segment, offset = f.read().split()
+                if segment in self.segments:
+                    return segment, int(offset)
+        except (IOError, ValueError):
+            pass
+        return None, 0
+
+    def _save_offset(self):
+        filename = os.path.join(self.path, self.OFFSET_FILE)
+        if self.read_segment is None:
+            if os.path.exists(filename):
+                os.unlink(filename)
+            return
+        with open(filename + '.tmp', 'w') as f:
+            f.write('%s %d\n' % (self.read_segment, self.read_offset))
+        os.rename(filename + '.tmp', filename)
+
+    def _segment_time(self, segment):
+        return int(segment.split('-')[0]) / 1000.0
+
+    def _remove(self, segment):
+        if segment == self.writer_segment:
+            self.writer.close()
+            self.writer = None
+            self.writer_segment = None
+        if segment == self.read_segment:
+            self.read_segment = None
+            self.read_offset = 0
+        self.segments.remove(segment)
+        self.total_size -= self.sizes.pop(segment, 0)
+        try:
+            os.unlink(os.path.join(self.path, segment))
+        except OSError:
+            pass
+
+    def _rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.sequence += 1
+        self.writer_segment = '%013d-%06d%s' % (int(time.time() * 1000),
+                                                self.sequence, self.SUFFIX)
+        self.writer = open(os.path.join(self.path, self.writer_segment), 'ab')
+        self.writer_size = 0
+        self.segments.append(self.writer_segment)
+        self.sizes[self.writer_segment] = 0
+
+    def _expire(self):
+        """
+        Drop the oldest segments past the age or size caps
+        """
+        oldest = time.time() - self.max_age
+        while self.segments and (
+                self._segment_time(self.segments[0]) < oldest and
+                self.segments[0] != self.writer_segment):
+            self.log.warning('Spool %s: dropping expired segment %s',
+                             self.path, self.segments[0])
+            self._remove(self.segments[0])
+
+        while len(self.segments) > 1 and self.total_size > self.max_size:
+            self.log.warning('Spool %s: full, dropping segment %s',
+                             self.path, self.segments[0])
+            self._remove(self.segments[0])
+
+    def append(self, records):
+        """
+        Spool a list of strings
+        """
+        if not records:
+            return
+        rotated = False
+        for record in records:
+            data = self.RECORD.pack(len(record)) + record
+            if (self.writer is None or
+                    self.writer_size + len(data) > self.segment_size):
+                if self.writer is not None:
+                    self.sizes[self.writer_segment] = self.writer_size
+                self._rotate()
+                rotated = True
+            self.writer.write(data)
+            self.writer_size += len(data)
+            self.total_size += len(data)
+        self.sizes[self.writer_segment] = self.writer_size
+        self.writer.flush()
+
+        # The caps only need checking once a segment is done or the spool
+        # grew past its size
+        if rotated or self.total_size > self.max_size:
+            self._expire()
+
+    def read(self, limit):
+        """
+        Return up to limit of the oldest records, without consuming them
+        """
+        self.pending_offset = None
+        if not self.segments:
+            return []
+
+        segment = self.segments[0]
+        offset = self.read_offset if segment == self.read_segment else 0
+        if segment == self.writer_segment:
+            self.writer.flush()
+
+        records = []
+        with open(os.path.join(self.path, segment), 'rb') as f:
+            f.seek(offset)
+            while len(records) < limit:
+                header = f.read(self.RECORD.size)
+                if len(header) < self.RECORD.size:
+                    break
+                length = self.RECORD.unpack(header)[0]
+                record = f.read(length)
+                if len(record) < length:
+                    # Truncated by a crash while writing
+                    break
+                records.append(record)
+                offset += self.RECORD.size + length
+            exhausted = (len(records) < limit or
+                         offset >= os.fstat(f.fileno()).st_size)
+
+        self.pending_offset = (segment, offset, exhausted)
+        return records
+
+    def ack(self):
+        """
+        Consume the records returned by the last read
+        """
+        if self.pending_offset is None:
+            return
+        segment, offset, exhausted = self.pending_offset
+        self.pending_offset = None
+
+        if exhausted:
+            self._remove(segment)
+        else:
+            self.read_segment = segment
+            self.read_offset = offset
+        self._save_offset()
+
+    def replay(self, send):
+        """
+        Hand spooled records to send, within the replay rate. send returns
+        whether the records made it to the backend.
+        """
+        now = time.time()
+        self.tokens = min(self.replay_rate,
+                          self.tokens + (now - self.last_replay) *
+                          self.replay_rate)
+        self.last_replay = now
+
+        while self.segments and self.tokens >= 1:
+            records = self.read(int(self.tokens))
+            if records and not send(records):
+                return False
+            self.tokens -= len(records)
+            self.ack()
+        return True
@@ -0,0 +1,231 @@
+# coding=utf-8
+
+"""
+Diamond's own health metrics, published like any other metric under
+<telemetry_prefix>.<hostname> when the telemetry option of the [server]
+section is enabled:
+
+ * collectors.<name>.run_time_ms and .metrics, percentiles of the run times
+   and of the metrics published per run
+ * collectors.<name>.killed, runs stopped by SIGALRM, or .timeouts, .skipped,
+   .late and .runs for collectors running in a pool
+ * collectors.<name>.queue_dropped, metrics dropped on a full metric queue
+ * collectors.<name>.counters, the counter values kept for derivatives, and
+   .counters_expired and .counters_evicted, those forgotten after counter_ttl
+   runs or above max_counters
+ * transport.*, what waits between the collectors and the handler process
+ * handlers.<name>.process_time_ms and .flush_time_ms, .errors,
+   .queue_depth and .dropped
+ * processes.<name>.rss_bytes, the resident memory of every process
+
+Every process records into a Telemetry object of its own and publishes what it
+recorded every telemetry_interval seconds.
+"""
+
+import os
+import platform
+import random
+import re
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from diamond.collector import get_hostname
+from diamond.collector import str_to_bool
+from diamond.metric import Metric
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_rss():
+    """
+    Resident memory of the current process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # Peak rather than current, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+class Histogram(object):
+    """
+    The distribution of a value over a telemetry interval, from a bounded
+    uniform sample of the recorded values
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            index = random.randint(0, self.count - 1)
+            if index < self.size:
+                self.samples[index] = value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        summary = {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': float(self.total) / self.count,
+        }
+        for percentile in PERCENTILES:
+            index = int(round(percentile / 100.0 * (len(samples) - 1)))
+            summary['p%d' % percentile] = samples[index]
+        return summary
+
+
+class Telemetry(object):
+    """
+    Record histograms, counters and gauges keyed by tuples of path parts and
+    turn them into metrics once per interval. Safe to use from many threads.
+    """
+
+    def __init__(self, name, prefix='diamond', hostname=None, interval=60):
+        self.name = name
+        self.hostname = hostname
+        self.interval = float(interval)
+        self.prefix = '.'.join(part for part in (prefix, hostname) if part)
+
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.paths = {}
+        self.next_publish = time.time() + self.interval
+
+    def record(self, key, value):
+        """
+        Add a value to the histogram of key
+        """
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(value)
+
+    def increment(self, key, value=1):
+        """
+        Add to the counter of key, counters are never reset
+        """
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, key, value):
+        """
+        Set the counter of key from a count kept elsewhere
+        """
+        with self.lock:
+            self.counters[key] = value
+
+    def gauge(self, key, value):
+        """
+        Set the value of key for this interval
+        """
+        with self.lock:
+            self.gauges[key] = value
+
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.next_publish
+
+    def _path(self, key):
+        path = self.paths.get(key)
+        if path is None:
+            parts = [re.sub(r'[^\w-]', '_', str(part)) for part in key]
+            if self.prefix:
+                parts.insert(0, self.prefix)
+            path = self.paths[key] = '.'.join(parts)
+        return path
+
+    def _metric(self, key, value, timestamp, metric_type='GAUGE',
+                precision=0):
+        return Metric(self._path(key), value, timestamp=timestamp,
+                      precision=precision, host=self.hostname,
+                      metric_type=metric_type)
+
+    def collect(self, now=None):
+        """
+        Return the metrics recorded so far and start a new interval
+        """
+        if now is None:
+            now = time.time()
+        self.gauge(('processes', self.name, 'rss_bytes'), get_rss())
+
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+            gauges, self.gauges = self.gauges, {}
+            counters = self.counters.items()
+            self.next_publish = now + self.interval
+
+        timestamp = int(now)
+        metrics = []
+        for key, histogram in sorted(histograms.iteritems()):
+            for stat, value in sorted(histogram.summary().iteritems()):
+                metrics.append(self._metric(key + (stat,), value, timestamp,
+                                            precision=3))
+        for key, value in sorted(counters):
+            metrics.append(self._metric(key, value, timestamp,
+                                        metric_type='COUNTER'))
+        for key, value in sorted(gauges.iteritems()):
+            if value is not None:
+                metrics.append(self._metric(key, value, timestamp))
+        return metrics
+
+    def publish(self, handlers, now=None):
+        """
+        Hand the metrics recorded so far to handlers and flush them
+        """
+        metrics = self.collect(now)
+        for handler in handlers:
+            handler._process_many(metrics)
+            handler._flush()
+        return metrics
+
+
+def create_telemetry(config, name):
+    """
+    Return the Telemetry of the process name, None when it is disabled
+    """
+    server = config.get('server', {})
+    if not str_to_bool(server.get('telemetry', False)):
+        return None
+
+    try:
+        hostname = get_hostname(config.get('collectors', {}).get('default',
+                                                                 {}))
+    except Exception:
+        hostname = platform.node().split('.')[0]
+
+    return Telemetry(name, prefix=server.get('telemetry_prefix', 'diamond'),
+                     hostname=hostname,
+                     interval=server.get('telemetry_interval', 60))
@@ -0,0 +1,333 @@
+# coding=utf-8
+
+"""
+Transports carry metrics from the collector processes to the handler process.
+
+The transport is selected with the `metric_transport` option of the [server]
+section. Collector processes only ever see a producer (an object with a
+Queue-like non blocking `put`) while the handler process drains the transport
+with `get`.
+"""
+
+import mmap
+import multiprocessing
+import Queue
+import struct
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle as pickle
+
+try:
+    from setproctitle import getproctitle, setproctitle
+except ImportError:
+    setproctitle = None
+
+from diamond.error import DiamondException
+
+TRANSPORTS = {
+    'manager': 'diamond.utils.transport.ManagerQueueTransport',
+    'ring_buffer': 'diamond.utils.transport.RingBufferTransport',
+}
+
+
+class MetricTransport(object):
+    """
+    Base class for the collector -> handler metric transports
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def producer(self, name):
+        """
+        Return the queue like object the collector process `name` puts its
+        metrics on
+        """
+        raise NotImplementedError
+
+    def release(self, name, process=None):
+        """
+        The collector process `name` has been stopped. When given, process
+        may still be exiting, what it produced to is not reused before it is
+        dead.
+        """
+        pass
+
+    def get(self, block=True, timeout=None):
+        """
+        Return the next item sent by any producer
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Gauges of what waits in the transport, as seen by the consumer
+        """
+        return {}
+
+
+class ManagerQueueTransport(MetricTransport):
+    """
+    A single Queue proxied through a multiprocessing SyncManager
+    """
+
+    def __init__(self, config):
+        MetricTransport.__init__(self, config)
+
+        self.maxsize = int(self.config.get('metric_queue_size', 16384))
+
+        # We do this weird process title swap around to get the sync manager
+        # title correct for ps
+        if setproctitle:
+            oldproctitle = getproctitle()
+            setproctitle('%s - SyncManager' % getproctitle())
+        self.manager = multiprocessing.Manager()
+        if setproctitle:
+            setproctitle(oldproctitle)
+
+        self.queue = self.manager.Queue(maxsize=self.maxsize)
+
+    def producer(self, name):
+        return self.queue
+
+    def get(self, block=True, timeout=None):
+        return self.queue.get(block=block, timeout=timeout)
+
+    def stats(self):
+        try:
+            return {'queue_depth': self.queue.qsize()}
+        except NotImplementedError:
+            return {}
+
+
+class RingBuffer(object):
+    """
+    A single producer, single consumer ring of length prefixed pickles living
+    in shared memory.
+
+    The header holds two monotonically increasing byte counters: `head` is only
+    ever written by the producer, `tail` only by the consumer, so no lock is
+    required between them.
+    """
+
+    HEADER_SIZE = 128
+    TAIL_OFFSET = 64
+    COUNTER = struct.Struct('Q')
+    LENGTH = struct.Struct('!I')
+
+    def __init__(self, buf, offset, size, doorbell=None):
+        self.buf = buf
+        self.offset = offset
+        self.data = offset + self.HEADER_SIZE
+        self.size = size
+        self.doorbell = doorbell
+
+    def _head(self):
+        return self.COUNTER.unpack_from(self.buf, self.offset)[0]
+
+    def _tail(self):
+        return self.COUNTER.unpack_from(self.buf,
+                                        self.offset + self.TAIL_OFFSET)[0]
+
+    def _write(self, position, data):
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        self.buf[self.data + start:self.data + start + first] = data[:first]
+        if first < len(data):
+            self.buf[self.data:self.data + len(data) - first] = data[first:]
+
+    def _read(self, position, length):
+        start = position % self.size
+        first = min(length, self.size - start)
+        data = self.buf[self.data + start:self.data + start + first]
+        if first < length:
+            data += self.buf[self.data:self.data + length - first]
+        return data
+
+    def put(self, item, block=False, timeout=None):
+        """
+        Append an item to the ring, raising Queue.Full if it does not fit
+        """
+        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        record = self.LENGTH.pack(len(data)) + data
+
+        if len(record) > self.size:
+            raise Queue.Full
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            head = self._head()
+            if len(record) <= self.size - (head - self._tail()):
+                break
+            if not block or (timeout is not None and time.time() > deadline):
+                raise Queue.Full
+            time.sleep(0.001)
+
+        self._write(head, record)
+        # Publishing the new head makes the record visible to the consumer
+        self.COUNTER.pack_into(self.buf, self.offset, head + len(record))
+
+        if self.doorbell is not None:
+            self.doorbell()
+
+    def drain(self):
+        """
+        Return every item currently in the ring
+        """
+        head = self._head()
+        tail = self._tail()
+        items = []
+        while tail < head:
+            length = self.LENGTH.unpack(self._read(tail, self.LENGTH.size))[0]
+            data = self._read(tail + self.LENGTH.size, length)
+            tail += self.LENGTH.size + length
+            items.append(pickle.loads(data))
+        self.COUNTER.pack_into(self.buf, self.offset + self.TAIL_OFFSET, tail)
+        return items
+
+    def queued_bytes(self):
+        return self._head() - self._tail()
+
+
+class RingBufferTransport(MetricTransport):
+    """
+    One shared memory ring buffer per collector process, drained by the
+    handler process.
+
+    Producers never talk to another process: a put is a pickle and a memory
+    copy. The handler process sleeps on a semaphore that producers only signal
+    when it announced it is waiting.
+    """
+
+    # Global header: the consumer's waiting flag and, on its own cache line,
+    # the number of ring slots handed out by the server
+    HEADER_SIZE = 128
+    USED_OFFSET = 64
+    COUNTER = struct.Struct('Q')
+
+    def __init__(self, config):
+        MetricTransport.__init__(self, config)
+
+        self.ring_size = int(self.config.get('metric_ring_buffer_size',
+                                             1048576))
+        self.slots = int(self.config.get('metric_ring_buffer_slots', 128))
+        self.poll_interval = float(self.config.get(
+            'metric_ring_buffer_poll_interval', 0.1))
+
+        stride = RingBuffer.HEADER_SIZE + self.ring_size
+        self.buf = mmap.mmap(-1, self.HEADER_SIZE + self.slots * stride)
+        self.semaphore = multiprocessing.Semaphore(0)
+
+        self.rings = [
+            RingBuffer(self.buf, self.HEADER_SIZE + slot * stride,
+                       self.ring_size, doorbell=self._doorbell)
+            for slot in range(self.slots)]
+
+        # Bookkeeping of the server process: the slot of each producer, and
+        # the slots of released producers that may still be exiting
+        self.assigned = {}
+        self.retired = {}
+
+        # State of the consumer
+        self.pending = []
+        self.cursor = 0
+
+    def _waiting(self):
+        return self.COUNTER.unpack_from(self.buf, 0)[0]
+
+    def _set_waiting(self, waiting):
+        self.COUNTER.pack_into(self.buf, 0, waiting)
+
+    def _used(self):
+        return self.COUNTER.unpack_from(self.buf, self.USED_OFFSET)[0]
+
+    def _doorbell(self):
+        if self._waiting():
+            self._set_waiting(0)
+            self.semaphore.release()
+
+    def producer(self, name):
+        if name in self.assigned:
+            return self.rings[self.assigned[name]]
+
+        # A ring only ever has one producer, a released slot waits until its
+        # last producer is gone
+        for slot, process in self.retired.items():
+            if not process.is_alive():
+                del self.retired[slot]
+
+        free = (set(range(self.slots)) - set(self.assigned.values()) -
+                set(self.retired))
+        if not free:
+            raise DiamondException(
+                'No free metric ring buffer for %s, increase '
+                'metric_ring_buffer_slots' % name)
+
+        slot = min(free)
+        self.assigned[name] = slot
+
+        if slot >= self._used():
+            self.COUNTER.pack_into(self.buf, self.USED_OFFSET, slot + 1)
+
+        return self.rings[slot]
+
+    def release(self, name, process=None):
+        # Anything left in the ring is still drained by the handler process
+        slot = self.assigned.pop(name, None)
+        if slot is not None and process is not None and process.is_alive():
+            self.retired[slot] = process
+
+    def stats(self):
+        return {
+            'queue_depth': len(self.pending),
+            'queued_bytes': sum(ring.queued_bytes()
+                                for ring in self.rings[:self._used()]),
+        }
+
+    def _poll(self):
+        """
+        Refill the pending items from the next ring that has data
+        """
+        used = self._used()
+        for i in range(used):
+            slot = (self.cursor + i) % used
+            items = self.rings[slot].drain()
+            if items:
+                self.cursor = slot + 1
+                items.reverse()
+                self.pending = items
+                return True
+        return False
+
+    def get(self, block=True, timeout=None):
+        if self.pending or self._poll():
+            return self.pending.pop()
+
+        if not block:
+            raise Queue.Empty
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            # Announce we are going to sleep and check again to not miss a
+            # producer that committed in the meantime
+            self._set_waiting(1)
+            if self._poll():
+                self._set_waiting(0)
+                return self.pending.pop()
+
+            wait = self.poll_interval
+            if timeout is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    raise Queue.Empty
+            self.semaphore.acquire(True, wait)
+
+            if self._poll():
+                return self.pending.pop()
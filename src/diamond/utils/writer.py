@@ -0,0 +1,233 @@
+# coding=utf-8
+
+"""
+A socket writer running in a thread of its own, so handlers can hand data off
+without ever blocking on the network.
+
+Data is kept in a buffer capped in bytes, the oldest data is dropped first
+when it is full. The thread writes the buffer out with non-blocking sends,
+picking up partial writes where they left off, and reconnects with an
+exponential backoff when the connection fails.
+"""
+
+import collections
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+
+class BackgroundWriter(object):
+    """
+    Write strings to the socket returned by connect from a background thread
+    """
+
+    def __init__(self, connect, max_buffer=16777216, backoff=1,
+                 max_backoff=60, reconnect_interval=0, name='writer',
+                 log=None):
+        if log is None:
+            self.log = logging.getLogger('diamond')
+        else:
+            self.log = log
+
+        self.connect = connect
+        self.max_buffer = int(max_buffer)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.reconnect_interval = float(reconnect_interval)
+        self.name = name
+
+        self.socket = None
+        self.connected_at = None
+        self.retry_at = 0
+        self.retry_backoff = self.backoff
+
+        # (data, queued at) chunks, the first one is sent from offset on
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.sending = False
+        self.bytes_queued = 0
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.flush_latency = 0
+
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        if self.pid is not None:
+            # Forked since started, the thread and its lock stayed behind
+            self.condition = threading.Condition()
+            self.socket = None
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self._close()
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    def write(self, data):
+        """
+        Queue data to be sent, never blocks.
+
+        :returns: the chunks dropped to make room, oldest first
+        """
+        dropped = []
+        if not data:
+            return dropped
+        if self.pid != os.getpid():
+            # Handlers are created before the handler process forks, the
+            # thread is started by the process writing
+            self.start()
+        with self.condition:
+            # The first chunk may be partly written already and stays
+            busy = 1 if self.offset or self.sending else 0
+            while (len(self.chunks) > busy and
+                   self.bytes_queued + len(data) > self.max_buffer):
+                index = busy
+                chunk = self.chunks[index][0]
+                del self.chunks[index]
+                self.bytes_queued -= len(chunk)
+                dropped.append(chunk)
+            if self.bytes_queued + len(data) > self.max_buffer:
+                dropped.append(data)
+            else:
+                self.chunks.append((data, time.time()))
+                self.bytes_queued += len(data)
+                self.condition.notify()
+            self.bytes_dropped += sum(len(chunk) for chunk in dropped)
+        return dropped
+
+    def has_room(self, size):
+        """
+        Whether size bytes can be written without dropping anything
+        """
+        with self.condition:
+            return self.bytes_queued + size <= self.max_buffer
+
+    def stats(self):
+        """
+        Bytes waiting to be sent, bytes sent and dropped so far and how long
+        the last chunk written waited to be sent out
+        """
+        with self.condition:
+            return {
+                'bytes_queued': self.bytes_queued,
+                'bytes_sent': self.bytes_sent,
+                'bytes_dropped': self.bytes_dropped,
+                'flush_latency': self.flush_latency,
+            }
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and not self.chunks:
+                    self.condition.wait(1)
+                    self._check_reconnect_interval()
+                if self.stopped:
+                    return
+
+            if self.socket is None:
+                if not self._connect():
+                    with self.condition:
+                        if not self.stopped:
+                            self.condition.wait(
+                                max(0, self.retry_at - time.time()))
+                    continue
+            self._write()
+
+    def _check_reconnect_interval(self):
+        if ((self.reconnect_interval > 0 and self.socket is not None and
+             not self.chunks and
+             time.time() > self.connected_at + self.reconnect_interval)):
+            self._close()
+
+    def _connect(self):
+        if time.time() < self.retry_at:
+            return False
+        try:
+            sock = self.connect()
+        except Exception, ex:
+            self.log.debug('%s: Failed to connect: %s', self.name, ex)
+            sock = None
+        if sock is None:
+            self.retry_at = time.time() + self.retry_backoff
+            self.log.debug('%s: Not connected, retrying in %.1fs',
+                           self.name, self.retry_backoff)
+            self.retry_backoff = min(self.retry_backoff * 2,
+                                     self.max_backoff)
+            return False
+        sock.setblocking(0)
+        self.socket = sock
+        self.connected_at = time.time()
+        self.retry_backoff = self.backoff
+        return True
+
+    def _close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+        self.socket = None
+        # A chunk cut off mid way is sent again in full over the next
+        # connection rather than as a torn line
+        with self.condition:
+            self.offset = 0
+
+    def _write(self):
+        """
+        Write out as much of the buffer as the socket takes within a second
+        """
+        try:
+            ready = select.select([], [self.socket], [], 1)[1]
+        except (select.error, socket.error, ValueError), ex:
+            self.log.warning('%s: Socket error: %s', self.name, ex)
+            self._close()
+            return
+        if not ready:
+            return
+
+        with self.condition:
+            if not self.chunks:
+                return
+            data, queued_at = self.chunks[0]
+            offset = self.offset
+            self.sending = True
+
+        try:
+            sent = self.socket.send(buffer(data, offset))
+        except socket.error, ex:
+            self.sending = False
+            if ex.args and ex.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                          errno.EINTR):
+                return
+            self.log.warning('%s: Failed sending data: %s', self.name, ex)
+            self._close()
+            self.retry_at = time.time() + self.retry_backoff
+            return
+
+        with self.condition:
+            self.sending = False
+            self.bytes_sent += sent
+            self.offset += sent
+            if self.offset >= len(data):
+                self.chunks.popleft()
+                self.bytes_queued -= len(data)
+                self.offset = 0
+                self.flush_latency = time.time() - queued_at
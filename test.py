@@ -134,14 +134,31 @@ class CollectorTestCase(unittest.TestCase):
     def assertUnpublished(self, mock, key, value, expected_value=0):
         return self.assertPublished(mock, key, value, expected_value)
 
+    def getPublishedArgs(self, mock):
+        """
+        The positional arguments of the calls to a mocked publish, with the
+        calls to a mocked publish_many or publish_counters expanded into one
+        (name, value) per metric
+        """
+        published = []
+        for args, kwargs in mock.call_args_list:
+            if isinstance(args[0], dict):
+                published.extend(args[0].iteritems())
+            elif isinstance(args[0], (list, tuple)):
+                published.extend(args[0])
+            else:
+                published.append(args)
+        return published
+
     def assertPublished(self, mock, key, value, expected_value=1):
         if type(mock) is list:
             for m in mock:
-                calls = (filter(lambda x: x[0][0] == key, m.call_args_list))
+                calls = filter(lambda x: x[0] == key,
+                               self.getPublishedArgs(m))
                 if len(calls) > 0:
                     break
         else:
-            calls = filter(lambda x: x[0][0] == key, mock.call_args_list)
+            calls = filter(lambda x: x[0] == key, self.getPublishedArgs(mock))
 
         actual_value = len(calls)
         message = '%s: actual number of calls %d, expected %d' % (
@@ -150,7 +167,7 @@ class CollectorTestCase(unittest.TestCase):
         self.assertEqual(actual_value, expected_value, message)
 
         if expected_value:
-            actual_value = calls[0][0][1]
+            actual_value = calls[0][1]
             expected_value = value
             precision = 0
 